@@ -0,0 +1,154 @@
+import time
+import logging
+import os
+from collections import deque
+import alert_engine
+import upstream
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Adaptive polling tuning (overridable from the environment)
+# Polling faster than the fetch cache expires would only return the cached response
+MIN_INTERVAL = float(os.getenv("MOODCAST_POLL_MIN_INTERVAL", upstream.FETCH_CACHE_TTL))
+MAX_INTERVAL = float(os.getenv("MOODCAST_POLL_MAX_INTERVAL", "900"))
+BACKOFF = float(os.getenv("MOODCAST_POLL_BACKOFF", "1.5"))        # interval factor per unchanged poll
+# Fraction of an alert threshold at which a location counts as trending
+TREND_FRACTION = float(os.getenv("MOODCAST_POLL_TREND_FRACTION", "0.5"))
+UPDATE_SLACK = 15            # seconds after the expected upstream update before polling
+TREND_WINDOW = 3600          # seconds of readings kept for trend checks
+MIN_TREND_HOURS = 0.25       # rates over shorter spans are measured as if over this long
+
+# Smallest difference per field that counts as a change
+CHANGE_THRESHOLDS = {
+    'temp': 0.3,
+    'humidity': 2,
+    'pressure': 0.5,
+    'wind_speed': 0.5,
+    'clouds': 5,
+    'rain': 0.1
+}
+
+class AdaptiveSchedule:
+    """Polling interval for one location, driven by how its data behaves.
+
+    observe() is called after each poll with the reading and, when the
+    upstream reports one, the time of its observation (e.g. OpenWeatherMap
+    dt). The interval grows by BACKOFF while readings stay static or the
+    upstream has not published anything new and shrinks back to base when
+    they change. Only while a condition that alert_engine alerts on is
+    building (fast temperature change, falling pressure, wind, rain or
+    cloud cover approaching their thresholds) does it drop below base, to
+    min_interval.
+    Once the upstream update cadence is known, polls of static data are
+    timed to just after the next expected update.
+
+    saved() compares the polls made against polling every base seconds;
+    it goes negative when trending polls made more calls than that.
+    """
+
+    def __init__(self, base, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, backoff=BACKOFF):
+        self.base = base
+        self.min_interval = min(min_interval, base)
+        self.max_interval = max(max_interval, base)
+        self.backoff = backoff
+        self.interval = base
+        self.started = time.monotonic()
+        self.polls = 0
+        self.trending = False
+        self._last = None
+        self._history = deque()
+        self._observed_at = None
+        self._cadence = None
+
+    def observe(self, reading=None, observed_at=None, now=None):
+        """Record one poll result and return the seconds until the next poll."""
+        now = now or time.time()
+        self.polls += 1
+        fresh = observed_at is None or observed_at != self._observed_at
+        if observed_at is not None and self._observed_at is not None and observed_at > self._observed_at:
+            gap = observed_at - self._observed_at
+            # Smoothed upstream update cadence
+            self._cadence = gap if self._cadence is None else 0.7 * self._cadence + 0.3 * gap
+        if observed_at is not None and (self._observed_at is None or observed_at > self._observed_at):
+            self._observed_at = observed_at
+
+        first = self._last is None
+        if reading:
+            changed = fresh and self._changed(reading)
+            self._last = reading
+            self._history.append((now, reading))
+            while self._history and self._history[0][0] < now - TREND_WINDOW:
+                self._history.popleft()
+            self.trending = self._trending()
+        else:
+            changed = False
+
+        if first and reading and not self.trending:
+            # Nothing to compare with yet
+            return self.interval
+        self._step(changed)
+        if not changed and not self.trending:
+            if self._cadence and self._observed_at is not None:
+                # Nothing new upstream: come back just after its next update
+                until_update = self._observed_at + self._cadence + UPDATE_SLACK - now
+                if until_update > 0:
+                    self.interval = min(self.max_interval, max(self.min_interval, until_update))
+        return self.interval
+
+    def update(self, changed, trending=False):
+        """Record one poll when only whether the data changed is known; returns the next interval."""
+        self.polls += 1
+        self.trending = trending
+        return self._step(changed)
+
+    def _step(self, changed):
+        if self.trending:
+            self.interval = self.min_interval
+        elif changed:
+            self.interval = max(self.base, self.interval / self.backoff)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+    def _changed(self, reading):
+        if self._last is None:
+            return True
+        for field, threshold in CHANGE_THRESHOLDS.items():
+            current, previous = reading.get(field), self._last.get(field)
+            if current is None or previous is None:
+                if current is not previous:
+                    return True
+            elif abs(current - previous) >= threshold:
+                return True
+        return False
+
+    def _trending(self):
+        epoch, reading = self._history[-1]
+        wind, rain, clouds = reading.get('wind_speed'), reading.get('rain'), reading.get('clouds')
+        if wind is not None and wind >= alert_engine.WIND_SPEED_MS * TREND_FRACTION:
+            return True
+        if rain is not None and rain >= alert_engine.RAIN_MM_PER_HOUR * TREND_FRACTION:
+            return True
+        first_epoch, first = self._history[0]
+        hours = (epoch - first_epoch) / 3600
+        temp, first_temp = reading.get('temp'), first.get('temp')
+        if temp is not None and first_temp is not None and \
+                abs(temp - first_temp) / max(hours, MIN_TREND_HOURS) >= alert_engine.TEMP_RATE_C_PER_HOUR * TREND_FRACTION:
+            return True
+        pressures = [past.get('pressure') for _, past in self._history if past.get('pressure') is not None]
+        if pressures and reading.get('pressure') is not None and \
+                max(pressures) - reading['pressure'] >= alert_engine.PRESSURE_DROP_HPA * TREND_FRACTION:
+            return True
+        first_clouds = first.get('clouds')
+        if clouds is not None and first_clouds is not None and \
+                clouds >= alert_engine.CLOUD_COVER_PCT * TREND_FRACTION and \
+                clouds - first_clouds >= alert_engine.CLOUD_JUMP_PCT * TREND_FRACTION:
+            return True
+        return False
+
+    def saved(self, now=None):
+        """API calls avoided so far compared with polling every base seconds (negative for extra calls)."""
+        elapsed = (now or time.monotonic()) - self.started
+        return int(elapsed / self.base) + 1 - self.polls
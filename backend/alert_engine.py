@@ -0,0 +1,254 @@
+import sqlite3
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import retention
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+ALERT_SOURCES = ('openweathermap',)                     # observations, kept in the ring buffers
+FORECAST_ALERT_SOURCES = ('openweathermap_forecast',)   # forecast runs, evaluated one run at a time
+HISTORY_SIZE = 256          # readings kept per (city, source), ~4 hours at one per minute
+PRESSURE_WINDOW_HOURS = 3   # window for the pressure drop rule
+PRESSURE_DROP_HPA = 4
+TEMP_RATE_C_PER_HOUR = 5
+WIND_SPEED_MS = 15
+RAIN_MM_PER_HOUR = 5
+CLOUD_COVER_PCT = 80
+CLOUD_JUMP_PCT = 50
+WARM_HOURS = 24             # raw partitions older than this are not read by warm()
+
+# Reading tuple layout in the ring buffers
+EPOCH, TEMP, PRESSURE, WIND, CLOUDS, RAIN = range(6)
+
+def parse_timestamp(timestamp):
+    """Parse an ISO-8601 or '%Y-%m-%d %H:%M:%S' timestamp to epoch seconds (naive means UTC)."""
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def timestamp_ms(timestamp):
+    """Epoch milliseconds for a timestamp string or epoch seconds, or None if it cannot be parsed.
+
+    The one place ingest normalizes reported times; everything stored
+    gets its ts_ms column from here.
+    """
+    try:
+        epoch = float(timestamp) if isinstance(timestamp, (int, float)) else parse_timestamp(timestamp)
+    except (TypeError, ValueError):
+        return None
+    return int(round(epoch * 1000))
+
+def _reading(epoch, weather):
+    return (
+        epoch, weather.get('temp'), weather.get('pressure'),
+        weather.get('wind_speed'), weather.get('clouds'), weather.get('rain')
+    )
+
+class AlertEngine:
+    """Evaluate weather alert rules against in-memory per-city history.
+
+    Keeps the last HISTORY_SIZE readings per (city, source) in a ring buffer,
+    so each new reading is checked without a database round-trip. warm()
+    loads the buffers from sensor_data once at startup.
+
+    Forecast steps never enter the ring buffers: each run is evaluated on
+    its own, in valid-time order (observe_forecast_run), and an alert is
+    raised once per (city, type, valid time) however many runs predict it.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE, sources=ALERT_SOURCES, forecast_sources=FORECAST_ALERT_SOURCES):
+        self.history_size = history_size
+        self.sources = sources
+        self.forecast_sources = forecast_sources
+        self._buffers = {}
+        self._pressure_latches = {}  # (city, source) -> epoch of the peak the last pressure_drop fell from
+        self._forecast_alerted = set()  # (city, type, valid ts_ms) already raised for a future time
+
+    def warm(self, conn):
+        """Fill the ring buffers with the latest history_size readings per (city, source)."""
+        placeholders = ','.join('?' for _ in self.sources)
+        try:
+            _, source, source_params = retention.range_source(
+                conn, datetime.now(timezone.utc) - timedelta(hours=WARM_HOURS), resolution='raw')
+            rows = conn.execute(f"""
+                SELECT city, source, ts_ms, temp, pressure, wind_speed, clouds, rain FROM (
+                    SELECT city, source, ts_ms, temp, pressure, wind_speed, clouds, rain,
+                           ROW_NUMBER() OVER (PARTITION BY city, source ORDER BY ts_ms DESC) AS rn
+                    FROM {source}
+                    WHERE source IN ({placeholders}) AND ts_ms IS NOT NULL
+                )
+                WHERE rn <= ?
+                ORDER BY city, source, ts_ms ASC
+            """, (*source_params, *self.sources, self.history_size)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error warming alert engine: {e}")
+            return 0
+
+        loaded = 0
+        for city, source, ts_ms, temp, pressure, wind, clouds, rain in rows:
+            self._buffer(city, source).append((ts_ms / 1000, temp, pressure, wind, clouds, rain))
+            loaded += 1
+
+        # Alerts already stored for future valid times are not raised again by the next run
+        try:
+            self._forecast_alerted.update(conn.execute(
+                "SELECT city, type, ts_ms FROM alerts WHERE ts_ms >= ?", (int(time.time() * 1000),)
+            ).fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error loading pending forecast alerts: {e}")
+        logger.info(f"Warmed alert engine with {loaded} readings for {len(self._buffers)} city/source pairs "
+                    f"and {len(self._forecast_alerted)} pending forecast alerts")
+        return loaded
+
+    def _buffer(self, city, source):
+        key = (city, source)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = deque(maxlen=self.history_size)
+        return buffer
+
+    def observe(self, city, source, current_data, timestamp, epoch=None):
+        """Record a reading and return the alerts it triggers as dicts of type, message and severity.
+
+        epoch (seconds), when the caller already parsed timestamp, saves parsing it again.
+        """
+        if source not in self.sources:
+            return []
+        if epoch is None:
+            try:
+                epoch = parse_timestamp(timestamp)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Error checking alerts for {city}: invalid timestamp {timestamp!r}: {e}")
+                return []
+
+        reading = _reading(epoch, current_data)
+        buffer = self._buffer(city, source)
+        previous = buffer[-1] if buffer else None
+        buffer.append(reading)
+        if previous is None or epoch <= previous[EPOCH]:
+            return []
+        return self._rules(buffer, reading, previous, self._pressure_latches, (city, source))
+
+    def observe_forecast_run(self, city, source, steps):
+        """Return the alerts a forecast run raises that were not raised before.
+
+        steps are (ts_ms, timestamp, weather) for each step of one run; the
+        result is (ts_ms, timestamp, alert) for the steps that trigger. Steps
+        are checked against the other steps of the run only.
+        """
+        if source not in self.forecast_sources:
+            return []
+        now_ms = time.time() * 1000
+        # Valid times in the past are never forecast again
+        self._forecast_alerted = {key for key in self._forecast_alerted if key[2] >= now_ms}
+
+        run = deque()
+        latches = {}
+        raised = []
+        for ts_ms, timestamp, weather in sorted(steps, key=lambda step: step[0]):
+            reading = _reading(ts_ms / 1000, weather)
+            previous = run[-1] if run else None
+            run.append(reading)
+            if previous is not None and reading[EPOCH] <= previous[EPOCH]:
+                previous = None
+            for alert in self._rules(run, reading, previous, latches, city):
+                key = (city, alert['type'], ts_ms)
+                if key in self._forecast_alerted:
+                    continue
+                self._forecast_alerted.add(key)
+                raised.append((ts_ms, timestamp, alert))
+        return raised
+
+    def _rules(self, buffer, reading, previous, latches, key):
+        """Alerts for reading, the newest in buffer; rate rules need the earlier previous reading.
+
+        latches[key] holds the peak of the series' last pressure drop: one
+        drop alerts once, not on every reading that follows it.
+        """
+        alerts = []
+        time_diff_hours = (reading[EPOCH] - previous[EPOCH]) / 3600 if previous is not None else None
+
+        # Temperature change: ±5°C/hour
+        if previous is not None and reading[TEMP] is not None and previous[TEMP] is not None:
+            temp_change = abs(reading[TEMP] - previous[TEMP])
+            if temp_change / time_diff_hours >= TEMP_RATE_C_PER_HOUR:
+                alerts.append({
+                    'type': 'temperature_change',
+                    'message': f"Rapid temperature {'drop' if reading[TEMP] < previous[TEMP] else 'rise'}: {temp_change:.1f}°C in {time_diff_hours:.1f} hours",
+                    'severity': 'warning'
+                })
+
+        # Pressure drop: ≥4 hPa within any 3 hour window ending now, once per drop
+        drop = self._pressure_drop(buffer, reading)
+        if reading[PRESSURE] is not None:
+            # Unlatch once pressure recovers or the peak it fell from leaves the window
+            if drop is None or latches.get(key, drop[2]) < reading[EPOCH] - PRESSURE_WINDOW_HOURS * 3600:
+                latches.pop(key, None)
+        if drop and key not in latches:
+            pressure_change, hours, peak_epoch = drop
+            latches[key] = peak_epoch
+            alerts.append({
+                'type': 'pressure_drop',
+                'message': f"Rapid pressure drop: {pressure_change:.1f} hPa in {hours:.1f} hours, possible storm",
+                'severity': 'critical'
+            })
+
+        # Wind speed: ≥15 m/s
+        if reading[WIND] is not None and reading[WIND] >= WIND_SPEED_MS:
+            alerts.append({
+                'type': 'high_wind',
+                'message': f"High wind speed: {reading[WIND]:.1f} m/s",
+                'severity': 'warning'
+            })
+
+        # Rain: ≥5 mm/h
+        if reading[RAIN] is not None and reading[RAIN] >= RAIN_MM_PER_HOUR:
+            alerts.append({
+                'type': 'heavy_rain',
+                'message': f"Heavy rain: {reading[RAIN]:.1f} mm/h",
+                'severity': 'warning'
+            })
+
+        # Clouds: Increase to ≥80% in 1 hour
+        if previous is not None and reading[CLOUDS] is not None and previous[CLOUDS] is not None:
+            cloud_change = reading[CLOUDS] - previous[CLOUDS]
+            if time_diff_hours <= 1 and reading[CLOUDS] >= CLOUD_COVER_PCT and cloud_change >= CLOUD_JUMP_PCT:
+                alerts.append({
+                    'type': 'sudden_clouds',
+                    'message': f"Sudden cloud cover increase: {cloud_change:.1f}% to {reading[CLOUDS]}%",
+                    'severity': 'warning'
+                })
+
+        return alerts
+
+    def _pressure_drop(self, buffer, reading):
+        """Return (drop_hpa, hours, peak epoch) for the largest drop from a reading in the window, or None."""
+        if reading[PRESSURE] is None:
+            return None
+        window_start = reading[EPOCH] - PRESSURE_WINDOW_HOURS * 3600
+        peak = None
+        # Newest first; stop at the first reading older than the window
+        for past in reversed(buffer):
+            if past is reading:
+                continue
+            if past[EPOCH] < window_start:
+                break
+            if past[PRESSURE] is not None and (peak is None or past[PRESSURE] > peak[PRESSURE]):
+                peak = past
+        if peak is None:
+            return None
+        pressure_change = peak[PRESSURE] - reading[PRESSURE]
+        if pressure_change < PRESSURE_DROP_HPA:
+            return None
+        return pressure_change, (reading[EPOCH] - peak[EPOCH]) / 3600, peak[EPOCH]
+
+    def stats(self):
+        return {
+            'series': len(self._buffers),
+            'readings': sum(len(buffer) for buffer in self._buffers.values())
+        }
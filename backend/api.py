@@ -1,19 +1,59 @@
 import sqlite3
 import json
 import logging
+import os
+import time
+from functools import wraps
 from datetime import datetime, timedelta, timezone
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, make_response, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import locations
+import retention
+import export
+import node_health
+import storage
+from response_cache import DataVersions, ResponseCache, GLOBAL_SCOPE
+from stream import StreamHub
+
+# orjson serializes responses several times faster; without it the stdlib provider is used
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, with sorted keys like the default provider."""
+
+    def _options(self):
+        return orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skip the str round trip: orjson already produces bytes
+        body = orjson.dumps(self._prepare_response_obj(args, kwargs), default=self.default,
+                            option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 CORS(app)
 
 DB_PATH = "moodcast.db"
 
+# Forecast sources served under 'model' by /forecast: predict_weather's batch fit and online_forecast
+MODEL_SOURCES = ('model_prediction', 'model_online')
+
 # City coordinates
 CITY_COORDS = {
     'Auckland': (-36.8485, 174.7633),
@@ -28,14 +68,85 @@ CITY_COORDS = {
     'Cape Town': (-33.9249, 18.4241)
 }
 
+# Read-only connections shared by all request threads; main.py owns the writer
+read_pool = storage.ReadPool(DB_PATH)
+
+# Resolves request coordinates to a station (city) once, instead of ABS(lat - ?) scans
+location_index = locations.LocationIndex(DB_PATH)
+location_index.load()
+
+# Rendered responses, invalidated when the ingest writer bumps data_versions
+CACHE_TTL = float(os.getenv("MOODCAST_CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("MOODCAST_CACHE_MAX_ENTRIES", "512"))
+response_cache = ResponseCache(DataVersions(DB_PATH), max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+
+# Shared MQTT subscriber behind /stream, started on the first client
+stream_hub = StreamHub()
+
+def normalize_args(args):
+    """Cache key part for query args: sorted, with numbers in one canonical form."""
+    items = []
+    for key, value in sorted(args.items(multi=True)):
+        try:
+            value = f"{float(value):.4f}"
+        except ValueError:
+            value = value.strip()
+        items.append((key, value))
+    return tuple(items)
+
+def coords_scope(args):
+    lat = args.get('lat', type=float)
+    lon = args.get('lon', type=float)
+    if lat is None or lon is None:
+        return GLOBAL_SCOPE
+    return location_index.resolve(lat, lon) or GLOBAL_SCOPE
+
+def city_scope(args):
+    return args.get('city') or GLOBAL_SCOPE
+
+def cached(scope_fn, ttl=None):
+    """Serve a GET view from response_cache, with ETag / If-None-Match support.
+
+    scope_fn(request.args) names the city whose writes invalidate the entry,
+    or GLOBAL_SCOPE for views that span all cities.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.path, normalize_args(request.args))
+            scope = scope_fn(request.args)
+            entry = response_cache.get(key, scope)
+            if entry is None:
+                version = response_cache.versions.get(scope)
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                etag = response_cache.put(key, scope, body, response.mimetype, ttl=ttl, version=version)
+            else:
+                body, mimetype, etag = entry
+                response = app.response_class(body, mimetype=mimetype)
+
+            if request.if_none_match.contains(etag):
+                response_cache.record_not_modified()
+                response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
 def get_db_connection():
+    """Check a connection out of the read pool; hand it back with release_db_connection."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        return conn
+        return read_pool.acquire()
     except sqlite3.Error as e:
         logger.error(f"Database connection error: {e}")
         return None
 
+def release_db_connection(conn):
+    read_pool.release(conn)
+
 def calculate_mood_score(temp, clouds):
     """Compute mood_score: (100 - clouds) * (temp / 30), clamped 0-100."""
     try:
@@ -44,45 +155,107 @@ def calculate_mood_score(temp, clouds):
     except (TypeError, ZeroDivisionError):
         return 50.0
 
+def query_weather(conn, city):
+    """Latest reading for a city with its quality metrics and IoT node, as /weather renders it; None without data."""
+    cursor = conn.cursor()
+    # Newest partition first; older ones are only read right after a rotation
+    row = None
+    for table in retention.raw_tables(conn):
+        cursor.execute(f"""
+            SELECT city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score
+            FROM {table}
+            WHERE city = ? AND source IN ('openweathermap', 'openmeteo')
+            ORDER BY ts_ms DESC, source = 'openweathermap' DESC LIMIT 1
+        """, (city,))
+        row = cursor.fetchone()
+        if row:
+            break
+    if not row:
+        return None
+
+    cursor.execute("""
+        SELECT completeness, freshness, missing_fields, error
+        FROM quality_metrics
+        WHERE city = ? ORDER BY timestamp DESC LIMIT 1
+    """, (row[0],))
+    quality_row = cursor.fetchone()
+
+    cursor.execute("""
+        SELECT pi_id, sensor_id
+        FROM iot_nodes
+        WHERE city = ?
+    """, (row[0],))
+    iot_row = cursor.fetchone()
+
+    return {
+        'city': row[0],
+        'lat': row[1],
+        'lon': row[2],
+        'weather': {
+            'temp': row[3],
+            'humidity': row[4],
+            'pressure': row[5],
+            'wind_speed': row[6],
+            'clouds': row[7],
+            'rain': row[8]
+        },
+        'timestamp': row[9],
+        'source': row[10],
+        'mood_score': row[11],
+        'quality': {
+            'completeness': quality_row[0] if quality_row else None,
+            'freshness': quality_row[1] if quality_row else None,
+            'missing_fields': quality_row[2].split(',') if quality_row and quality_row[2] else [],
+            'error': quality_row[3] if quality_row else None
+        },
+        'iot_node': {
+            'pi_id': iot_row[0] if iot_row else None,
+            'sensor_id': iot_row[1] if iot_row else None
+        }
+    }
+
 @app.route('/weather', methods=['GET'])
+@cached(coords_scope)
 def get_weather():
     lat = request.args.get('lat', type=float)
     lon = request.args.get('lon', type=float)
     if not lat or not lon:
         return jsonify({'error': 'Missing lat or lon'}), 400
 
+    city = location_index.resolve(lat, lon)
+    if not city:
+        return jsonify({'error': 'No weather data found'}), 404
+
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database error'}), 500
 
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score
-            FROM sensor_data
-            WHERE ABS(lat - ?) <= 0.01 AND ABS(lon - ?) <= 0.01
-            AND source IN ('openweathermap', 'openmeteo')
-            ORDER BY timestamp DESC, source = 'openweathermap' DESC LIMIT 1
-        """, (lat, lon))
-        row = cursor.fetchone()
-        if not row:
+        response = query_weather(conn, city)
+        if not response:
             return jsonify({'error': 'No weather data found'}), 404
+        return jsonify(response)
+    except Exception as e:
+        logger.error(f"Error fetching weather: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        release_db_connection(conn)
 
-        cursor.execute("""
-            SELECT completeness, freshness, missing_fields, error
-            FROM quality_metrics
-            WHERE city = ? ORDER BY timestamp DESC LIMIT 1
-        """, (row[0],))
-        quality_row = cursor.fetchone()
-
-        cursor.execute("""
-            SELECT pi_id, sensor_id
-            FROM iot_nodes
-            WHERE city = ?
-        """, (row[0],))
-        iot_row = cursor.fetchone()
+def query_forecast(conn, city):
+    """Latest forecast run per source for a city, split into API and model forecasts as /forecast renders them."""
+    cursor = conn.cursor()
+    # Latest run per source, straight off the forecasts primary key
+    cursor.execute("""
+        SELECT city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, valid_time, source, mood_score, issue_time
+        FROM latest_forecasts
+        WHERE city = ? AND source IN ('openweathermap_forecast', 'openmeteo_forecast', 'model_prediction', 'model_online')
+        ORDER BY source, valid_time ASC
+    """, (city,))
 
-        response = {
+    api_forecasts = []
+    model_forecasts = []
+    for row in cursor.fetchall():
+        forecast = {
             'city': row[0],
             'lat': row[1],
             'lon': row[2],
@@ -97,95 +270,153 @@ def get_weather():
             'timestamp': row[9],
             'source': row[10],
             'mood_score': row[11],
-            'quality': {
-                'completeness': quality_row[0] if quality_row else None,
-                'freshness': quality_row[1] if quality_row else None,
-                'missing_fields': quality_row[2].split(',') if quality_row and quality_row[2] else [],
-                'error': quality_row[3] if quality_row else None
-            },
-            'iot_node': {
-                'pi_id': iot_row[0] if iot_row else None,
-                'sensor_id': iot_row[1] if iot_row else None
-            }
+            'issue_time': row[12]
         }
-        return jsonify(response)
-    except Exception as e:
-        logger.error(f"Error fetching weather: {e}")
-        return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+        (model_forecasts if row[10] in MODEL_SOURCES else api_forecasts).append(forecast)
+
+    return {'api': api_forecasts, 'model': model_forecasts}
 
 @app.route('/forecast', methods=['GET'])
+@cached(coords_scope)
 def get_forecast():
     lat = request.args.get('lat', type=float)
     lon = request.args.get('lon', type=float)
     if not lat or not lon:
         return jsonify({'error': 'Missing lat or lon'}), 400
 
+    city = location_index.resolve(lat, lon)
+    if not city:
+        return jsonify({'api': [], 'model': []})
+
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database error'}), 500
 
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score
-            FROM sensor_data
-            WHERE ABS(lat - ?) <= 0.01 AND ABS(lon - ?) <= 0.01 AND source = 'openweathermap_forecast'
-            ORDER BY timestamp ASC
-        """, (lat, lon))
-        api_rows = cursor.fetchall()
-
-        cursor.execute("""
-            SELECT city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score
-            FROM sensor_data
-            WHERE ABS(lat - ?) <= 0.01 AND ABS(lon - ?) <= 0.01 AND source = 'model_prediction'
-            ORDER BY timestamp ASC
-        """, (lat, lon))
-        model_rows = cursor.fetchall()
+        return jsonify(query_forecast(conn, city))
+    except Exception as e:
+        logger.error(f"Error fetching forecast: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        release_db_connection(conn)
 
-        api_forecasts = [{
-            'city': row[0],
-            'lat': row[1],
-            'lon': row[2],
-            'weather': {
-                'temp': row[3],
-                'humidity': row[4],
-                'pressure': row[5],
-                'wind_speed': row[6],
-                'clouds': row[7],
-                'rain': row[8]
-            },
-            'timestamp': row[9],
-            'source': row[10],
-            'mood_score': row[11]
-        } for row in api_rows]
+@app.route('/history', methods=['GET'])
+def get_history():
+    """Stream sensor history for a city/time range in chunks.
 
-        model_forecasts = [{
-            'city': row[0],
-            'lat': row[1],
-            'lon': row[2],
-            'weather': {
-                'temp': row[3],
-                'humidity': row[4],
-                'pressure': row[5],
-                'wind_speed': row[6],
-                'clouds': row[7],
-                'rain': row[8]
-            },
-            'timestamp': row[9],
-            'source': row[10],
-            'mood_score': row[11]
-        } for row in model_rows]
+    ?city=Auckland,Tokyo&since=...&until=...&source=...&resolution=raw|5m|1h|1d
+    &max_points=N&format=csv|ndjson|arrow|parquet&gzip=1. Rows are read and
+    encoded chunk by chunk, so memory use does not grow with the range.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.available_formats():
+        return jsonify({'error': f"format must be one of {export.available_formats()}"}), 400
+    resolution = request.args.get('resolution')
+    if resolution and resolution not in retention.RESOLUTIONS:
+        return jsonify({'error': f"resolution must be one of {list(retention.RESOLUTIONS)}"}), 400
+    try:
+        since = export.parse_time(request.args['since']) if request.args.get('since') else None
+        until = export.parse_time(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO-8601 times'}), 400
+    cities = [c.strip() for c in request.args.get('city', '').split(',') if c.strip()] or None
+    sources = [s.strip() for s in request.args.get('source', '').split(',') if s.strip()] or None
+    max_points = request.args.get('max_points', type=int)
+    gzip = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
 
-        return jsonify({'api': api_forecasts, 'model': model_forecasts})
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database error'}), 500
+    try:
+        chunks = export.iter_chunks(conn, cities, since, until, sources, resolution, max_points)
+        # Run the query now so errors become a JSON 500 rather than a broken stream
+        served_resolution, first = next(chunks)
     except Exception as e:
-        logger.error(f"Error fetching forecast: {e}")
+        release_db_connection(conn)
+        logger.error(f"Error fetching history: {e}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
+
+    def rows():
+        yield first
+        for _, chunk in chunks:
+            yield chunk
+
+    def release():
+        chunks.close()
+        release_db_connection(conn)
+
+    mimetype, extension, _ = export.FORMATS[fmt]
+    headers = {
+        'X-MoodCast-Resolution': served_resolution,
+        'Content-Disposition': f"attachment; filename=moodcast_history.{extension}"
+    }
+    if gzip:
+        headers['Content-Encoding'] = 'gzip'
+    response = Response(export.encode(rows(), fmt, gzip), mimetype=mimetype, headers=headers)
+    # The server closes the response however it ends (HEAD, disconnect, or
+    # fully sent), whereas rows() never runs at all for a HEAD request
+    response.call_on_close(release)
+    return response
+
+@app.route('/locations/nearest', methods=['GET'])
+def get_nearest_locations():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    limit = request.args.get('limit', default=1, type=int)
+    max_km = request.args.get('max_km', type=float)
+    if lat is None or lon is None:
+        return jsonify({'error': 'Missing lat or lon'}), 400
+    if not 1 <= limit <= 100:
+        return jsonify({'error': 'limit must be between 1 and 100'}), 400
+
+    if not len(location_index):
+        location_index.load()
+    stations = [{
+        'city': city,
+        'lat': s_lat,
+        'lon': s_lon,
+        'distance_km': round(distance, 2)
+    } for city, s_lat, s_lon, distance in location_index.nearest(lat, lon, k=limit, max_km=max_km)]
+    return jsonify(stations)
+
+def node_health_view(row, now):
+    """Render a node_health row (selected as NODE_HEALTH_COLUMNS) for /status and /nodes."""
+    status, freshness = node_health.node_status(row[5], now)
+    return {
+        'city': row[0],
+        'status': status,
+        'freshness': freshness,
+        'pi_id': row[1],
+        'sensor_id': row[2],
+        'lat': row[3] if row[3] is not None else CITY_COORDS.get(row[0], (0, 0))[0],
+        'lon': row[4] if row[4] is not None else CITY_COORDS.get(row[0], (0, 0))[1],
+        'last_seen': node_health.format_time(row[5]) if row[5] is not None else None,
+        'uptime': row[6],
+        'message_rate': row[7],
+        'gaps': {'avg': row[8], 'max': row[9], 'outages': row[10]},
+        'logs': json.loads(row[11]) if row[11] else []
+    }
+
+NODE_HEALTH_COLUMNS = """
+    city, pi_id, sensor_id, lat, lon, last_seen, uptime_pct, message_rate, gap_avg, gap_max, outages, logs
+"""
+
+def query_status(conn, city, now):
+    """IoT node health for a city as /status renders it (without logs); None without a node."""
+    # Precomputed by main.py as quality messages arrive
+    row = conn.execute(f"SELECT {NODE_HEALTH_COLUMNS} FROM node_health WHERE city = ?", (city,)).fetchone()
+    if not row:
+        return None
+    node = node_health_view(row, now)
+    del node['logs']
+    return node
+
+def query_nodes(conn, now):
+    rows = conn.execute(f"SELECT {NODE_HEALTH_COLUMNS} FROM node_health").fetchall()
+    return [node_health_view(row, now) for row in rows]
 
 @app.route('/status', methods=['GET'])
+@cached(city_scope, ttl=5)  # freshness is time-dependent
 def get_status():
     city = request.args.get('city')
     if not city:
@@ -196,84 +427,59 @@ def get_status():
         return jsonify({'error': 'Database error'}), 500
 
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT pi_id, sensor_id, last_seen, lat, lon
-            FROM iot_nodes
-            WHERE city = ?
-        """, (city,))
-        node_row = cursor.fetchone()
-        if not node_row:
+        node = query_status(conn, city, time.time())
+        if not node:
             return jsonify({'error': 'No IoT node found for city'}), 404
-
-        last_seen = None
-        if node_row[2]:
-            try:
-                last_seen = datetime.strptime(node_row[2], '%Y-%m-%dT%H:%M:%S.%f%z')
-            except ValueError as e:
-                logger.error(f"Failed to parse last_seen timestamp '{node_row[2]}': {e}")
-                return jsonify({'error': 'Invalid timestamp format'}), 500
-
-        status = 'Online' if last_seen and (datetime.now(timezone.utc) - last_seen).total_seconds() < 300 else 'Offline'
-        freshness = (datetime.now(timezone.utc) - last_seen).total_seconds() if last_seen else None
-
-        response = {
-            'city': city,
-            'status': status,
-            'freshness': round(freshness, 1) if freshness is not None else None,
-            'pi_id': node_row[0],
-            'sensor_id': node_row[1]
-        }
-        return jsonify(response)
+        return jsonify(node)
     except Exception as e:
         logger.error(f"Error fetching status: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 @app.route('/nodes', methods=['GET'])
+@cached(lambda args: GLOBAL_SCOPE, ttl=5)
 def get_nodes():
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database error'}), 500
 
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT city, pi_id, sensor_id, last_seen, lat, lon
-            FROM iot_nodes
-        """)
-        rows = cursor.fetchall()
-
-        nodes = []
-        for row in rows:
-            last_seen = None
-            if row[3]:
-                try:
-                    last_seen = datetime.strptime(row[3], '%Y-%m-%dT%H:%M:%S.%f%z')
-                except ValueError as e:
-                    logger.error(f"Failed to parse last_seen timestamp '{row[3]}': {e}")
-                    continue
-            status = 'Online' if last_seen and (datetime.now(timezone.utc) - last_seen).total_seconds() < 300 else 'Offline'
-            freshness = (datetime.now(timezone.utc) - last_seen).total_seconds() if last_seen else None
-            nodes.append({
-                'city': row[0],
-                'pi_id': row[1],
-                'sensor_id': row[2],
-                'status': status,
-                'freshness': round(freshness, 1) if freshness is not None else None,
-                'lat': row[4] if row[4] is not None else CITY_COORDS.get(row[0], (0, 0))[0],
-                'lon': row[5] if row[5] is not None else CITY_COORDS.get(row[0], (0, 0))[1],
-                'logs': []
-            })
-        return jsonify(nodes)
+        return jsonify(query_nodes(conn, time.time()))
     except Exception as e:
         logger.error(f"Error fetching nodes: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+def query_alerts(conn, city=None):
+    """Alerts from the last 24 hours, newest first, for one city or all of them."""
+    cursor = conn.cursor()
+    if city:
+        cursor.execute("""
+            SELECT city, type, message, timestamp, severity
+            FROM alerts
+            WHERE city = ? AND ts_ms >= ?
+            ORDER BY ts_ms DESC
+        """, (city, retention.sql_ms(datetime.now(timezone.utc) - timedelta(hours=24))))
+    else:
+        cursor.execute("""
+            SELECT city, type, message, timestamp, severity
+            FROM alerts
+            WHERE ts_ms >= ?
+            ORDER BY ts_ms DESC
+        """, (retention.sql_ms(datetime.now(timezone.utc) - timedelta(hours=24)),))
+
+    return [{
+        'city': row[0],
+        'type': row[1],
+        'message': row[2],
+        'timestamp': row[3],
+        'severity': row[4]
+    } for row in cursor.fetchall()]
 
 @app.route('/alerts', methods=['GET'])
+@cached(city_scope)
 def get_alerts():
     city = request.args.get('city')
     conn = get_db_connection()
@@ -281,36 +487,159 @@ def get_alerts():
         return jsonify({'error': 'Database error'}), 500
 
     try:
-        cursor = conn.cursor()
-        if city:
-            cursor.execute("""
-                SELECT city, type, message, timestamp, severity
-                FROM alerts
-                WHERE city = ? AND timestamp >= ?
-                ORDER BY timestamp DESC
-            """, (city, (datetime.now(timezone.utc) - timedelta(hours=24)).isoformat()))
-        else:
-            cursor.execute("""
-                SELECT city, type, message, timestamp, severity
-                FROM alerts
-                WHERE timestamp >= ?
-                ORDER BY timestamp DESC
-            """, ((datetime.now(timezone.utc) - timedelta(hours=24)).isoformat(),))
-        
-        rows = cursor.fetchall()
-        alerts = [{
-            'city': row[0],
-            'type': row[1],
-            'message': row[2],
-            'timestamp': row[3],
-            'severity': row[4]
-        } for row in rows]
-        return jsonify(alerts)
+        return jsonify(query_alerts(conn, city))
     except Exception as e:
         logger.error(f"Error fetching alerts: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+# /batch: per-city sections, plus 'nodes' for the whole network
+BATCH_SECTIONS = ('weather', 'forecast', 'status', 'alerts')
+BATCH_MAX_CITIES = int(os.getenv("MOODCAST_BATCH_MAX_CITIES", "50"))
+
+def batch_cities(args):
+    """Cities named in ?city=, plus the station nearest ?lat=&lon= when given."""
+    cities = [c.strip() for c in args.get('city', '').split(',') if c.strip()]
+    lat = args.get('lat', type=float)
+    lon = args.get('lon', type=float)
+    if lat is not None and lon is not None:
+        station = location_index.resolve(lat, lon)
+        if station:
+            cities.append(station)
+    return list(dict.fromkeys(cities))
+
+def batch_scope(args):
+    cities = batch_cities(args)
+    return cities[0] if len(cities) == 1 else GLOBAL_SCOPE
+
+def field_tree(spec):
+    """Parse 'weather.weather.temp,alerts' into {'weather': {'weather': {'temp': True}}, 'alerts': True}."""
+    tree = {}
+    for path in spec.split(','):
+        parts = [part.strip() for part in path.split('.')]
+        if not all(parts):
+            continue
+        node = tree
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break  # an ancestor is already selected whole
+        else:
+            node[parts[-1]] = True
+    return tree
+
+def select_fields(value, tree):
+    """Keep only the fields named in tree (True keeps everything); lists are projected item by item."""
+    if tree is True or value is None:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: select_fields(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+@app.route('/batch', methods=['GET'])
+@cached(batch_scope, ttl=5)  # status freshness is time-dependent
+def get_batch():
+    """Weather, forecast, status and alerts for one or many cities in one response.
+
+    ?city=Auckland,Tokyo&fields=weather.weather,weather.mood_score,status.status,alerts,nodes
+    (or ?lat=&lon= for the nearest station, as /weather resolves it).
+    fields names the sections to return (default: every per-city section;
+    nodes adds the /nodes list) and, as dotted paths, fields inside them.
+    Sections not asked for are not queried. Everything is read on one
+    connection inside a single read transaction, so all sections describe
+    the same snapshot of the database.
+    """
+    cities = batch_cities(request.args)
+    if not cities:
+        return jsonify({'error': 'Missing city, or lat and lon near a station'}), 400
+    if len(cities) > BATCH_MAX_CITIES:
+        return jsonify({'error': f"At most {BATCH_MAX_CITIES} cities per request"}), 400
+    tree = field_tree(request.args.get('fields') or ','.join(BATCH_SECTIONS))
+    unknown = set(tree) - set(BATCH_SECTIONS) - {'nodes'}
+    if not tree or unknown:
+        return jsonify({'error': f"fields must name sections among {[*BATCH_SECTIONS, 'nodes']}"}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database error'}), 500
+
+    try:
+        now = time.time()
+        results = {city: {} for city in cities}
+        conn.execute("BEGIN")
+        if 'weather' in tree:
+            for city in cities:
+                results[city]['weather'] = query_weather(conn, city)
+        if 'forecast' in tree:
+            for city in cities:
+                results[city]['forecast'] = query_forecast(conn, city)
+        # One node_health read serves both status for several cities and the nodes list
+        nodes = query_nodes(conn, now) if 'nodes' in tree or ('status' in tree and len(cities) > 1) else None
+        if 'status' in tree:
+            if nodes is None:
+                statuses = {cities[0]: query_status(conn, cities[0], now)}
+            else:
+                statuses = {node['city']: {k: v for k, v in node.items() if k != 'logs'} for node in nodes}
+            for city in cities:
+                results[city]['status'] = statuses.get(city)
+        if 'alerts' in tree:
+            for city in cities:
+                results[city]['alerts'] = []
+            for alert in query_alerts(conn, cities[0] if len(cities) == 1 else None):
+                if alert['city'] in results:
+                    results[alert['city']]['alerts'].append(alert)
+        conn.commit()
+
+        city_tree = {section: subtree for section, subtree in tree.items() if section != 'nodes'}
+        response = {'cities': {city: select_fields(sections, city_tree) for city, sections in results.items()}}
+        if 'nodes' in tree:
+            response['nodes'] = select_fields(nodes, tree['nodes'])
+        return jsonify(response)
+    except Exception as e:
+        logger.error(f"Error fetching batch: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        release_db_connection(conn)
+
+@app.route('/stream', methods=['GET'])
+def stream_events():
+    """Server-Sent Events feed of sensor readings, forecasts and alerts.
+
+    ?city=Auckland,Tokyo limits the feed to those cities; without it every
+    city is streamed.
+    """
+    cities = [c.strip() for c in request.args.get('city', '').split(',') if c.strip()]
+    stream_hub.start()
+    subscription = stream_hub.subscribe(cities or None)
+
+    def generate():
+        try:
+            yield b"retry: 5000\n\n"
+            while not subscription.closed:
+                frames = subscription.get()
+                yield b"".join(frames) if frames else b": keep-alive\n\n"
+        finally:
+            stream_hub.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/stream/stats', methods=['GET'])
+def get_stream_stats():
+    return jsonify(stream_hub.stats())
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route('/db/stats', methods=['GET'])
+def get_db_stats():
+    return jsonify(read_pool.stats())
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,282 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import storage
+import api
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# ASGI serving tuning (overridable from the environment)
+ASGI_THREADS = int(os.getenv("MOODCAST_ASGI_THREADS", str(storage.READ_POOL_SIZE)))  # requests handled at once
+ASGI_STREAM_THREADS = int(os.getenv("MOODCAST_ASGI_STREAM_THREADS", "64"))          # open /stream and /history bodies
+ASGI_BACKLOG = int(os.getenv("MOODCAST_ASGI_BACKLOG", "256"))                       # requests queued for a thread before 503
+ASGI_DRAIN_TIMEOUT = float(os.getenv("MOODCAST_ASGI_DRAIN_TIMEOUT", "10"))          # seconds shutdown waits for in-flight requests
+MAX_BODY_BYTES = 1024 * 1024
+STATS_PATH = '/asgi/stats'   # answered by the bridge itself, never reaches the WSGI app
+
+class AsgiBridge:
+    """Serve a WSGI app (the Flask API) from an ASGI server.
+
+    The event loop only moves bytes: every view runs on a bounded thread
+    pool sized to the read pool, so SQLite work never blocks the loop and
+    never queues for a connection inside a handler. Streamed bodies
+    (/stream, /history) are pulled chunk by chunk on a separate pool, so
+    long-lived clients do not occupy request threads. Beyond threads +
+    backlog outstanding requests new ones get 503 with Retry-After.
+
+    On lifespan shutdown the bridge stops taking requests, ends open
+    streams, waits up to drain_timeout for in-flight requests and then
+    runs on_shutdown. GET STATS_PATH returns stats() as JSON.
+    """
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, stream_threads=ASGI_STREAM_THREADS,
+                 backlog=ASGI_BACKLOG, drain_timeout=ASGI_DRAIN_TIMEOUT, on_drain=None, on_shutdown=None):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.backlog = backlog
+        self.drain_timeout = drain_timeout
+        self.on_drain = on_drain
+        self.on_shutdown = on_shutdown
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi-request")
+        self._stream_executor = ThreadPoolExecutor(stream_threads, thread_name_prefix="asgi-stream")
+        self._draining = False
+        self._in_flight = 0
+        self._open_streams = 0
+        self._idle = None
+        self._stats = {
+            'requests': 0,
+            'rejected': 0,
+            'streams': 0,
+            'disconnects': 0,
+            'errors': 0
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        # Other scope types (websocket) are not served
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._idle = asyncio.Event()
+                self._idle.set()
+                logger.info(f"ASGI bridge started ({self.threads} request threads, pid {os.getpid()})")
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def shutdown(self):
+        self._draining = True
+        if self.on_drain:
+            self.on_drain()
+        if self._idle is not None and self._in_flight:
+            logger.info(f"Draining {self._in_flight} in-flight requests")
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Shutting down with {self._in_flight} requests still in flight")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._stream_executor.shutdown(wait=False, cancel_futures=True)
+        if self.on_shutdown:
+            self.on_shutdown()
+        logger.info("ASGI bridge stopped")
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['in_flight'] = self._in_flight
+        stats['open_streams'] = self._open_streams
+        stats['threads'] = self.threads
+        stats['backlog'] = self.backlog
+        stats['draining'] = self._draining
+        return stats
+
+    async def _http(self, scope, receive, send):
+        if scope['path'] == STATS_PATH and scope['method'] == 'GET':
+            body = json.dumps(self.stats(), sort_keys=True).encode()
+            await self._plain(send, 200, body, content_type=b'application/json')
+            return
+        # Open streams hold no request thread, so they do not count against the backlog
+        if self._draining or self._in_flight - self._open_streams >= self.threads + self.backlog:
+            self._stats['rejected'] += 1
+            await self._plain(send, 503, b"Server busy, retry shortly\n", [(b'retry-after', b'1')])
+            return
+        self._in_flight += 1
+        if self._idle is not None:
+            self._idle.clear()
+        self._stats['requests'] += 1
+        try:
+            body = await self._read_body(receive)
+            if body is None:
+                await self._plain(send, 413, b"Request body too large\n")
+                return
+            loop = asyncio.get_running_loop()
+            status, headers, chunks, stream = await loop.run_in_executor(
+                self._executor, self._call, self._environ(scope, body))
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            if stream is None:
+                await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+            else:
+                await self._stream(receive, send, chunks, stream)
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"Error serving {scope.get('path')}: {e}")
+            raise
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight and self._idle is not None:
+                self._idle.set()
+
+    async def _read_body(self, receive):
+        parts = []
+        size = 0
+        more = True
+        while more:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                return None
+            parts.append(chunk)
+            more = message.get('more_body', False)
+        return b''.join(parts)
+
+    def _call(self, environ):
+        """Run the WSGI app on a request thread.
+
+        Returns (status, headers, chunks, stream): sized bodies are read here
+        in full and stream is None; otherwise chunks holds what was read so
+        far and stream is the (iterator, result) still to be pulled.
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        iterator = iter(result)
+        chunks = []
+        try:
+            # start_response may be deferred until the first chunk
+            while 'status' not in response:
+                chunks.append(next(iterator))
+        except StopIteration:
+            _close(result)
+            return response['status'], response['headers'], chunks, None
+        sized = any(name == b'content-length' for name, _ in response['headers'])
+        if sized or response['status'] in (204, 304) or environ['REQUEST_METHOD'] == 'HEAD':
+            try:
+                chunks.extend(iterator)
+            finally:
+                _close(result)
+            return response['status'], response['headers'], chunks, None
+        return response['status'], response['headers'], chunks, (iterator, result)
+
+    async def _stream(self, receive, send, chunks, stream):
+        iterator, result = stream
+        self._stats['streams'] += 1
+        self._open_streams += 1
+        disconnected = asyncio.Event()
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch())
+        pending = None
+        try:
+            for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            while not disconnected.is_set() and not self._draining:
+                # One next() at a time per stream, so the generator never runs on two threads
+                pending = self._stream_executor.submit(next, iterator, None)
+                chunk = await asyncio.wrap_future(pending)
+                pending = None
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if disconnected.is_set():
+                self._stats['disconnects'] += 1
+            else:
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            self._open_streams -= 1
+            watcher.cancel()
+            # Close the body (releasing its connection or subscription) once no next() is running
+            if pending is not None and not pending.done():
+                pending.add_done_callback(lambda _: _close(result))
+            else:
+                _close(result)
+
+    @staticmethod
+    async def _plain(send, status, body, headers=(), content_type=b'text/plain'):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode()),
+                                *headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    def _environ(scope, body):
+        """PEP 3333 environ for an ASGI HTTP scope."""
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1')
+            value = value.decode('latin-1')
+            if name == 'content-type':
+                key = 'CONTENT_TYPE'
+            elif name == 'content-length':
+                key = 'CONTENT_LENGTH'
+            else:
+                key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+def _close(result):
+    close = getattr(result, 'close', None)
+    if close:
+        try:
+            close()
+        except Exception as e:
+            logger.error(f"Error closing response body: {e}")
+
+def _on_shutdown():
+    api.read_pool.close()
+
+# Ending the shared MQTT subscription wakes every open /stream so it can finish
+application = AsgiBridge(api.app, on_drain=api.stream_hub.stop, on_shutdown=_on_shutdown)
@@ -0,0 +1,668 @@
+import sqlite3
+import numpy as np
+import threading
+import time
+import logging
+import os
+import math
+import tempfile
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote
+import retention
+import export
+import ingest
+import storage
+
+# The columnar backend stores segments as Parquet and needs pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DB_PATH = "moodcast.db"
+
+# History store selection and columnar tuning (overridable from the environment).
+# moodcast.db stays the system of record that ingest writes and the API reads;
+# HISTORY_BACKEND picks where committed readings, alerts and nodes are also
+# mirrored (main.on_commit) and where predict_weather reads its training history.
+HISTORY_BACKEND = os.getenv("MOODCAST_HISTORY_BACKEND", "sqlite")
+TIMESERIES_PATH = os.getenv("MOODCAST_TIMESERIES_PATH", "moodcast_ts")
+SEGMENT_ROWS = int(os.getenv("MOODCAST_TIMESERIES_SEGMENT_ROWS", "50000"))        # buffered rows per city before a segment is cut
+FLUSH_INTERVAL = float(os.getenv("MOODCAST_TIMESERIES_FLUSH_INTERVAL", "60"))     # seconds before buffered rows are cut anyway
+COMPACT_SEGMENTS = int(os.getenv("MOODCAST_TIMESERIES_COMPACT_SEGMENTS", "16"))  # small segments per city before they are merged
+SEGMENT_CACHE = 256          # decoded segments kept in memory
+
+# Row layouts, in the order IngestWriter.put() takes them for each table
+READING_COLUMNS = retention.RANGE_COLUMNS
+ALERT_COLUMNS = ('city', 'type', 'message', 'timestamp', 'severity', 'ts_ms')
+NODE_COLUMNS = ('city', 'pi_id', 'sensor_id', 'last_seen', 'lat', 'lon')
+TEXT_COLUMNS = ('city', 'timestamp', 'source', 'type', 'message', 'severity', 'pi_id', 'sensor_id', 'last_seen')
+
+class StorageBackend(ABC):
+    """What MoodCast needs from a history store of readings, alerts and nodes.
+
+    Rows are tuples in READING_COLUMNS, ALERT_COLUMNS and NODE_COLUMNS
+    order, i.e. the rows IngestWriter.put() takes for sensor_data, alerts
+    and iot_nodes. Times are filtered on ts_ms; since and until are aware
+    datetimes (or epoch seconds), since inclusive and until exclusive.
+    Every implementation must pass check_contract().
+    """
+
+    name = None
+
+    @abstractmethod
+    def append_readings(self, rows):
+        pass
+
+    @abstractmethod
+    def range_query(self, since, until=None, cities=None, sources=None):
+        """Raw readings in the range as export.read_columns() columns, ordered by city then time."""
+
+    @abstractmethod
+    def latest(self, cities=None, sources=None):
+        """Newest reading per city, optionally among sources only, as {city: row}."""
+
+    @abstractmethod
+    def append_alerts(self, rows):
+        pass
+
+    @abstractmethod
+    def alerts(self, city=None, since=None):
+        """Alerts at or after since, newest first (ties by city, then last written first)."""
+
+    @abstractmethod
+    def upsert_nodes(self, rows):
+        """Insert or replace the node of each row's city."""
+
+    @abstractmethod
+    def nodes(self):
+        """All nodes, ordered by city."""
+
+    def flush(self):
+        """Make everything appended so far durable and visible to other processes."""
+
+    def close(self):
+        self.flush()
+
+class SQLiteBackend(StorageBackend):
+    """The moodcast.db tables, read through a storage.ReadPool.
+
+    Writes go through one writer connection and bump data_versions like
+    the ingest writer does, so the API response cache stays correct. The
+    schema must exist (database.init_db()); range queries include the
+    rotated raw partitions.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path=DB_PATH, readonly=False):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.pool = storage.ReadPool(db_path)
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+    def _write(self, table, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        if self.readonly:
+            raise ValueError("Storage backend was opened read-only")
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = storage.writer_connection(self.db_path)
+            try:
+                self._writer.execute("BEGIN")
+                self._writer.executemany(ingest.INSERT_SQL[table], rows)
+                scopes = {row[0] for row in rows} | {'*'}
+                self._writer.executemany(ingest.BUMP_VERSION_SQL, [(scope,) for scope in scopes])
+                self._writer.commit()
+            except sqlite3.Error:
+                self._writer.rollback()
+                raise
+
+    def append_readings(self, rows):
+        self._write('sensor_data', rows)
+
+    def range_query(self, since, until=None, cities=None, sources=None):
+        with self.pool.connection() as conn:
+            return export.read_columns(conn, cities=cities, since=since, until=until,
+                                       sources=sources, resolution='raw')
+
+    def latest(self, cities=None, sources=None):
+        found = {}
+        with self.pool.connection() as conn:
+            # Newest table first; older partitions only for cities not seen yet
+            for table in retention.raw_tables(conn):
+                newest = {}
+                for city, source in conn.execute(f"SELECT DISTINCT city, source FROM {table}").fetchall():
+                    if city in found or (cities and city not in cities) or (sources and source not in sources):
+                        continue
+                    # One (city, source, ts_ms) index probe per series
+                    row = conn.execute(f"""
+                        SELECT {', '.join(READING_COLUMNS)}, id
+                        FROM {table}
+                        WHERE city = ? AND source IS ?
+                        ORDER BY ts_ms DESC, id DESC LIMIT 1
+                    """, (city, source)).fetchone()
+                    if city not in newest or row[-2:] > newest[city][-2:]:
+                        newest[city] = row
+                found.update((city, row[:-1]) for city, row in newest.items())
+                if cities and all(city in found for city in cities):
+                    break
+        return found
+
+    def append_alerts(self, rows):
+        self._write('alerts', rows)
+
+    def alerts(self, city=None, since=None):
+        where = ["ts_ms >= ?"]
+        params = [retention.sql_ms(since) if since is not None else -2 ** 63]
+        if city:
+            where.append("city = ?")
+            params.append(city)
+        with self.pool.connection() as conn:
+            return conn.execute(f"""
+                SELECT {', '.join(ALERT_COLUMNS)}
+                FROM alerts
+                WHERE {' AND '.join(where)}
+                ORDER BY ts_ms DESC, city, id DESC
+            """, params).fetchall()
+
+    def upsert_nodes(self, rows):
+        self._write('iot_nodes', rows)
+
+    def nodes(self):
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT {', '.join(NODE_COLUMNS)} FROM iot_nodes ORDER BY city").fetchall()
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        self.pool.close()
+
+def _arrays(rows, columns):
+    """Rows as column arrays: text as objects, ts_ms as int64, other numbers float64 with NaN for NULL."""
+    values = dict(zip(columns, zip(*rows))) if rows else {name: () for name in columns}
+    arrays = {}
+    for name in columns:
+        if name in TEXT_COLUMNS:
+            arrays[name] = np.array(values[name], dtype=object)
+        elif name == 'ts_ms':
+            arrays[name] = np.array(values[name], dtype=np.int64)
+        else:
+            arrays[name] = np.array([np.nan if v is None else v for v in values[name]], dtype=float)
+    return arrays
+
+def _row(arrays, columns, i):
+    """Row i of column arrays as a tuple of Python values, the way sqlite3 returns it."""
+    row = []
+    for name in columns:
+        value = arrays[name][i]
+        if name in TEXT_COLUMNS:
+            row.append(value)
+        elif name == 'ts_ms':
+            row.append(int(value))
+        else:
+            row.append(None if math.isnan(value) else float(value))
+    return tuple(row)
+
+def _arrow_type(name):
+    if name in TEXT_COLUMNS:
+        return pa.string()
+    return pa.int64() if name == 'ts_ms' else pa.float64()
+
+class ColumnarBackend(StorageBackend):
+    """Embedded columnar store laid out for time series.
+
+    Readings and alerts are kept per city as immutable Parquet segments,
+    each sorted by ts_ms, under <path>/<table>/<city>/. A segment's file
+    name carries its sequence range, time range and row count, so range
+    queries skip non-overlapping segments without opening them and
+    binary-search ts_ms inside the rest. Appends are buffered per city and
+    cut into a segment once SEGMENT_ROWS are waiting or FLUSH_INTERVAL has
+    passed; until then they are visible to this instance only. Once more
+    than COMPACT_SEGMENTS small segments pile up for a city they are merged
+    into one. Nodes are a single small Parquet file rewritten on flush.
+
+    One process writes; others open the same path with readonly=True.
+    Segments are written to a temporary name and renamed into place, and
+    readers ignore segments whose sequence range a merged one covers, so a
+    reader never sees partial or duplicated data.
+    """
+
+    name = 'columnar'
+    TABLES = {'readings': READING_COLUMNS, 'alerts': ALERT_COLUMNS}
+
+    def __init__(self, path=TIMESERIES_PATH, readonly=False, segment_rows=SEGMENT_ROWS,
+                 flush_interval=FLUSH_INTERVAL, compact_segments=COMPACT_SEGMENTS):
+        if pa is None:
+            raise ValueError("The columnar storage backend needs pyarrow")
+        self.path = path
+        self.readonly = readonly
+        self.segment_rows = segment_rows
+        self.flush_interval = flush_interval
+        self.compact_segments = compact_segments
+        self._lock = threading.RLock()
+        self._buffers = {}  # (table, city) -> rows not yet in a segment
+        self._last_flush = time.monotonic()
+        self._cache = OrderedDict()
+        self._nodes = {}
+        self._nodes_mtime = None
+        self._nodes_dirty = False
+        self._seq = 0
+        if not readonly:
+            for table in self.TABLES:
+                os.makedirs(os.path.join(path, table), exist_ok=True)
+            self._seq = self._recover()
+        self._load_nodes()
+
+    # -- segments --
+
+    def _city_dir(self, table, city):
+        return os.path.join(self.path, table, quote(city, safe=''))
+
+    def _cities(self, table):
+        try:
+            names = {unquote(name) for name in os.listdir(os.path.join(self.path, table))}
+        except FileNotFoundError:
+            names = set()
+        return names | {city for (t, city), rows in self._buffers.items() if t == table and rows}
+
+    def _segments(self, table, city, live_only=True):
+        """[(seq_lo, seq_hi, min_ts, max_ts, rows, path)] for a city, oldest first."""
+        directory = self._city_dir(table, city)
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        segments = []
+        for name in names:
+            if not name.endswith('.parquet'):
+                continue
+            seqs, min_ts, max_ts, rows = name[:-len('.parquet')].split('_')
+            seq_lo, seq_hi = seqs.split('-')
+            segments.append((int(seq_lo), int(seq_hi), int(min_ts), int(max_ts), int(rows),
+                             os.path.join(directory, name)))
+        segments.sort()
+        if not live_only:
+            return segments
+        # A merge leaves its inputs behind until they are removed: skip covered segments
+        return [s for s in segments
+                if not any(o is not s and o[0] <= s[0] and s[1] <= o[1] for o in segments)]
+
+    def _read(self, segment, columns):
+        path = segment[5]
+        with self._lock:
+            arrays = self._cache.get(path)
+            if arrays is not None:
+                self._cache.move_to_end(path)
+                return arrays
+        table = pq.read_table(path)
+        arrays = {}
+        for name in columns:
+            column = table.column(name)
+            if name in TEXT_COLUMNS:
+                arrays[name] = np.array(column.to_pylist(), dtype=object)
+            else:
+                arrays[name] = column.to_numpy()
+        with self._lock:
+            self._cache[path] = arrays
+            while len(self._cache) > SEGMENT_CACHE:
+                self._cache.popitem(last=False)
+        return arrays
+
+    def _write_segment(self, table, city, arrays, seq_lo, seq_hi):
+        columns = self.TABLES[table]
+        count = len(arrays['ts_ms'])
+        directory = self._city_dir(table, city)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{seq_lo:010d}-{seq_hi:010d}_{int(arrays['ts_ms'][0])}_{int(arrays['ts_ms'][-1])}_{count}.parquet"
+        batch = pa.table({
+            column: pa.array([None if v is None or (isinstance(v, float) and math.isnan(v)) else v
+                              for v in arrays[column].tolist()], type=_arrow_type(column))
+            for column in columns
+        })
+        tmp = os.path.join(directory, f".{name}.tmp")
+        pq.write_table(batch, tmp, compression='zstd')
+        os.replace(tmp, os.path.join(directory, name))
+
+    def _recover(self):
+        """Drop leftovers of an interrupted flush or merge; return the next sequence number."""
+        seq = 0
+        for table in self.TABLES:
+            for city in self._cities(table):
+                directory = self._city_dir(table, city)
+                for name in os.listdir(directory):
+                    if name.endswith('.tmp'):
+                        os.remove(os.path.join(directory, name))
+                live = self._segments(table, city)
+                for segment in self._segments(table, city, live_only=False):
+                    if segment not in live:
+                        os.remove(segment[5])
+                seq = max([seq] + [s[1] + 1 for s in live])
+        return seq
+
+    def _cut(self, table, city):
+        rows = self._buffers.pop((table, city), None)
+        if not rows:
+            return
+        columns = self.TABLES[table]
+        ts_index = columns.index('ts_ms')
+        rows.sort(key=lambda row: row[ts_index])  # stable: equal times keep write order
+        self._write_segment(table, city, _arrays(rows, columns), self._seq, self._seq)
+        self._seq += 1
+        self._compact(table, city)
+
+    def _compact(self, table, city):
+        segments = self._segments(table, city)
+        # Only the run of small segments after the newest large one, so sequence ranges never interleave
+        tail = []
+        for segment in reversed(segments):
+            if segment[4] >= self.segment_rows:
+                break
+            tail.append(segment)
+        if len(tail) <= self.compact_segments:
+            return
+        tail.reverse()
+        columns = self.TABLES[table]
+        parts = [self._read(segment, columns) for segment in tail]
+        merged = {name: np.concatenate([part[name] for part in parts]) for name in columns}
+        order = np.argsort(merged['ts_ms'], kind='stable')
+        merged = {name: array[order] for name, array in merged.items()}
+        self._write_segment(table, city, merged, tail[0][0], tail[-1][1])
+        for segment in tail:
+            os.remove(segment[5])
+            with self._lock:
+                self._cache.pop(segment[5], None)
+        logger.debug(f"Merged {len(tail)} {table} segments for {city}")
+
+    def _append(self, table, rows):
+        if self.readonly:
+            raise ValueError("Storage backend was opened read-only")
+        with self._lock:
+            for row in rows:
+                buffer = self._buffers.setdefault((table, row[0]), [])
+                buffer.append(tuple(row))
+                if len(buffer) >= self.segment_rows:
+                    self._cut(table, row[0])
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def _scan(self, table, city, since_ms, until_ms):
+        """Column arrays for one city with since_ms <= ts_ms < until_ms, in time order."""
+        columns = self.TABLES[table]
+        parts = []
+        for segment in self._segments(table, city):
+            if segment[3] < since_ms or segment[2] >= until_ms:
+                continue
+            arrays = self._read(segment, columns)
+            lo, hi = np.searchsorted(arrays['ts_ms'], [since_ms, until_ms])
+            if hi > lo:
+                parts.append({name: array[lo:hi] for name, array in arrays.items()})
+        with self._lock:
+            pending = list(self._buffers.get((table, city), ()))
+        if pending:
+            arrays = _arrays(pending, columns)
+            keep = np.flatnonzero((arrays['ts_ms'] >= since_ms) & (arrays['ts_ms'] < until_ms))
+            # The buffer is in write order, not time order
+            keep = keep[np.argsort(arrays['ts_ms'][keep], kind='stable')]
+            parts.append({name: array[keep] for name, array in arrays.items()})
+        if not parts:
+            return _arrays([], columns)
+        merged = {name: np.concatenate([part[name] for part in parts]) for name in columns}
+        if len(parts) > 1:
+            # Late readings can land in a newer segment than later ones
+            order = np.argsort(merged['ts_ms'], kind='stable')
+            merged = {name: array[order] for name, array in merged.items()}
+        return merged
+
+    @staticmethod
+    def _bounds(since, until):
+        since_ms = retention.sql_ms(since) if since is not None else -2 ** 63
+        until_ms = retention.sql_ms(until) if until is not None else 2 ** 63 - 1
+        return since_ms, until_ms
+
+    # -- interface --
+
+    def append_readings(self, rows):
+        self._append('readings', rows)
+
+    def range_query(self, since, until=None, cities=None, sources=None):
+        since_ms, until_ms = self._bounds(since, until)
+        parts = []
+        for city in sorted(cities if cities else self._cities('readings')):
+            arrays = self._scan('readings', city, since_ms, until_ms)
+            if sources:
+                keep = np.isin(arrays['source'], list(sources))
+                arrays = {name: array[keep] for name, array in arrays.items()}
+            parts.append(arrays)
+        # Same shape as export.read_columns(): every number as float64
+        return {name: np.concatenate([part[name] for part in parts]).astype(object if name in TEXT_COLUMNS else float)
+                if parts else np.array([]) for name in READING_COLUMNS}
+
+    def latest(self, cities=None, sources=None):
+        found = {}
+        for city in cities if cities else self._cities('readings'):
+            best = None  # (ts_ms, recency, row)
+            with self._lock:
+                pending = list(self._buffers.get(('readings', city), ()))
+            if pending:
+                arrays = _arrays(pending, READING_COLUMNS)
+                for i, row in enumerate(pending):
+                    if (not sources or row[10] in sources) and (best is None or row[-1] >= best[0]):
+                        best = (row[-1], i, _row(arrays, READING_COLUMNS, i))
+            # Newest segments first; stop once none can hold anything newer
+            for segment in sorted(self._segments('readings', city), key=lambda s: (s[3], s[0]), reverse=True):
+                if best is not None and segment[3] < best[0]:
+                    break
+                arrays = self._read(segment, READING_COLUMNS)
+                candidates = np.flatnonzero(np.isin(arrays['source'], list(sources))) if sources \
+                    else np.arange(len(arrays['ts_ms']))
+                if not len(candidates):
+                    continue
+                i = candidates[-1]  # sorted by time, so the last match is the newest
+                if best is None or arrays['ts_ms'][i] > best[0]:
+                    best = (int(arrays['ts_ms'][i]), -1, _row(arrays, READING_COLUMNS, i))
+            if best is not None:
+                found[city] = best[2]
+        return found
+
+    def append_alerts(self, rows):
+        self._append('alerts', rows)
+
+    def alerts(self, city=None, since=None):
+        since_ms, until_ms = self._bounds(since, None)
+        rows = []
+        for name in [city] if city else sorted(self._cities('alerts')):
+            arrays = self._scan('alerts', name, since_ms, until_ms)
+            # Scans come back in write order within each time: reverse to last written first
+            rows.extend(reversed([_row(arrays, ALERT_COLUMNS, i) for i in range(len(arrays['ts_ms']))]))
+        # Stable, so equal times stay ordered by city
+        rows.sort(key=lambda row: row[-1], reverse=True)
+        return rows
+
+    def _nodes_file(self):
+        return os.path.join(self.path, 'nodes.parquet')
+
+    def _load_nodes(self):
+        try:
+            mtime = os.stat(self._nodes_file()).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._nodes_mtime:
+            return
+        rows = pq.read_table(self._nodes_file()).to_pylist()
+        self._nodes = {row['city']: tuple(row[name] for name in NODE_COLUMNS) for row in rows}
+        self._nodes_mtime = mtime
+
+    def upsert_nodes(self, rows):
+        if self.readonly:
+            raise ValueError("Storage backend was opened read-only")
+        with self._lock:
+            for row in rows:
+                self._nodes[row[0]] = tuple(row)
+            self._nodes_dirty = True
+
+    def nodes(self):
+        with self._lock:
+            if self.readonly:
+                self._load_nodes()
+            return [self._nodes[city] for city in sorted(self._nodes)]
+
+    def flush(self):
+        if self.readonly:
+            return
+        with self._lock:
+            for table, city in list(self._buffers):
+                self._cut(table, city)
+            if self._nodes_dirty:
+                rows = [self._nodes[city] for city in sorted(self._nodes)]
+                batch = pa.table({name: pa.array([row[i] for row in rows], type=_arrow_type(name))
+                                  for i, name in enumerate(NODE_COLUMNS)})
+                tmp = self._nodes_file() + '.tmp'
+                pq.write_table(batch, tmp)
+                os.replace(tmp, self._nodes_file())
+                self._nodes_dirty = False
+            self._last_flush = time.monotonic()
+
+BACKENDS = {'sqlite': SQLiteBackend, 'columnar': ColumnarBackend}
+
+def open_backend(name=None, path=None, readonly=False):
+    """Open the configured history backend (MOODCAST_HISTORY_BACKEND) at its default or a given path."""
+    name = name or HISTORY_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown history backend {name}; expected one of {list(BACKENDS)}")
+    backend = BACKENDS[name]
+    if path is None:
+        path = DB_PATH if backend is SQLiteBackend else TIMESERIES_PATH
+    return backend(path, readonly=readonly)
+
+# -- contract --
+
+CONTRACT_START_MS = 1_704_067_200_000  # 2024-01-01T00:00:00Z
+
+class ContractError(Exception):
+    """A backend returned something the StorageBackend contract does not allow."""
+
+def _expect(condition, message):
+    if not condition:
+        raise ContractError(message)
+
+def _at(ms):
+    return datetime.fromtimestamp(ms / 1000, timezone.utc)
+
+def _contract_readings():
+    """Readings for three cities, written out of time order, with NULLs and two sources."""
+    rows = []
+    for i in range(120):
+        city = ('Auckland', 'New York', 'São Paulo')[i % 3]
+        source = 'openweathermap' if i % 4 else 'openmeteo'
+        ts_ms = CONTRACT_START_MS + ((i * 37) % 120) * 60_000
+        rain = None if i % 5 == 0 else round(i * 0.1, 1)
+        moment = retention.sql_time(ts_ms / 1000)
+        rows.append((city, -36.85, 174.76, 10 + i * 0.25, 60.0 + i % 30, 1013.0 - i * 0.1, 3.5, 40.0 + i % 50,
+                     rain, moment, source, 55.5, ts_ms))
+    return rows
+
+def _contract_alerts():
+    return [(('Auckland', 'Tokyo')[i % 2], 'wind', f"Wind alert {i}", retention.sql_time(CONTRACT_START_MS / 1000 + i // 2 * 60),
+             'high' if i % 3 else 'low', CONTRACT_START_MS + i // 2 * 60_000) for i in range(20)]
+
+def _same_columns(actual, expected):
+    for name in READING_COLUMNS:
+        a, e = np.asarray(actual[name]), np.asarray(expected[name])
+        _expect(len(a) == len(e), f"{name}: {len(a)} values, expected {len(e)}")
+        if name in TEXT_COLUMNS:
+            _expect(list(a) == list(e), f"{name} values differ")
+        else:
+            _expect(np.array_equal(a.astype(float), e.astype(float), equal_nan=True), f"{name} values differ")
+
+def _expected_range(rows, since_ms, until_ms, cities=None, sources=None):
+    picked = [row for row in rows if since_ms <= row[-1] < until_ms
+              and (not cities or row[0] in cities) and (not sources or row[10] in sources)]
+    # Stable, so readings at the same time keep write order (none share one here)
+    picked.sort(key=lambda row: (row[0], row[-1]))
+    return export.to_columns(picked)
+
+def check_contract(make):
+    """Run the interface contract against make(path), a factory for an empty backend at path.
+
+    The same path is reopened to check persistence. Returns a list of
+    (check, error) for every failed check; empty means the backend passed.
+    """
+    readings = _contract_readings()
+    alerts = _contract_alerts()
+
+    def check_range(backend):
+        since_ms, until_ms = CONTRACT_START_MS + 30 * 60_000, CONTRACT_START_MS + 90 * 60_000
+        _same_columns(backend.range_query(_at(since_ms), _at(until_ms)), _expected_range(readings, since_ms, until_ms))
+        _same_columns(backend.range_query(_at(since_ms), cities=['New York'], sources=['openmeteo']),
+                      _expected_range(readings, since_ms, 2 ** 63, ['New York'], ['openmeteo']))
+        _same_columns(backend.range_query(_at(CONTRACT_START_MS + 10 ** 9)), _expected_range(readings, CONTRACT_START_MS + 10 ** 9, 2 ** 63))
+
+    def check_latest(backend):
+        for sources in (None, ['openmeteo']):
+            expected = {}
+            for row in readings:
+                if (not sources or row[10] in sources) and (row[0] not in expected or row[-1] >= expected[row[0]][-1]):
+                    expected[row[0]] = row
+            actual = backend.latest(sources=sources)
+            _expect(set(actual) == set(expected), f"latest cities {sorted(actual)}, expected {sorted(expected)}")
+            for city, row in expected.items():
+                _expect(tuple(actual[city]) == row, f"latest {city} is {actual[city]}, expected {row}")
+        _expect(set(backend.latest(cities=['Auckland', 'Nowhere'])) == {'Auckland'}, "latest for unknown city")
+
+    def check_alerts(backend):
+        ordered = sorted(enumerate(alerts), key=lambda item: (-item[1][-1], item[1][0], -item[0]))
+        expected = [row for _, row in ordered]
+        _expect([tuple(r) for r in backend.alerts()] == expected, "alerts not newest first")
+        since_ms = CONTRACT_START_MS + 5 * 60_000
+        _expect([tuple(r) for r in backend.alerts(city='Tokyo', since=_at(since_ms))] ==
+                [r for r in expected if r[0] == 'Tokyo' and r[-1] >= since_ms], "alerts city/since filter")
+
+    def check_nodes(backend):
+        expected = [('Auckland', 'pi-2', 'sensor-9', '2024-01-01 01:00:00', -36.85, 174.76),
+                    ('Tokyo', 'pi-1', 'sensor-1', '2024-01-01 00:00:00', 35.68, 139.65)]
+        _expect([tuple(r) for r in backend.nodes()] == expected, "nodes not replaced per city")
+
+    checks = [('range_query', check_range), ('latest', check_latest), ('alerts', check_alerts), ('nodes', check_nodes)]
+    failures = []
+    with tempfile.TemporaryDirectory(prefix="moodcast_contract_") as directory:
+        path = os.path.join(directory, 'store')
+        backend = make(path)
+        try:
+            # Two appends per table, so stores that cut segments hold more than one
+            backend.append_readings(readings[:70])
+            backend.append_readings(readings[70:])
+            backend.append_alerts(alerts[:11])
+            backend.append_alerts(alerts[11:])
+            backend.upsert_nodes([('Auckland', 'pi-1', 'sensor-1', '2024-01-01 00:00:00', -36.85, 174.76),
+                                  ('Tokyo', 'pi-1', 'sensor-1', '2024-01-01 00:00:00', 35.68, 139.65)])
+            backend.upsert_nodes([('Auckland', 'pi-2', 'sensor-9', '2024-01-01 01:00:00', -36.85, 174.76)])
+            for name, check in checks:
+                try:
+                    check(backend)
+                except ContractError as e:
+                    failures.append((name, str(e)))
+        finally:
+            backend.close()
+        reopened = make(path)
+        try:
+            for name, check in checks:
+                try:
+                    check(reopened)
+                except ContractError as e:
+                    failures.append((f"{name} after reopen", str(e)))
+        finally:
+            reopened.close()
+    return failures
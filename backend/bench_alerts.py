@@ -0,0 +1,66 @@
+import sys
+import time
+import random
+from alert_engine import AlertEngine, PRESSURE_DROP_HPA, PRESSURE_WINDOW_HOURS
+
+# Usage: python bench_alerts.py [readings]
+# Checks that one pressure drop raises a single pressure_drop alert, then
+# measures AlertEngine.observe() per reading over cities reporting once a
+# minute.
+DEFAULT_READINGS = 200_000
+CITIES = [f"City{i:03d}" for i in range(50)]
+SOURCE = 'openweathermap'
+START = 1_704_067_200  # 2024-01-01T00:00:00Z
+
+def reading(pressure):
+    return {'temp': 15.0, 'pressure': pressure, 'wind_speed': 3.0, 'clouds': 20, 'rain': 0}
+
+def pressure_drop_alerts(pressures, step=60):
+    """pressure_drop alerts raised for one city reporting pressures every step seconds."""
+    engine = AlertEngine()
+    raised = []
+    for i, pressure in enumerate(pressures):
+        for alert in engine.observe('Check', SOURCE, reading(pressure), None, START + i * step):
+            if alert['type'] == 'pressure_drop':
+                raised.append(i)
+    return raised
+
+def check_pressure_drop():
+    """Return a list of failures; empty when every case alerts as often as expected."""
+    window = PRESSURE_WINDOW_HOURS * 60
+    cases = {
+        # One drop, then pressure stays low for the rest of the window and beyond
+        'single drop': ([1015.0] * 30 + [1015.0 - PRESSURE_DROP_HPA - 1] * (2 * window), 1),
+        # Drop, recovery, then a second drop
+        'two drops': ([1015.0] * 30 + [1010.0] * 30 + [1015.0] * 30 + [1010.0] * 30, 2),
+        # Steady pressure never alerts
+        'steady': ([1013.0] * window, 0)
+    }
+    failures = []
+    for name, (pressures, expected) in cases.items():
+        raised = pressure_drop_alerts(pressures)
+        if len(raised) != expected:
+            failures.append(f"{name}: {len(raised)} pressure_drop alerts (at readings {raised[:5]}), expected {expected}")
+    return failures
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_READINGS
+    failures = check_pressure_drop()
+    if failures:
+        sys.exit("\n".join(failures))
+    print("pressure_drop: one alert per drop")
+
+    random.seed(0)
+    engine = AlertEngine()
+    pressures = {city: 1013.0 for city in CITIES}
+    alerts = 0
+    started = time.perf_counter()
+    for i in range(count):
+        city = CITIES[i % len(CITIES)]
+        pressures[city] += random.uniform(-0.3, 0.3)
+        alerts += len(engine.observe(city, SOURCE, reading(pressures[city]), None, START + i // len(CITIES) * 60))
+    elapsed = time.perf_counter() - started
+    print(f"{count:,} readings, {alerts:,} alerts, {elapsed / count * 1e6:.2f} us per reading")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import http.client
+import random
+import threading
+import time
+from urllib.parse import urlsplit, urlencode
+import numpy as np
+
+# Usage: python bench_api.py [--url http://localhost:5000] [--clients 32] [--duration 20]
+#                            [--endpoints weather,forecast,alerts] [--bust-cache]
+# Start the server under test first: `python api.py` (Flask threaded) or
+# `python serve.py --workers 4` (ASGI). Each client keeps one keep-alive
+# connection and issues requests back to back, cycling through the
+# endpoints and cities; --bust-cache adds a unique argument so every
+# request misses the response cache and hits SQLite.
+CITY_COORDS = {
+    'Auckland': (-36.8485, 174.7633),
+    'Tokyo': (35.6762, 139.6503),
+    'London': (51.5074, -0.1278),
+    'New York': (40.7128, -74.006),
+    'Sydney': (-33.8688, 151.2093),
+    'Paris': (48.8566, 2.3522),
+    'Singapore': (1.3521, 103.8198),
+    'Dubai': (25.2048, 55.2708),
+    'Mumbai': (19.076, 72.8777),
+    'Cape Town': (-33.9249, 18.4241)
+}
+
+# endpoint -> query args for a city
+ENDPOINTS = {
+    'weather': lambda city, lat, lon: {'lat': lat, 'lon': lon},
+    'forecast': lambda city, lat, lon: {'lat': lat, 'lon': lon},
+    'alerts': lambda city, lat, lon: {'city': city}
+}
+
+def client(url, endpoints, deadline, bust_cache, results, seed):
+    parts = urlsplit(url)
+    conn_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    conn = conn_class(parts.hostname, parts.port, timeout=30)
+    rng = random.Random(seed)
+    cities = list(CITY_COORDS.items())
+    i = 0
+    while time.perf_counter() < deadline:
+        endpoint = endpoints[i % len(endpoints)]
+        city, (lat, lon) = rng.choice(cities)
+        args = ENDPOINTS[endpoint](city, lat, lon)
+        if bust_cache:
+            args['_'] = f"{seed}-{i}"
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', f"{parts.path.rstrip('/')}/{endpoint}?{urlencode(args)}")
+            response = conn.getresponse()
+            response.read()
+            ok = response.status < 500
+            if response.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            ok = False
+            conn.close()
+        results[endpoint].append((time.perf_counter() - started, ok))
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the MoodCast API")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--bust-cache', action='store_true')
+    args = parser.parse_args()
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints {sorted(unknown)}; expected some of {list(ENDPOINTS)}")
+
+    # One list per endpoint per client, merged afterwards, so clients never contend on a lock
+    per_client = [{endpoint: [] for endpoint in endpoints} for _ in range(args.clients)]
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=client, args=(args.url, endpoints, deadline, args.bust_cache, results, n))
+               for n, results in enumerate(per_client)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.clients} clients, {elapsed:.1f}s against {args.url}{' (cache busted)' if args.bust_cache else ''}")
+    print(f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    totals = []
+    for endpoint in endpoints + ['total']:
+        if endpoint == 'total':
+            samples = totals
+        else:
+            samples = [sample for results in per_client for sample in results[endpoint]]
+            totals.extend(samples)
+        if not samples:
+            print(f"{endpoint:<10} {0:>9}")
+            continue
+        latencies = np.array([latency for latency, _ in samples]) * 1000
+        errors = sum(1 for _, ok in samples if not ok)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{endpoint:<10} {len(samples):>9,} {errors:>7,} {len(samples) / elapsed:>9,.1f} "
+              f"{p50:>8.2f} {p99:>8.2f} {latencies.max():>8.2f}")
+
+if __name__ == "__main__":
+    main()
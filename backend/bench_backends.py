@@ -0,0 +1,85 @@
+import random
+import time
+import os
+import sys
+import shutil
+import tempfile
+import logging
+from datetime import timedelta, timezone, datetime
+import database
+import backends
+import retention
+
+logging.getLogger(database.__name__).setLevel(logging.WARNING)
+logging.getLogger(backends.__name__).setLevel(logging.WARNING)
+
+# Usage: python bench_backends.py [rows,rows,...] [backend,backend,...]
+# Runs the storage contract against each backend, then compares ingest
+# rate (appends of ingest.INGEST_BATCH_SIZE rows) and range-scan latency.
+DEFAULT_SIZES = [100_000, 1_000_000]
+CITIES = [f"City{i:03d}" for i in range(50)]
+SOURCES = ['openweathermap', 'openmeteo']
+BATCH = 500
+REPEAT = 20
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+def make(name, path):
+    if name == 'sqlite':
+        database.DB_PATH = path
+        database.init_db()
+    return backends.open_backend(name, path)
+
+def readings(start_row, end_row):
+    for i in range(start_row, end_row):
+        moment = START + timedelta(minutes=i // len(CITIES))
+        yield (CITIES[i % len(CITIES)], 0.0, 0.0, random.uniform(-5, 35), random.uniform(20, 100),
+               random.uniform(990, 1030), random.uniform(0, 15), random.uniform(0, 100), 0.0,
+               retention.sql_time(moment), SOURCES[i % 2], 50.0, retention.sql_ms(moment))
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for i in range(repeat):
+        result = fn(i)
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else DEFAULT_SIZES
+    names = sys.argv[2].split(',') if len(sys.argv) > 2 else list(backends.BACKENDS)
+
+    for name in names:
+        failures = backends.check_contract(lambda path: make(name, path))
+        print(f"{name}: contract {'passed' if not failures else 'FAILED'}")
+        for check, error in failures:
+            print(f"  {check}: {error}")
+
+    print(f"{'backend':<9} {'rows':>10} {'ingest rows/s':>14} {'city 24h ms':>12} {'all 24h ms':>11} "
+          f"{'city 7d ms':>11} {'latest ms':>10}")
+    for name in names:
+        directory = tempfile.mkdtemp(prefix="moodcast_bench_")
+        backend = make(name, os.path.join(directory, 'store'))
+        rows = 0
+        try:
+            for size in sizes:
+                pending = list(readings(rows, size))
+                started = time.perf_counter()
+                for i in range(0, len(pending), BATCH):
+                    backend.append_readings(pending[i:i + BATCH])
+                backend.flush()
+                rate = len(pending) / (time.perf_counter() - started)
+                rows = size
+
+                newest = START + timedelta(minutes=rows // len(CITIES))
+                day, week = newest - timedelta(hours=24), newest - timedelta(days=7)
+                city_ms, _ = timed(lambda i: backend.range_query(day, cities=[CITIES[i % len(CITIES)]]), REPEAT)
+                all_ms, _ = timed(lambda i: backend.range_query(day), max(REPEAT // 10, 1))
+                week_ms, _ = timed(lambda i: backend.range_query(week, cities=[CITIES[i % len(CITIES)]]), REPEAT)
+                latest_ms, found = timed(lambda i: backend.latest(), REPEAT)
+                assert len(found) == len(CITIES), f"latest found {len(found)} cities"
+                print(f"{name:<9} {rows:>10,} {rate:>14,.0f} {city_ms:>12.2f} {all_ms:>11.2f} "
+                      f"{week_ms:>11.2f} {latest_ms:>10.2f}")
+        finally:
+            backend.close()
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
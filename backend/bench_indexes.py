@@ -0,0 +1,139 @@
+import sqlite3
+import random
+import time
+import os
+import sys
+import tempfile
+import logging
+from datetime import datetime, timedelta, timezone
+import database
+
+# Keep the benchmark output readable
+logging.getLogger(database.__name__).setLevel(logging.WARNING)
+
+# Usage: python bench_indexes.py [rows,rows,...]
+# e.g. python bench_indexes.py 100000,1000000,10000000,30000000
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+CITIES = [f"City{i:03d}" for i in range(50)]
+SOURCES = ['openweathermap', 'openmeteo', 'openweathermap_forecast', 'model_prediction']
+REPEAT = 200
+CHUNK = 100_000
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+QUERIES = {
+    'alert_prev_reading': ("""
+        SELECT temp, pressure, wind_speed, clouds, rain, timestamp
+        FROM sensor_data
+        WHERE city = ? AND source = ?
+        ORDER BY ts_ms DESC LIMIT 1 OFFSET 1
+    """, lambda city, since: (city, 'openweathermap')),
+    'weather_quality': ("""
+        SELECT completeness, freshness, missing_fields, error
+        FROM quality_metrics
+        WHERE city = ? ORDER BY timestamp DESC LIMIT 1
+    """, lambda city, since: (city,)),
+    'alerts_city_24h': ("""
+        SELECT city, type, message, timestamp, severity
+        FROM alerts
+        WHERE city = ? AND ts_ms >= ?
+        ORDER BY ts_ms DESC
+    """, lambda city, since: (city, since)),
+    'alerts_all_24h': ("""
+        SELECT city, type, message, timestamp, severity
+        FROM alerts
+        WHERE ts_ms >= ?
+        ORDER BY ts_ms DESC
+    """, lambda city, since: (since,))
+}
+
+def generate(conn, start_row, end_row):
+    """Append synthetic rows [start_row, end_row) with one reading per minute per city."""
+    cursor = conn.cursor()
+    for chunk_start in range(start_row, end_row, CHUNK):
+        chunk_end = min(chunk_start + CHUNK, end_row)
+        sensor_rows = []
+        quality_rows = []
+        alert_rows = []
+        for i in range(chunk_start, chunk_end):
+            city = CITIES[i % len(CITIES)]
+            moment = START + timedelta(minutes=i // len(CITIES))
+            ts = moment.isoformat(timespec='microseconds')
+            ts_ms = int(moment.timestamp() * 1000)
+            sensor_rows.append((
+                city, 0.0, 0.0, random.uniform(-5, 35), random.uniform(20, 100),
+                random.uniform(980, 1030), random.uniform(0, 20), random.uniform(0, 100),
+                random.uniform(0, 10), ts, SOURCES[(i // len(CITIES)) % len(SOURCES)], 50.0, ts_ms
+            ))
+            if i % 10 == 0:
+                quality_rows.append((city, 100, 60, '', ts))
+            if i % 100 == 0:
+                alert_rows.append((city, 'high_wind', 'High wind speed: 16.0 m/s', ts, 'warning', ts_ms))
+        cursor.executemany("""
+            INSERT INTO sensor_data (city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score, ts_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, sensor_rows)
+        cursor.executemany("""
+            INSERT INTO quality_metrics (city, completeness, freshness, missing_fields, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        """, quality_rows)
+        cursor.executemany("""
+            INSERT INTO alerts (city, type, message, timestamp, severity, ts_ms)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, alert_rows)
+        conn.commit()
+
+def drop_indexes(conn):
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")]
+    for name in names:
+        conn.execute(f"DROP INDEX {name}")
+    conn.execute("PRAGMA user_version = 0")
+    conn.commit()
+
+def time_queries(conn, rows):
+    # "Last 24 hours" relative to the newest synthetic reading
+    newest = START + timedelta(minutes=rows // len(CITIES))
+    since = int((newest - timedelta(hours=24)).timestamp() * 1000)
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        repeat = REPEAT if name != 'alerts_all_24h' else max(REPEAT // 10, 1)
+        started = time.perf_counter()
+        for i in range(repeat):
+            conn.execute(sql, params(CITIES[i % len(CITIES)], since)).fetchall()
+        results[name] = (time.perf_counter() - started) / repeat * 1000
+    return results
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else DEFAULT_SIZES
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="moodcast_bench_")
+    os.close(fd)
+    database.DB_PATH = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+
+    print(f"{'rows':>12} {'query':<20} {'no index ms':>12} {'indexed ms':>12} {'speedup':>9}")
+    rows = 0
+    try:
+        for size in sizes:
+            drop_indexes(conn)
+            generate(conn, rows, size)
+            rows = size
+            before = time_queries(conn, rows)
+
+            started = time.perf_counter()
+            database.migrate(conn)
+            build_s = time.perf_counter() - started
+            conn.execute("ANALYZE")
+            after = time_queries(conn, rows)
+
+            for name in QUERIES:
+                speedup = before[name] / after[name] if after[name] else float('inf')
+                print(f"{rows:>12,} {name:<20} {before[name]:>12.3f} {after[name]:>12.3f} {speedup:>8.1f}x")
+            print(f"{rows:>12,} {'(index build)':<20} {build_s * 1000:>12.0f} ms")
+    finally:
+        conn.close()
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import sys
+import time
+import random
+from datetime import datetime, timedelta, timezone
+import payloads
+
+# Usage: python bench_payloads.py [messages]
+# Checks that every message decodes to the same values from compact as from
+# JSON, then compares bytes on the wire and encode/decode CPU per message.
+# forecast_run is one 16-step run message, replacing 16 forecast messages.
+DEFAULT_MESSAGES = 20000
+
+def sensor_message(i, now):
+    return {
+        "city": "Auckland",
+        "lat": -36.8485,
+        "lon": 174.7633,
+        "temp": round(random.uniform(5, 25), 2),
+        "humidity": random.randint(40, 95),
+        "pressure": random.randint(990, 1030),
+        "wind_speed": round(random.uniform(0, 20), 2),
+        "clouds": random.randint(0, 100),
+        "rain": round(random.uniform(0, 3), 2),
+        "timestamp": (now + timedelta(seconds=60 * i)).isoformat(),
+        "source": "openweathermap",
+        "mood_score": round(random.uniform(0, 100), 1)
+    }
+
+def forecast_message(i, now):
+    valid = now + timedelta(hours=3 * (i % 16 + 1))
+    return {
+        "city": "Auckland",
+        "lat": -36.8485,
+        "lon": 174.7633,
+        "weather": {
+            "temp": round(random.uniform(5, 25), 2),
+            "humidity": random.randint(40, 95),
+            "pressure": random.randint(990, 1030),
+            "wind_speed": round(random.uniform(0, 20), 2),
+            "clouds": random.randint(0, 100),
+            "rain": round(random.uniform(0, 3), 2)
+        },
+        "timestamp": valid.strftime('%Y-%m-%d %H:%M:%S'),
+        "issue_time": now.strftime('%Y-%m-%d %H:%M:%S'),
+        "source": "openweathermap_forecast",
+        "mood_score": round(random.uniform(0, 100), 1)
+    }
+
+def forecast_run_message(i, now):
+    return payloads.forecast_run([forecast_message(i * 16 + step, now) for step in range(16)])
+
+def round_trip_mismatches(kind, messages):
+    """Messages whose compact encoding decodes to other values than their JSON encoding, as (json, compact)."""
+    mismatches = []
+    for message in messages:
+        from_json = payloads.decode(*payloads.encode(kind, message, 'json'))
+        from_compact = payloads.decode(*payloads.encode(kind, message, 'compact'))
+        if from_json != from_compact:
+            mismatches.append((from_json, from_compact))
+    return mismatches
+
+def measure(kind, messages, fmt):
+    started = time.perf_counter()
+    encoded = [payloads.encode(kind, message, fmt) for message in messages]
+    encode_us = (time.perf_counter() - started) / len(messages) * 1e6
+    wire = [(payload.encode() if isinstance(payload, str) else payload, properties)
+            for payload, properties in encoded]
+    size = sum(len(payload) for payload, _ in wire) / len(wire)
+    started = time.perf_counter()
+    for payload, properties in wire:
+        payloads.decode(payload, properties)
+    decode_us = (time.perf_counter() - started) / len(wire) * 1e6
+    return size, encode_us, decode_us
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MESSAGES
+    random.seed(0)
+    now = datetime.now(timezone.utc)
+    kinds = {kind: [factory(i, now) for i in range(count)]
+             for kind, factory in (('sensor', sensor_message), ('forecast', forecast_message),
+                                   ('forecast_run', forecast_run_message))}
+    for kind, messages in kinds.items():
+        mismatches = round_trip_mismatches(kind, messages)
+        if mismatches:
+            from_json, from_compact = mismatches[0]
+            sys.exit(f"{kind}: {len(mismatches)} of {len(messages)} messages decode differently from compact, "
+                     f"e.g. {from_compact} instead of {from_json}")
+        print(f"{kind}: compact and JSON decode to the same values for all {len(messages):,} messages")
+
+    print(f"{'message':>12} {'format':>8} {'bytes/msg':>10} {'encode us':>10} {'decode us':>10}")
+    for kind, messages in kinds.items():
+        for fmt in ('json', 'compact'):
+            size, encode_us, decode_us = measure(kind, messages, fmt)
+            print(f"{kind:>12} {fmt:>8} {size:>10.1f} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import sqlite3
+import os
+import sys
+import time
+import tempfile
+import logging
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from sklearn.linear_model import LinearRegression
+import database
+import predict_weather
+
+# Usage: python bench_predict.py [city_counts] [workers]
+# e.g. python bench_predict.py 10,50,100,250,500 4
+DEFAULT_COUNTS = [10, 50, 100, 250]
+ROWS_PER_CITY = 1080  # one reading every 4 minutes over 72 hours
+
+logging.getLogger(predict_weather.__name__).setLevel(logging.WARNING)
+logging.getLogger(database.__name__).setLevel(logging.WARNING)
+
+def populate(path, n_cities):
+    conn = sqlite3.connect(path)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rng = np.random.default_rng(0)
+    for c in range(n_cities):
+        rows = []
+        for i in range(ROWS_PER_CITY):
+            ts = now - timedelta(minutes=4 * (ROWS_PER_CITY - i))
+            rows.append((
+                f"City{c:04d}", 0.0, 0.0,
+                15 + 5 * np.sin(i / 60) + rng.normal(), rng.uniform(40, 90), 1013.0, 3.0,
+                rng.uniform(0, 100), rng.uniform(0, 2),
+                ts.strftime('%Y-%m-%d %H:%M:%S'), 'openweathermap', 50.0,
+                int(ts.replace(tzinfo=timezone.utc).timestamp() * 1000)
+            ))
+        conn.executemany("""
+            INSERT INTO sensor_data (city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score, ts_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.commit()
+    conn.close()
+
+def legacy_predict(city):
+    """The previous implementation: one query per city, one model per target."""
+    conn = sqlite3.connect(predict_weather.DB_PATH)
+    df = pd.read_sql_query("""
+        SELECT timestamp, temp, humidity, clouds, rain
+        FROM sensor_data
+        WHERE city = ? AND timestamp >= datetime('now', '-72 hours')
+        ORDER BY timestamp ASC
+    """, conn, params=(city,))
+    conn.close()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df['time_diff'] = (df['timestamp'] - df['timestamp'].min()).dt.total_seconds() / 3600
+    df['hour'] = df['timestamp'].dt.hour
+    now = datetime.utcnow()
+    predictions = []
+    for target in predict_weather.TARGETS:
+        model = LinearRegression()
+        model.fit(df[['time_diff', 'hour']], df[target])
+        future_times = [now + timedelta(hours=i) for i in range(3, 73, 3)]
+        future_features = pd.DataFrame({
+            'time_diff': [(t - df['timestamp'].min()).total_seconds() / 3600 for t in future_times],
+            'hour': [t.hour for t in future_times]
+        })
+        predictions.append(model.predict(future_features))
+    return predictions
+
+def main():
+    counts = [int(c) for c in sys.argv[1].split(',')] if len(sys.argv) > 1 else DEFAULT_COUNTS
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 2
+
+    print(f"{'cities':>7} {'legacy ms/city':>15} {'batched ms/city':>16} {f'pool({workers}) ms/city':>18}")
+    for n in counts:
+        fd, path = tempfile.mkstemp(suffix=".db", prefix="moodcast_bench_")
+        os.close(fd)
+        try:
+            database.DB_PATH = path
+            predict_weather.DB_PATH = path
+            database.init_db()
+            populate(path, n)
+            city_list = [{'name': f"City{c:04d}", 'lat': 0.0, 'lon': 0.0} for c in range(n)]
+
+            started = time.perf_counter()
+            for city in city_list:
+                legacy_predict(city['name'])
+            legacy = (time.perf_counter() - started) / n * 1000
+
+            started = time.perf_counter()
+            results = predict_weather.predict_all(city_list)
+            batched = (time.perf_counter() - started) / n * 1000
+            assert len(results) == n, f"expected {n} cities, got {len(results)}"
+
+            started = time.perf_counter()
+            predict_weather.predict_all(city_list, workers=workers)
+            pooled = (time.perf_counter() - started) / n * 1000
+
+            print(f"{n:>7} {legacy:>15.2f} {batched:>16.2f} {pooled:>18.2f}")
+        finally:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import json
+import selectors
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+from stream import StreamHub
+
+# Load test for the /stream fan-out.
+#
+# Hub mode (default) drives StreamHub in-process: N subscriber threads spread
+# over the cities read their queues while messages are published at a fixed
+# rate, and a fraction of them read slowly to exercise backpressure.
+#   python bench_stream.py --subscribers 5000 --messages 2000
+#
+# HTTP mode holds N concurrent SSE connections against a running api.py and
+# counts the events each one receives.
+#   python bench_stream.py --url http://localhost:5000/stream --subscribers 2000 --duration 60
+
+CITIES = ['Auckland', 'Tokyo', 'London', 'New York', 'Sydney',
+          'Paris', 'Singapore', 'Dubai', 'Mumbai', 'Cape Town']
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def run_hub(args):
+    hub = StreamHub()
+    latencies = []
+    latency_lock = threading.Lock()
+    received = [0] * args.subscribers
+    stop = threading.Event()
+
+    def consume(index, subscription, slow):
+        # Only a sample of subscribers decode frames to measure latency
+        sample = index % 50 == 0
+        local = []
+        while not stop.is_set() and not subscription.closed:
+            frames = subscription.get()
+            received[index] += len(frames)
+            if sample:
+                now = time.perf_counter()
+                for frame in frames:
+                    # frame is b"event: sensor\ndata: {...}\n\n"
+                    local.append(now - json.loads(frame.split(b"data: ", 1)[1])['sent'])
+            if slow:
+                time.sleep(args.slow_delay)
+        if subscription.closed:
+            hub.unsubscribe(subscription)
+        with latency_lock:
+            latencies.extend(local)
+
+    threads = []
+    n_slow = int(args.subscribers * args.slow_fraction)
+    for i in range(args.subscribers):
+        subscription = hub.subscribe([CITIES[i % len(CITIES)]])
+        thread = threading.Thread(target=consume, args=(i, subscription, i < n_slow), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    interval = 1.0 / args.rate if args.rate else 0
+    publish_times = []
+    started = time.perf_counter()
+    for m in range(args.messages):
+        city = CITIES[m % len(CITIES)]
+        t0 = time.perf_counter()
+        hub.publish(city, 'sensor', json.dumps({'city': city, 'seq': m, 'sent': t0}))
+        publish_times.append(time.perf_counter() - t0)
+        if interval:
+            time.sleep(max(0.0, interval - (time.perf_counter() - t0)))
+    elapsed = time.perf_counter() - started
+
+    time.sleep(1.0)
+    stats = hub.stats()
+    stop.set()
+    hub.stop()  # closes every subscription and wakes its reader
+    for thread in threads:
+        thread.join(timeout=2)
+
+    expected = args.messages * args.subscribers // len(CITIES)
+    print(f"subscribers        {args.subscribers} ({n_slow} slow)")
+    print(f"messages           {args.messages} in {elapsed:.2f}s ({args.messages / elapsed:.0f} msg/s)")
+    print(f"frames delivered   {sum(received)} of {expected}")
+    print(f"fan-out per msg    p50 {percentile(publish_times, 50) * 1000:.3f} ms, p99 {percentile(publish_times, 99) * 1000:.3f} ms")
+    print(f"delivery latency   p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"dropped frames     {stats['dropped_frames']}, slow clients disconnected {stats['disconnected_slow']}")
+
+def run_http(args):
+    parts = urlsplit(args.url)
+    host, port = parts.hostname, parts.port or 80
+    selector = selectors.DefaultSelector()
+    events = {}
+    failed = 0
+
+    for i in range(args.subscribers):
+        city = CITIES[i % len(CITIES)]
+        path = f"{parts.path or '/stream'}?city={city.replace(' ', '%20')}"
+        try:
+            sock = socket.create_connection((host, port), timeout=10)
+            sock.sendall(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+            sock.setblocking(False)
+        except OSError:
+            failed += 1
+            continue
+        selector.register(sock, selectors.EVENT_READ, i)
+        events[i] = 0
+
+    print(f"opened {len(events)} connections ({failed} failed), reading for {args.duration}s")
+    closed = 0
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=1):
+            try:
+                data = key.fileobj.recv(65536)
+            except (BlockingIOError, ConnectionError):
+                continue
+            if not data:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                closed += 1
+                continue
+            events[key.data] += data.count(b"event: ")
+
+    counts = sorted(events.values())
+    print(f"connections still open  {len(events) - closed}")
+    print(f"events per connection   min {counts[0] if counts else 0}, p50 {percentile(counts, 50)}, max {counts[-1] if counts else 0}")
+    print(f"total events            {sum(counts)}")
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the MoodCast stream fan-out")
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=500, help="messages per second in hub mode (0 = unthrottled)")
+    parser.add_argument('--slow-fraction', type=float, default=0.01)
+    parser.add_argument('--slow-delay', type=float, default=0.05)
+    parser.add_argument('--url', help="run against a live /stream endpoint instead of in-process")
+    parser.add_argument('--duration', type=float, default=30)
+    args = parser.parse_args()
+    if args.url:
+        run_http(args)
+    else:
+        run_hub(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import sqlite3
+import random
+import time
+import os
+import sys
+import tempfile
+import logging
+from datetime import datetime, timedelta, timezone
+import database
+from alert_engine import parse_timestamp
+
+logging.getLogger(database.__name__).setLevel(logging.WARNING)
+
+# Usage: python bench_timestamps.py [rows,rows,...]
+# Compares TEXT timestamp vs integer ts_ms for range queries, sorts and
+# turning fetched rows into epoch seconds. Half the rows use the
+# mqtt_sensor format (isoformat with offset), half '%Y-%m-%d %H:%M:%S'.
+DEFAULT_SIZES = [100_000, 1_000_000]
+CITIES = [f"City{i:03d}" for i in range(50)]
+SOURCE = 'openweathermap'
+REPEAT = 50
+CHUNK = 100_000
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+QUERIES = {
+    # name -> (TEXT version, ts_ms version)
+    'range_city_24h': (
+        "SELECT timestamp FROM sensor_data WHERE city = ? AND source = ? AND timestamp >= ? ORDER BY timestamp",
+        "SELECT ts_ms FROM sensor_data WHERE city = ? AND source = ? AND ts_ms >= ? ORDER BY ts_ms"
+    ),
+    'latest_per_city': (
+        "SELECT timestamp FROM sensor_data WHERE city = ? AND source = ? ORDER BY timestamp DESC LIMIT 1",
+        "SELECT ts_ms FROM sensor_data WHERE city = ? AND source = ? ORDER BY ts_ms DESC LIMIT 1"
+    ),
+    'sort_all_24h': (
+        "SELECT timestamp FROM sensor_data WHERE timestamp >= ? ORDER BY timestamp",
+        "SELECT ts_ms FROM sensor_data WHERE ts_ms >= ? ORDER BY ts_ms"
+    )
+}
+
+def generate(conn, start_row, end_row):
+    for chunk_start in range(start_row, end_row, CHUNK):
+        rows = []
+        for i in range(chunk_start, min(chunk_start + CHUNK, end_row)):
+            moment = START + timedelta(minutes=i // len(CITIES))
+            text = moment.isoformat() if i % 2 else moment.strftime('%Y-%m-%d %H:%M:%S')
+            rows.append((CITIES[i % len(CITIES)], random.uniform(-5, 35), text, SOURCE, int(moment.timestamp() * 1000)))
+        conn.executemany("INSERT INTO sensor_data (city, temp, timestamp, source, ts_ms) VALUES (?, ?, ?, ?, ?)", rows)
+        conn.commit()
+
+def run(conn, sql, params, repeat):
+    started = time.perf_counter()
+    for i in range(repeat):
+        rows = conn.execute(sql, params(i)).fetchall()
+    return (time.perf_counter() - started) / repeat * 1000, len(rows)
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else DEFAULT_SIZES
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="moodcast_bench_")
+    os.close(fd)
+    database.DB_PATH = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    # The TEXT path gets the index it had before ts_ms
+    conn.execute("CREATE INDEX idx_bench_city_source_ts ON sensor_data (city, source, timestamp DESC)")
+    conn.execute("CREATE INDEX idx_bench_ts ON sensor_data (timestamp)")
+
+    print(f"{'rows':>10} {'query':<16} {'text ms':>9} {'ts_ms ms':>9} {'speedup':>8} {'text rows':>10} {'ts_ms rows':>10}")
+    rows = 0
+    try:
+        for size in sizes:
+            generate(conn, rows, size)
+            rows = size
+            conn.execute("ANALYZE")
+            newest = START + timedelta(minutes=rows // len(CITIES))
+            since = newest - timedelta(hours=24)
+            since_text, since_ms = since.strftime('%Y-%m-%d %H:%M:%S'), int(since.timestamp() * 1000)
+            for name, (text_sql, ms_sql) in QUERIES.items():
+                repeat = REPEAT if name != 'sort_all_24h' else max(REPEAT // 10, 1)
+                if name == 'sort_all_24h':
+                    text_params, ms_params = (lambda i: (since_text,)), (lambda i: (since_ms,))
+                elif name == 'latest_per_city':
+                    text_params = ms_params = lambda i: (CITIES[i % len(CITIES)], SOURCE)
+                else:
+                    text_params = lambda i: (CITIES[i % len(CITIES)], SOURCE, since_text)
+                    ms_params = lambda i: (CITIES[i % len(CITIES)], SOURCE, since_ms)
+                text_ms, text_rows = run(conn, text_sql, text_params, repeat)
+                ms_ms, ms_rows = run(conn, ms_sql, ms_params, repeat)
+                # Row counts differ where mixed TEXT formats compare wrongly as strings
+                print(f"{rows:>10,} {name:<16} {text_ms:>9.3f} {ms_ms:>9.3f} {text_ms / ms_ms:>7.1f}x "
+                      f"{text_rows:>10,} {ms_rows:>10,}")
+
+            # Turning a city's 24 hours into epoch seconds: parse per row vs divide
+            fetched = conn.execute(QUERIES['range_city_24h'][0], (CITIES[0], SOURCE, since_text)).fetchall()
+            started = time.perf_counter()
+            [parse_timestamp(ts) for (ts,) in fetched]
+            parse_us = (time.perf_counter() - started) / max(len(fetched), 1) * 1e6
+            fetched = conn.execute(QUERIES['range_city_24h'][1], (CITIES[0], SOURCE, since_ms)).fetchall()
+            started = time.perf_counter()
+            [ts / 1000 for (ts,) in fetched]
+            divide_us = (time.perf_counter() - started) / max(len(fetched), 1) * 1e6
+            print(f"{rows:>10,} {'to_epoch/row':<16} {parse_us:>7.3f}us {divide_us:>7.3f}us {parse_us / divide_us:>7.1f}x")
+    finally:
+        conn.close()
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
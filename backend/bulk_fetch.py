@@ -0,0 +1,108 @@
+import threading
+import time
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Bulk fetch tuning (overridable from the environment)
+FETCH_RATE = float(os.getenv("MOODCAST_FETCH_RATE", "10"))            # upstream requests per second
+FETCH_BURST = int(os.getenv("MOODCAST_FETCH_BURST", "10"))            # requests allowed back to back
+FETCH_CONCURRENCY = int(os.getenv("MOODCAST_FETCH_CONCURRENCY", "8"))  # requests in flight
+
+class RateLimiter:
+    """Token bucket shared by every worker: rate tokens per second, up to burst saved."""
+
+    def __init__(self, rate=FETCH_RATE, burst=FETCH_BURST):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available; returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class BulkFetcher:
+    """Fetch many locations concurrently and hand results back as they arrive.
+
+    Providers that accept several locations per request are called once per
+    chunk of batch_size locations (fetch_many); the others once per location
+    (fetch_one). Every upstream call takes a token from one RateLimiter and
+    at most concurrency calls are in flight, so a refresh over hundreds of
+    locations takes roughly len(requests) / rate seconds, not the sum of
+    their latencies.
+    """
+
+    def __init__(self, rate=FETCH_RATE, burst=FETCH_BURST, concurrency=FETCH_CONCURRENCY):
+        self.limiter = RateLimiter(rate, burst)
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._stats = {'locations': 0, 'requests': 0, 'failures': 0, 'throttled_s': 0.0}
+
+    def _call(self, fn, arg):
+        throttled = self.limiter.acquire()
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['throttled_s'] += throttled
+        return fn(arg)
+
+    def _one(self, fetch_one, location):
+        return [(location, self._call(fetch_one, location))]
+
+    def _many(self, fetch_many, chunk):
+        results = self._call(fetch_many, chunk)
+        if results is None:
+            return [(location, None) for location in chunk]
+        return list(zip(chunk, results))
+
+    def stream(self, locations, fetch_one=None, fetch_many=None, batch_size=1):
+        """Yield (location, result) pairs in completion order.
+
+        result is whatever fetch_one returns for the location (or the
+        matching element of fetch_many's list), and None when the call
+        raised. Pass fetch_many with batch_size > 1 for multi-location
+        providers.
+        """
+        locations = list(locations)
+        if fetch_many is not None:
+            tasks = [(self._many, fetch_many, locations[i:i + batch_size])
+                     for i in range(0, len(locations), max(batch_size, 1))]
+        else:
+            tasks = [(self._one, fetch_one, location) for location in locations]
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="bulk-fetch") as executor:
+            futures = {executor.submit(method, fn, arg): arg for method, fn, arg in tasks}
+            for future in as_completed(futures):
+                try:
+                    pairs = future.result()
+                except Exception as e:
+                    arg = futures[future]
+                    chunk = arg if isinstance(arg, list) else [arg]
+                    logger.error(f"Bulk fetch failed for {len(chunk)} location(s): {e}")
+                    with self._lock:
+                        self._stats['failures'] += 1
+                    pairs = [(location, None) for location in chunk]
+                with self._lock:
+                    self._stats['locations'] += len(pairs)
+                yield from pairs
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['throttled_s'] = round(snapshot['throttled_s'], 3)
+        return snapshot
@@ -1,5 +1,6 @@
 import sqlite3
 import logging
+import storage
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -7,10 +8,197 @@ logger = logging.getLogger(__name__)
 
 DB_PATH = "moodcast.db"
 
+# Epoch milliseconds for a stored TEXT timestamp (ISO-8601 with or without
+# offset, or '%Y-%m-%d %H:%M:%S' UTC); NULL when SQLite cannot parse it
+TS_MS_SQL = "CAST(ROUND((julianday({column}) - 2440587.5) * 86400000.0) AS INTEGER)"
+
+def _add_ts_ms(conn):
+    """Add and backfill ts_ms on sensor_data, its raw partitions, the rollups and alerts."""
+    tables = ['sensor_data', 'alerts', 'sensor_rollup_5m', 'sensor_rollup_1h', 'sensor_rollup_1d']
+    tables += [row[0] for row in conn.execute("SELECT name FROM sensor_partitions")]
+    for table in tables:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if not columns:
+            continue
+        if 'ts_ms' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN ts_ms INTEGER")
+        conn.execute(f"UPDATE {table} SET ts_ms = {TS_MS_SQL.format(column='timestamp')} WHERE ts_ms IS NULL")
+        if table.startswith('sensor_data_p'):
+            conn.execute(f"DROP INDEX IF EXISTS idx_{table}_city_source_ts")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_city_source_ts_ms ON {table} (city, source, ts_ms)")
+
+# Versioned schema migrations, applied in order on top of the base tables.
+# PRAGMA user_version records the last applied version, so existing
+# moodcast.db files are upgraded in place. Append new entries; never edit
+# or reorder ones that have shipped. A step is a SQL string or, for work
+# that depends on what the database holds, a callable taking the connection.
+MIGRATIONS = [
+    (1, "Add indexes matched to the API and alert queries", [
+        # Latest reading per city/source (check_weather_alerts, /weather, predict_weather)
+        """CREATE INDEX IF NOT EXISTS idx_sensor_data_city_source_ts
+           ON sensor_data (city, source, timestamp DESC)""",
+        # /weather quality lookup: latest metrics per city
+        """CREATE INDEX IF NOT EXISTS idx_quality_metrics_city_ts
+           ON quality_metrics (city, timestamp)""",
+        # /alerts?city=...: covers the whole SELECT list
+        """CREATE INDEX IF NOT EXISTS idx_alerts_city_ts
+           ON alerts (city, timestamp, type, severity, message)""",
+        # /alerts without city: last 24 hours across all cities
+        """CREATE INDEX IF NOT EXISTS idx_alerts_ts
+           ON alerts (timestamp)"""
+    ]),
+    (2, "Add locations registry for lat/lon resolution", [
+        """CREATE TABLE IF NOT EXISTS locations (
+               city TEXT PRIMARY KEY,
+               lat REAL NOT NULL,
+               lon REAL NOT NULL,
+               updated_at TEXT
+           )""",
+        # Seed from the coordinates of each city's latest reading, then from IoT nodes
+        """INSERT OR IGNORE INTO locations (city, lat, lon, updated_at)
+           SELECT city, lat, lon, timestamp FROM (
+               SELECT city, lat, lon, timestamp, MAX(id)
+               FROM sensor_data
+               WHERE source IN ('openweathermap', 'openmeteo') AND lat IS NOT NULL AND lon IS NOT NULL
+               GROUP BY city
+           )""",
+        """INSERT OR IGNORE INTO locations (city, lat, lon, updated_at)
+           SELECT city, lat, lon, last_seen FROM iot_nodes
+           WHERE lat IS NOT NULL AND lon IS NOT NULL"""
+    ]),
+    (3, "Add data_versions write counters for API cache invalidation", [
+        """CREATE TABLE IF NOT EXISTS data_versions (
+               scope TEXT PRIMARY KEY,
+               version INTEGER NOT NULL DEFAULT 0
+           )"""
+    ]),
+    (4, "Add raw partition registry and 5m/1h/1d rollup tables", [
+        # One row per raw partition rotated out of sensor_data (see retention.py)
+        """CREATE TABLE IF NOT EXISTS sensor_partitions (
+               name TEXT PRIMARY KEY,
+               min_ts TEXT,
+               max_ts TEXT,
+               row_count INTEGER,
+               created_at TEXT
+           )""",
+        *[f"""CREATE TABLE IF NOT EXISTS sensor_rollup_{resolution} (
+                  city TEXT NOT NULL,
+                  source TEXT NOT NULL,
+                  timestamp TEXT NOT NULL,
+                  lat REAL,
+                  lon REAL,
+                  temp REAL,
+                  temp_min REAL,
+                  temp_max REAL,
+                  humidity REAL,
+                  pressure REAL,
+                  wind_speed REAL,
+                  wind_speed_max REAL,
+                  clouds REAL,
+                  rain REAL,
+                  mood_score REAL,
+                  samples INTEGER NOT NULL,
+                  PRIMARY KEY (city, source, timestamp)
+              ) WITHOUT ROWID""" for resolution in ('5m', '1h', '1d')]
+    ]),
+    (5, "Move forecasts out of sensor_data into an upserted forecasts table", [
+        """CREATE TABLE IF NOT EXISTS forecasts (
+               city TEXT NOT NULL,
+               source TEXT NOT NULL,
+               issue_time TEXT NOT NULL,
+               valid_time TEXT NOT NULL,
+               lat REAL,
+               lon REAL,
+               temp REAL,
+               humidity REAL,
+               pressure REAL,
+               wind_speed REAL,
+               clouds REAL,
+               rain REAL,
+               mood_score REAL,
+               PRIMARY KEY (city, source, issue_time, valid_time)
+           ) WITHOUT ROWID""",
+        # Newest issue_time per city and source
+        """CREATE TABLE IF NOT EXISTS forecast_runs (
+               city TEXT NOT NULL,
+               source TEXT NOT NULL,
+               issue_time TEXT NOT NULL,
+               PRIMARY KEY (city, source)
+           ) WITHOUT ROWID""",
+        # A newer run replaces the older ones, so storage stays horizon x locations
+        """CREATE TRIGGER IF NOT EXISTS forecasts_track_run AFTER INSERT ON forecasts
+           BEGIN
+               INSERT INTO forecast_runs (city, source, issue_time)
+               VALUES (NEW.city, NEW.source, NEW.issue_time)
+               ON CONFLICT(city, source) DO UPDATE SET issue_time = MAX(issue_time, excluded.issue_time);
+               DELETE FROM forecasts
+               WHERE city = NEW.city AND source = NEW.source AND issue_time < NEW.issue_time;
+           END""",
+        """CREATE VIEW IF NOT EXISTS latest_forecasts AS
+           SELECT f.city, f.source, f.issue_time, f.valid_time, f.lat, f.lon, f.temp, f.humidity,
+                  f.pressure, f.wind_speed, f.clouds, f.rain, f.mood_score
+           FROM forecast_runs r
+           JOIN forecasts f ON f.city = r.city AND f.source = r.source AND f.issue_time = r.issue_time""",
+        # Legacy forecast rows have no issue time: keep the newest value per step as one run
+        """INSERT OR IGNORE INTO forecasts (city, source, issue_time, valid_time, lat, lon, temp, humidity,
+                                           pressure, wind_speed, clouds, rain, mood_score)
+           SELECT city, source, '1970-01-01 00:00:00', timestamp, lat, lon, temp, humidity,
+                  pressure, wind_speed, clouds, rain, mood_score
+           FROM (
+               SELECT *, MAX(id) FROM sensor_data
+               WHERE source IN ('openweathermap_forecast', 'model_prediction') AND timestamp IS NOT NULL
+               GROUP BY city, source, timestamp
+           )""",
+        "DELETE FROM sensor_data WHERE source IN ('openweathermap_forecast', 'model_prediction')"
+    ]),
+    (6, "Add node_health snapshot maintained from quality messages", [
+        """CREATE TABLE IF NOT EXISTS node_health (
+               city TEXT PRIMARY KEY,
+               pi_id TEXT,
+               sensor_id TEXT,
+               lat REAL,
+               lon REAL,
+               last_seen REAL,
+               first_seen REAL,
+               messages INTEGER NOT NULL DEFAULT 0,
+               uptime_pct REAL,
+               message_rate REAL,
+               gap_avg REAL,
+               gap_max REAL,
+               outages INTEGER NOT NULL DEFAULT 0,
+               logs TEXT
+           )""",
+        # Seed from iot_nodes, converting the ISO last_seen to epoch seconds once
+        """INSERT OR IGNORE INTO node_health (city, pi_id, sensor_id, lat, lon, last_seen, first_seen, messages, logs)
+           SELECT city, pi_id, sensor_id, lat, lon,
+                  (julianday(last_seen) - 2440587.5) * 86400.0,
+                  (julianday(last_seen) - 2440587.5) * 86400.0,
+                  1, '[]'
+           FROM iot_nodes"""
+    ]),
+    (7, "Add integer epoch-millisecond ts_ms columns for range queries and sorts", [
+        _add_ts_ms,
+        # ts_ms replaces timestamp in every range filter and ORDER BY
+        "DROP INDEX IF EXISTS idx_sensor_data_city_source_ts",
+        """CREATE INDEX IF NOT EXISTS idx_sensor_data_city_source_ts_ms
+           ON sensor_data (city, source, ts_ms DESC)""",
+        "DROP INDEX IF EXISTS idx_alerts_city_ts",
+        "DROP INDEX IF EXISTS idx_alerts_ts",
+        """CREATE INDEX IF NOT EXISTS idx_alerts_city_ts_ms
+           ON alerts (city, ts_ms, type, severity, message, timestamp)""",
+        """CREATE INDEX IF NOT EXISTS idx_alerts_ts_ms
+           ON alerts (ts_ms)""",
+        *[f"""CREATE INDEX IF NOT EXISTS idx_sensor_rollup_{resolution}_ts_ms
+              ON sensor_rollup_{resolution} (ts_ms)""" for resolution in ('5m', '1h', '1d')]
+    ])
+]
+
 def init_db():
     """Initialize the database with required tables."""
+    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
+        # Also switches the file to WAL, which every later connection inherits
+        conn = storage.connect(DB_PATH)
         cursor = conn.cursor()
 
         # Sensor data table
@@ -75,10 +263,39 @@ def init_db():
         logger.info("Created/verified alerts table")
 
         conn.commit()
+        migrate(conn)
     except sqlite3.Error as e:
         logger.error(f"Database initialization error: {e}")
     finally:
-        conn.close()
+        if conn:
+            conn.close()
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to target (default: latest), one transaction each."""
+    current = get_schema_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            # PRAGMA does not accept bound parameters
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            logger.error(f"Migration {version} ({description}) failed")
+            raise
+        logger.info(f"Applied migration {version}: {description}")
+        current = version
+    return current
 
 if __name__ == "__main__":
     init_db()
\ No newline at end of file
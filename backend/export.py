@@ -0,0 +1,230 @@
+import sqlite3
+import numpy as np
+import argparse
+import csv
+import io
+import json
+import zlib
+import sys
+import logging
+from datetime import datetime, timedelta, timezone
+from alert_engine import parse_timestamp
+import retention
+import storage
+
+# Arrow IPC and Parquet output need pyarrow; CSV and NDJSON work without it
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DB_PATH = "moodcast.db"
+CHUNK_SIZE = 5000            # rows fetched, encoded and flushed at a time
+DEFAULT_HOURS = 24           # history window when no start is given
+COLUMNS = retention.RANGE_COLUMNS
+TEXT_COLUMNS = ('city', 'timestamp', 'source')
+INTEGER_COLUMNS = ('ts_ms',)
+
+FORMATS = {
+    # name -> (mimetype, file extension, needs pyarrow)
+    'csv': ('text/csv', 'csv', False),
+    'ndjson': ('application/x-ndjson', 'ndjson', False),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows', True),
+    'parquet': ('application/vnd.apache.parquet', 'parquet', True)
+}
+
+def parse_time(value):
+    """Parse an ISO-8601 time (naive means UTC) into an aware datetime."""
+    return datetime.fromtimestamp(parse_timestamp(value), timezone.utc)
+
+def available_formats():
+    return [name for name, (_, _, needs_arrow) in FORMATS.items() if pa is not None or not needs_arrow]
+
+def iter_chunks(conn, cities=None, since=None, until=None, sources=None, resolution=None,
+                max_points=None, chunk_size=CHUNK_SIZE):
+    """Yield (resolution, rows) chunks of sensor history ordered by city and time.
+
+    Rows are COLUMNS tuples read with fetchmany, so memory is bounded by
+    chunk_size whatever the range. The first chunk is yielded even when
+    empty, so callers always learn the resolution that served the range.
+    """
+    since = since or datetime.now(timezone.utc) - timedelta(hours=DEFAULT_HOURS)
+    resolution, source, params = retention.range_source(
+        conn, since, until, resolution=resolution, max_points=max_points)
+    where = ["ts_ms >= ?"]
+    params = [*params, retention.sql_ms(since)]
+    if until:
+        where.append("ts_ms < ?")
+        params.append(retention.sql_ms(until))
+    if cities:
+        where.append(f"city IN ({','.join('?' for _ in cities)})")
+        params.extend(cities)
+    if sources:
+        where.append(f"source IN ({','.join('?' for _ in sources)})")
+        params.extend(sources)
+    cursor = conn.execute(f"""
+        SELECT {', '.join(COLUMNS)}
+        FROM {source}
+        WHERE {' AND '.join(where)}
+        ORDER BY city, ts_ms
+    """, params)
+    first = True
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows and not first:
+            return
+        yield resolution, rows
+        if not rows:
+            return
+        first = False
+
+def to_columns(rows):
+    """Transpose a chunk of rows into per-column NumPy arrays (numbers as float64, NaN for NULL)."""
+    columns = dict(zip(COLUMNS, zip(*rows))) if rows else {name: () for name in COLUMNS}
+    arrays = {}
+    for name, values in columns.items():
+        if name in TEXT_COLUMNS:
+            arrays[name] = np.array(values, dtype=object)
+        else:
+            arrays[name] = np.array([np.nan if v is None else v for v in values], dtype=float)
+    return arrays
+
+def read_columns(conn, **kwargs):
+    """Return the whole range as a dict of NumPy column arrays, filled chunk by chunk."""
+    parts = {name: [] for name in COLUMNS}
+    for _, rows in iter_chunks(conn, **kwargs):
+        for name, array in to_columns(rows).items():
+            parts[name].append(array)
+    return {name: np.concatenate(chunks) if chunks else np.array([]) for name, chunks in parts.items()}
+
+def _encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def _encode_ndjson(chunks):
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(COLUMNS, row))) + '\n' for row in rows).encode()
+
+class _Sink:
+    """Minimal writable file that hands back whatever was written since the last take()."""
+
+    def __init__(self):
+        self._parts = []
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def _arrow_schema():
+    return pa.schema([(name, pa.string() if name in TEXT_COLUMNS else pa.int64() if name in INTEGER_COLUMNS
+                       else pa.float64()) for name in COLUMNS])
+
+def _record_batch(rows, schema):
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    return pa.record_batch([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                           schema=schema)
+
+def _encode_arrow(chunks):
+    schema = _arrow_schema()
+    sink = _Sink()
+    with pa_ipc.new_stream(sink, schema) as writer:
+        for rows in chunks:
+            if rows:
+                writer.write_batch(_record_batch(rows, schema))
+            yield sink.take()
+    yield sink.take()
+
+def _encode_parquet(chunks):
+    schema = _arrow_schema()
+    sink = _Sink()
+    # One row group per chunk; the footer is written on close
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for rows in chunks:
+            if rows:
+                writer.write_batch(_record_batch(rows, schema))
+            yield sink.take()
+    yield sink.take()
+
+ENCODERS = {'csv': _encode_csv, 'ndjson': _encode_ndjson, 'arrow': _encode_arrow, 'parquet': _encode_parquet}
+
+def _gzip(parts):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for part in parts:
+        data = compressor.compress(part)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def encode(chunks, fmt='csv', gzip=False):
+    """Encode an iterable of row chunks into a stream of bytes in fmt, optionally gzipped."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if FORMATS[fmt][2] and pa is None:
+        raise ValueError(f"Export format {fmt} needs pyarrow")
+    parts = (part for part in ENCODERS[fmt](chunks) if part)
+    return _gzip(parts) if gzip else parts
+
+def main():
+    parser = argparse.ArgumentParser(description="Export MoodCast sensor history")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--city", action="append", help="city to export (repeatable; default all)")
+    parser.add_argument("--source", action="append", help="source to export (repeatable; default all)")
+    parser.add_argument("--since", type=parse_time, help=f"ISO-8601 start (default {DEFAULT_HOURS} hours ago)")
+    parser.add_argument("--until", type=parse_time, help="ISO-8601 end (default now)")
+    parser.add_argument("--resolution", choices=retention.RESOLUTIONS, help="default: picked from the range")
+    parser.add_argument("--format", default="csv", choices=list(FORMATS))
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--out", help="output file (default stdout)")
+    args = parser.parse_args()
+
+    conn = storage.connect(args.db, readonly=True)
+    out = open(args.out, 'wb') if args.out else sys.stdout.buffer
+    rows_written = 0
+    resolution = None
+    try:
+        def chunks():
+            nonlocal rows_written, resolution
+            for resolution, rows in iter_chunks(conn, args.city, args.since, args.until, args.source,
+                                                args.resolution, chunk_size=args.chunk_size):
+                rows_written += len(rows)
+                yield rows
+        for part in encode(chunks(), args.format, args.gzip):
+            out.write(part)
+    except (ValueError, sqlite3.Error) as e:
+        logger.error(f"Export failed: {e}")
+        sys.exit(1)
+    finally:
+        if args.out:
+            out.close()
+        conn.close()
+    logger.info(f"Exported {rows_written} rows at {resolution} resolution as {args.format}{' (gzip)' if args.gzip else ''}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 import requests
-import json
 import paho.mqtt.client as mqtt
 import time
 from datetime import datetime, timedelta
 import logging
 import os
+import payloads
+import upstream
+from bulk_fetch import BulkFetcher
+from adaptive_schedule import AdaptiveSchedule
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,6 +15,21 @@ logger = logging.getLogger(__name__)
 
 # OpenWeatherMap API key
 OPENWEATHERMAP_API_KEY = os.getenv("OPENWEATHERMAP_API_KEY", "d82ef6867adb72ca0227e9d0d3e9fd7e")
+OPENWEATHERMAP_FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
+OPENMETEO_FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+OPENMETEO_HOURLY = "temperature_2m,relative_humidity_2m,pressure_msl,wind_speed_10m,cloud_cover,precipitation"
+
+# 'openweathermap' (one request per city, run concurrently) or 'openmeteo'
+# (up to OPENMETEO_BATCH_SIZE cities per request)
+FORECAST_PROVIDER = os.getenv("MOODCAST_FORECAST_PROVIDER", "openweathermap")
+OPENMETEO_BATCH_SIZE = int(os.getenv("MOODCAST_OPENMETEO_BATCH_SIZE", "50"))
+# Refresh every FORECAST_INTERVAL seconds while forecasts change, backing off
+# to FORECAST_MAX_INTERVAL while the upstream keeps returning the same runs
+FORECAST_INTERVAL = float(os.getenv("MOODCAST_FORECAST_INTERVAL", "3600"))
+FORECAST_MIN_INTERVAL = float(os.getenv("MOODCAST_FORECAST_MIN_INTERVAL", "1800"))
+FORECAST_MAX_INTERVAL = float(os.getenv("MOODCAST_FORECAST_MAX_INTERVAL", "10800"))
+FORECAST_STEPS = 16       # 48 hours
+STEP_HOURS = 3
 
 # MQTT settings
 MQTT_BROKER = "localhost"
@@ -32,14 +50,20 @@ cities = [
     {"name": "Cape Town", "lat": -33.9249, "lon": 18.4241},
 ]
 
+def mood_score(temp, clouds):
+    return round(min(max((100 - clouds) * (temp / 30), 0), 100), 1)
+
 def fetch_openweathermap_forecast(lat, lon):
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={lat}&lon={lon}&appid={OPENWEATHERMAP_API_KEY}&units=metric"
+    params = {
+        "lat": upstream.round_coord(lat),
+        "lon": upstream.round_coord(lon),
+        "appid": OPENWEATHERMAP_API_KEY,
+        "units": "metric"
+    }
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = upstream.get_client().get_json(OPENWEATHERMAP_FORECAST_URL, params)
         forecasts = []
-        for item in data['list'][:16]:  # 48 hours (3-hour intervals)
+        for item in data['list'][:FORECAST_STEPS]:  # 48 hours (3-hour intervals)
             timestamp = datetime.utcfromtimestamp(item['dt']).strftime('%Y-%m-%d %H:%M:%S')
             weather = {
                 'temp': item['main']['temp'],
@@ -51,8 +75,7 @@ def fetch_openweathermap_forecast(lat, lon):
                 'timestamp': timestamp,
                 'source': 'openweathermap_forecast'
             }
-            mood_score = min(max((100 - weather['clouds']) * (weather['temp'] / 30), 0), 100)
-            weather['mood_score'] = round(mood_score, 1)
+            weather['mood_score'] = mood_score(weather['temp'], weather['clouds'])
             forecasts.append(weather)
         logger.debug(f"Fetched {len(forecasts)} forecast entries for lat={lat}, lon={lon}")
         return forecasts
@@ -60,12 +83,84 @@ def fetch_openweathermap_forecast(lat, lon):
         logger.error(f"Error fetching OpenWeatherMap forecast: {e}")
         return []
 
+def fetch_openmeteo_forecast_bulk(locations):
+    """Fetch forecasts for several cities in one Open-Meteo request.
+
+    Returns one forecast list per location, in order, shaped like
+    fetch_openweathermap_forecast's (3-hour steps, rain summed over the
+    step, wind in m/s), or None if the request failed.
+    """
+    params = {
+        "latitude": ','.join(str(upstream.round_coord(location['lat'])) for location in locations),
+        "longitude": ','.join(str(upstream.round_coord(location['lon'])) for location in locations),
+        "hourly": OPENMETEO_HOURLY,
+        "forecast_hours": FORECAST_STEPS * STEP_HOURS,
+        "wind_speed_unit": "ms",
+        "timezone": "GMT"
+    }
+    try:
+        data = upstream.get_client().get_json(OPENMETEO_FORECAST_URL, params)
+    except requests.RequestException as e:
+        logger.error(f"Error fetching Open-Meteo forecast for {len(locations)} locations: {e}")
+        return None
+    # A single location comes back as an object, several as a list in request order
+    results = data if isinstance(data, list) else [data]
+    if len(results) != len(locations):
+        logger.error(f"Open-Meteo returned {len(results)} forecasts for {len(locations)} locations")
+        return None
+    return [_openmeteo_steps(result.get('hourly', {})) for result in results]
+
+def _openmeteo_steps(hourly):
+    forecasts = []
+    times = hourly.get('time', [])
+    for start in range(0, min(len(times), FORECAST_STEPS * STEP_HOURS), STEP_HOURS):
+        hours = slice(start, start + STEP_HOURS)
+        weather = {
+            'temp': hourly['temperature_2m'][start],
+            'humidity': hourly['relative_humidity_2m'][start],
+            'pressure': hourly['pressure_msl'][start],
+            'wind_speed': hourly['wind_speed_10m'][start],
+            'clouds': hourly['cloud_cover'][start],
+            'rain': round(sum(value or 0 for value in hourly['precipitation'][hours]), 2),
+            'timestamp': datetime.strptime(times[start], '%Y-%m-%dT%H:%M').strftime('%Y-%m-%d %H:%M:%S'),
+            'source': 'openmeteo_forecast'
+        }
+        if weather['temp'] is None or weather['clouds'] is None:
+            continue
+        weather['mood_score'] = mood_score(weather['temp'], weather['clouds'])
+        forecasts.append(weather)
+    return forecasts
+
+def fetch_forecasts(locations, provider=FORECAST_PROVIDER, fetcher=None):
+    """Yield (location, forecasts) for every location as its upstream request completes."""
+    fetcher = fetcher or BulkFetcher()
+    if provider == 'openmeteo':
+        pairs = fetcher.stream(locations, fetch_many=fetch_openmeteo_forecast_bulk, batch_size=OPENMETEO_BATCH_SIZE)
+    else:
+        pairs = fetcher.stream(
+            locations, fetch_one=lambda location: fetch_openweathermap_forecast(location['lat'], location['lon']))
+    for location, forecasts in pairs:
+        yield location, forecasts or []
+
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         logger.info("Connected to MQTT broker")
     else:
         logger.error(f"Failed to connect to MQTT broker with code {rc}")
 
+def publish_run(client, city, forecasts):
+    """Publish one city's forecast run as a single message."""
+    run = payloads.forecast_run(forecasts)
+    if run is None:
+        return
+    topic = f"{MQTT_TOPIC}/{city}"
+    try:
+        data, properties = payloads.encode('forecast_run', run)
+        client.publish(topic, data, qos=1, properties=properties)
+        logger.debug(f"Published {len(forecasts)}-step forecast run to {topic}")
+    except Exception as e:
+        logger.error(f"Error publishing to {topic}: {e}")
+
 def main():
     client = mqtt.Client(protocol=mqtt.MQTTv5)
     client.on_connect = on_connect
@@ -76,11 +171,23 @@ def main():
         logger.error(f"Error connecting to MQTT broker: {e}")
         return
 
+    schedule = AdaptiveSchedule(FORECAST_INTERVAL, FORECAST_MIN_INTERVAL, FORECAST_MAX_INTERVAL)
+    last_runs = {}
     while True:
-        for city in cities:
-            forecasts = fetch_openweathermap_forecast(city['lat'], city['lon'])
+        # Every step of this cycle belongs to one forecast run
+        issue_time = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        started = time.monotonic()
+        fetcher = BulkFetcher()
+        changed = 0
+        for city, forecasts in fetch_forecasts(cities, fetcher=fetcher):
+            signature = tuple((forecast['timestamp'], forecast['temp'], forecast['clouds'], forecast['rain'])
+                              for forecast in forecasts)
+            if forecasts and signature != last_runs.get(city['name']):
+                last_runs[city['name']] = signature
+                changed += 1
+            steps = []
             for forecast in forecasts:
-                payload = {
+                steps.append({
                     'city': city['name'],
                     'lat': city['lat'],
                     'lon': city['lon'],
@@ -93,16 +200,16 @@ def main():
                         'rain': forecast['rain']
                     },
                     'timestamp': forecast['timestamp'],
+                    'issue_time': issue_time,
                     'source': forecast['source'],
                     'mood_score': forecast['mood_score']
-                }
-                topic = f"{MQTT_TOPIC}/{city['name']}"
-                try:
-                    client.publish(topic, json.dumps(payload), qos=1)
-                    logger.debug(f"Published forecast to {topic}")
-                except Exception as e:
-                    logger.error(f"Error publishing to {topic}: {e}")
-        time.sleep(3600)  # Run every hour
+                })
+            publish_run(client, city['name'], steps)
+        interval = schedule.update(changed > 0)
+        logger.info(f"Forecast refresh of {len(cities)} cities via {FORECAST_PROVIDER} took "
+                    f"{time.monotonic() - started:.1f}s, {changed} changed: {fetcher.stats()}; "
+                    f"next in {interval:.0f}s, {schedule.saved()} refresh cycles saved")
+        time.sleep(interval)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
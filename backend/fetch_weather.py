@@ -1,6 +1,8 @@
 import requests
 import logging
 import os
+from datetime import datetime, timezone
+import upstream
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -10,9 +12,15 @@ logger = logging.getLogger(__name__)
 OPENWEATHERMAP_API_KEY = os.getenv("OPENWEATHERMAP_API_KEY", "684d135ca91c19fce9c0e052e3d55ddc")
 OPENWEATHERMAP_URL = "http://api.openweathermap.org/data/2.5/weather"
 OPENMETEO_URL = "https://api.open-meteo.com/v1/forecast"
+# Only the current conditions; the full hourly array is never read
+OPENMETEO_CURRENT = "temperature_2m,relative_humidity_2m,pressure_msl,wind_speed_10m,cloud_cover,precipitation"
 
-def fetch_openweathermap(lat, lon):
-    """Fetch weather data from OpenWeatherMap."""
+def fetch_openweathermap(lat, lon, session=None):
+    """Fetch weather data from OpenWeatherMap through the shared upstream cache.
+
+    Coordinates are rounded to upstream.COORD_PRECISION so nearby
+    locations share one request; session, when given, carries the request.
+    """
     logger.debug(f"Fetching OpenWeatherMap data for lat={lat}, lon={lon}")
     if not OPENWEATHERMAP_API_KEY or OPENWEATHERMAP_API_KEY == "":
         logger.error("OpenWeatherMap API key is missing or invalid")
@@ -20,14 +28,12 @@ def fetch_openweathermap(lat, lon):
     
     try:
         params = {
-            "lat": lat,
-            "lon": lon,
+            "lat": upstream.round_coord(lat),
+            "lon": upstream.round_coord(lon),
             "appid": OPENWEATHERMAP_API_KEY,
             "units": "metric"
         }
-        response = requests.get(OPENWEATHERMAP_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = upstream.get_client().get_json(OPENWEATHERMAP_URL, params, session=session)
         
         logger.debug(f"OpenWeatherMap response: {data}")
         return {
@@ -39,38 +45,46 @@ def fetch_openweathermap(lat, lon):
             "wind_speed": data["wind"]["speed"],
             "clouds": data["clouds"]["all"],
             "rain": data.get("rain", {}).get("1h", 0),
+            # Upstream observation time, epoch seconds
+            "observed_at": data.get("dt"),
             "source": "openweathermap"
         }
     except requests.RequestException as e:
         logger.error(f"Error fetching OpenWeatherMap data: {e}")
         return None
 
-def fetch_openmeteo(lat, lon):
-    """Fetch weather data from Open-Meteo."""
+def fetch_openmeteo(lat, lon, session=None):
+    """Fetch current weather from Open-Meteo through the shared upstream cache (see fetch_openweathermap)."""
     logger.debug(f"Fetching Open-Meteo data for lat={lat}, lon={lon}")
     try:
         params = {
-            "latitude": lat,
-            "longitude": lon,
-            "current_weather": True,
-            "hourly": "temperature_2m,relativehumidity_2m,pressure_msl,windspeed_10m,cloudcover,precipitation"
+            "latitude": upstream.round_coord(lat),
+            "longitude": upstream.round_coord(lon),
+            "current": OPENMETEO_CURRENT
         }
-        response = requests.get(OPENMETEO_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = upstream.get_client().get_json(OPENMETEO_URL, params, session=session)
         
         logger.debug(f"Open-Meteo response: {data}")
+        current = data["current"]
         return {
             "lat": lat,
             "lon": lon,
-            "temp": data["current_weather"]["temperature"],
-            "humidity": data["hourly"]["relativehumidity_2m"][0],
-            "pressure": data["hourly"]["pressure_msl"][0],
-            "wind_speed": data["current_weather"]["windspeed"],
-            "clouds": data["hourly"]["cloudcover"][0],
-            "rain": data["hourly"]["precipitation"][0],
+            "temp": current["temperature_2m"],
+            "humidity": current["relative_humidity_2m"],
+            "pressure": current["pressure_msl"],
+            "wind_speed": current["wind_speed_10m"],
+            "clouds": current["cloud_cover"],
+            "rain": current["precipitation"],
+            "observed_at": _openmeteo_time(current.get("time")),
             "source": "openmeteo"
         }
     except requests.RequestException as e:
         logger.error(f"Error fetching Open-Meteo data: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def _openmeteo_time(value):
+    """Open-Meteo 'current.time' (ISO, GMT, minute precision) to epoch seconds."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M").replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return None
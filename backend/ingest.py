@@ -0,0 +1,267 @@
+import queue
+import threading
+import time
+import logging
+import os
+import storage
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DB_PATH = "moodcast.db"
+
+# Ingest tuning (overridable from the environment)
+INGEST_BATCH_SIZE = int(os.getenv("MOODCAST_INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("MOODCAST_INGEST_FLUSH_INTERVAL", "1.0"))
+INGEST_QUEUE_SIZE = int(os.getenv("MOODCAST_INGEST_QUEUE_SIZE", "10000"))
+
+# One INSERT statement per target table
+INSERT_SQL = {
+    'sensor_data': """
+        INSERT INTO sensor_data (city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score, ts_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    'quality_metrics': """
+        INSERT INTO quality_metrics (city, completeness, freshness, missing_fields, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+    'iot_nodes': """
+        INSERT OR REPLACE INTO iot_nodes (city, pi_id, sensor_id, last_seen, lat, lon)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    'alerts': """
+        INSERT INTO alerts (city, type, message, timestamp, severity, ts_ms)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    'forecasts': """
+        INSERT INTO forecasts (city, source, issue_time, valid_time, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, mood_score)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(city, source, issue_time, valid_time) DO UPDATE SET
+            lat = excluded.lat, lon = excluded.lon, temp = excluded.temp, humidity = excluded.humidity,
+            pressure = excluded.pressure, wind_speed = excluded.wind_speed, clouds = excluded.clouds,
+            rain = excluded.rain, mood_score = excluded.mood_score
+    """,
+    'node_health': """
+        INSERT OR REPLACE INTO node_health (city, pi_id, sensor_id, lat, lon, last_seen, first_seen, messages,
+                                            uptime_pct, message_rate, gap_avg, gap_max, outages, logs)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    'locations': """
+        INSERT OR REPLACE INTO locations (city, lat, lon, updated_at)
+        VALUES (?, ?, ?, ?)
+    """
+}
+
+# Bumps the write counter the API cache validates against (one per city plus '*')
+BUMP_VERSION_SQL = """
+    INSERT INTO data_versions (scope, version) VALUES (?, 1)
+    ON CONFLICT(scope) DO UPDATE SET version = version + 1
+"""
+
+# Tables inserted row by row so their new ids can be handed to on_commit
+RETURN_ID_TABLES = ('alerts',)
+
+class IngestWriter:
+    """Queue decoded rows and write them in batches from one long-lived connection.
+
+    Producers call put() with a (table, row) record, or put_many() with a
+    list of records that must land in the same transaction (e.g. every
+    step of a forecast run). A single writer thread
+    drains the bounded queue and flushes with executemany in one transaction
+    per batch, either when batch_size records are waiting or when
+    flush_interval seconds have passed since the first record of the batch.
+    on_commit(records, row_ids) is called after each batch commits, where
+    row_ids maps each table in RETURN_ID_TABLES to (id, row) pairs.
+    maintenance(conn), when given, runs on the writer connection between
+    batches (at least once per flush_interval), so schema work such as
+    partition rotation never contends with ingest for the write lock.
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL, max_queue=INGEST_QUEUE_SIZE,
+                 on_commit=None, maintenance=None):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_commit = on_commit
+        self.maintenance = maintenance
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'batches': 0,
+            'errors': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+        logger.info(f"Started ingest writer (batch_size={self.batch_size}, flush_interval={self.flush_interval}s)")
+
+    def stop(self, timeout=10):
+        """Stop the writer thread after draining whatever is already queued."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, table, row, timeout=5):
+        """Queue one row for table. Blocks up to timeout seconds when the queue is full."""
+        if table not in INSERT_SQL:
+            raise ValueError(f"Unknown ingest table: {table}")
+        try:
+            self._queue.put((table, row), timeout=timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['dropped'] += 1
+            logger.error(f"Ingest queue full, dropped {table} row")
+            return False
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def put_many(self, records, timeout=5):
+        """Queue (table, row) records as one unit: they are flushed together, in one transaction."""
+        records = list(records)
+        if not records:
+            return True
+        for table, _ in records:
+            if table not in INSERT_SQL:
+                raise ValueError(f"Unknown ingest table: {table}")
+        try:
+            self._queue.put(records, timeout=timeout)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['dropped'] += len(records)
+            logger.error(f"Ingest queue full, dropped group of {len(records)} rows")
+            return False
+        with self._stats_lock:
+            self._stats['enqueued'] += len(records)
+        return True
+
+    def stats(self):
+        """Return a snapshot of queue depth and flush latency counters."""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        total_ms = snapshot.pop('total_flush_ms')
+        snapshot['avg_flush_ms'] = round(total_ms / snapshot['batches'], 3) if snapshot['batches'] else 0.0
+        # Queue depth counts queued items; a put_many() group is one item
+        snapshot['queue_depth'] = self._queue.qsize()
+        snapshot['queue_capacity'] = self._queue.maxsize
+        return snapshot
+
+    def _next_batch(self):
+        """Block for the first record, then collect until the batch is full or the interval ends."""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = []
+        self._add(batch, first)
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                self._add(batch, self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                self._add(batch, self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _add(batch, item):
+        # put_many() groups are queued as one list and never split across batches
+        if isinstance(item, list):
+            batch.extend(item)
+        else:
+            batch.append(item)
+
+    def _flush(self, conn, batch):
+        grouped = {}
+        for table, row in batch:
+            grouped.setdefault(table, []).append(row)
+
+        started = time.perf_counter()
+        row_ids = {}
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            for table, rows in grouped.items():
+                if table in RETURN_ID_TABLES:
+                    ids = row_ids.setdefault(table, [])
+                    for row in rows:
+                        cursor.execute(INSERT_SQL[table], row)
+                        ids.append((cursor.lastrowid, row))
+                else:
+                    cursor.executemany(INSERT_SQL[table], rows)
+            # Every table's rows lead with the city
+            scopes = {row[0] for _, row in batch}
+            scopes.add('*')
+            cursor.executemany(BUMP_VERSION_SQL, [(scope,) for scope in scopes])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            with self._stats_lock:
+                self._stats['errors'] += 1
+            logger.error(f"Error flushing ingest batch of {len(batch)} rows: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._stats_lock:
+            self._stats['written'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_flush_ms'] = round(elapsed_ms, 3)
+            self._stats['max_flush_ms'] = round(max(self._stats['max_flush_ms'], elapsed_ms), 3)
+            self._stats['total_flush_ms'] += elapsed_ms
+        logger.debug(f"Flushed {len(batch)} rows in {elapsed_ms:.1f} ms (queue depth {self._queue.qsize()})")
+
+        if self.on_commit:
+            try:
+                self.on_commit(batch, row_ids)
+            except Exception as e:
+                logger.error(f"Error in ingest commit hook: {e}")
+
+    def _run(self):
+        # The process's one writer connection; it controls BEGIN/COMMIT itself
+        conn = storage.writer_connection(self.db_path)
+        try:
+            while not self._stop.is_set():
+                batch = self._next_batch()
+                if batch:
+                    self._flush(conn, batch)
+                if self.maintenance:
+                    try:
+                        self.maintenance(conn)
+                    except Exception as e:
+                        logger.error(f"Error in ingest maintenance hook: {e}")
+            # Drain anything queued before stop()
+            while True:
+                batch = self._drain()
+                if not batch:
+                    break
+                self._flush(conn, batch)
+        finally:
+            conn.close()
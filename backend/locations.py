@@ -0,0 +1,150 @@
+import sqlite3
+import math
+import threading
+import time
+import logging
+import storage
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DB_PATH = "moodcast.db"
+
+CELL_SIZE = 0.5          # grid cell edge in degrees
+MATCH_TOLERANCE = 0.01   # max |dlat| and |dlon| for a request to match a station
+REFRESH_INTERVAL = 30    # min seconds between reloads triggered by a miss
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def cell_of(lat, lon, cell_size=CELL_SIZE):
+    return (int(math.floor((lat + 90) / cell_size)), int(math.floor((lon + 180) / cell_size)))
+
+class LocationIndex:
+    """In-process grid index over the stations in the locations table.
+
+    Resolves a request lat/lon to a canonical location id (the station's
+    city) so queries can filter on the indexed city column instead of
+    ABS(lat - ?) range scans. Lookups only touch the grid cells around the
+    point, so cost does not grow with the number of stations.
+    """
+
+    def __init__(self, db_path=DB_PATH, cell_size=CELL_SIZE):
+        self.db_path = db_path
+        self.cell_size = cell_size
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._stations = {}
+        self._loaded_at = 0.0
+        self._n_cols = int(round(360 / cell_size))
+
+    def load(self, conn=None):
+        """(Re)build the grid from the locations table."""
+        own_conn = conn is None
+        try:
+            if own_conn:
+                conn = storage.connect(self.db_path, readonly=True)
+            rows = conn.execute("SELECT city, lat, lon FROM locations WHERE lat IS NOT NULL AND lon IS NOT NULL").fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error loading locations: {e}")
+            return
+        finally:
+            if own_conn and conn:
+                conn.close()
+
+        cells = {}
+        stations = {}
+        for city, lat, lon in rows:
+            stations[city] = (lat, lon)
+            cells.setdefault(cell_of(lat, lon, self.cell_size), []).append((city, lat, lon))
+        with self._lock:
+            self._cells = cells
+            self._stations = stations
+            self._loaded_at = time.monotonic()
+        logger.debug(f"Loaded {len(stations)} locations into {len(cells)} grid cells")
+
+    def add(self, city, lat, lon):
+        """Insert or move one station in the in-memory grid."""
+        with self._lock:
+            old = self._stations.get(city)
+            if old == (lat, lon):
+                return
+            if old:
+                bucket = self._cells.get(cell_of(old[0], old[1], self.cell_size), [])
+                bucket[:] = [entry for entry in bucket if entry[0] != city]
+            self._stations[city] = (lat, lon)
+            self._cells.setdefault(cell_of(lat, lon, self.cell_size), []).append((city, lat, lon))
+
+    def __len__(self):
+        return len(self._stations)
+
+    def _ring(self, row, col, radius):
+        """Yield the grid cells at Chebyshev distance radius from (row, col)."""
+        for r in range(row - radius, row + radius + 1):
+            for c in range(col - radius, col + radius + 1):
+                if max(abs(r - row), abs(c - col)) == radius:
+                    yield (r, c % self._n_cols)
+
+    def nearest(self, lat, lon, k=1, max_km=None):
+        """Return up to k (city, lat, lon, distance_km) tuples, nearest first."""
+        with self._lock:
+            cells = self._cells
+            total = len(self._stations)
+        if not total:
+            return []
+
+        row, col = cell_of(lat, lon, self.cell_size)
+        found = []
+        seen = 0
+        visited = set()
+        radius = 0
+        while seen < total:
+            if (2 * radius + 1) ** 2 > len(cells):
+                # The search square now covers more cells than are occupied:
+                # scanning every station directly is cheaper
+                found = [(city, s_lat, s_lon, haversine_km(lat, lon, s_lat, s_lon))
+                         for bucket in cells.values() for city, s_lat, s_lon in bucket]
+                break
+            for key in self._ring(row, col, radius):
+                # Longitude wraps, so large rings can revisit cells
+                if key in visited:
+                    continue
+                visited.add(key)
+                for city, s_lat, s_lon in cells.get(key, ()):
+                    found.append((city, s_lat, s_lon, haversine_km(lat, lon, s_lat, s_lon)))
+                    seen += 1
+            if len(found) >= k:
+                found.sort(key=lambda entry: entry[3])
+                # Stations outside the searched square are at least radius cells away
+                max_lat = min(abs(lat) + (radius + 1) * self.cell_size, 89.9)
+                ring_km = radius * self.cell_size * 111.0 * math.cos(math.radians(max_lat))
+                if found[k - 1][3] <= ring_km:
+                    break
+            radius += 1
+
+        found.sort(key=lambda entry: entry[3])
+        if max_km is not None:
+            found = [entry for entry in found if entry[3] <= max_km]
+        return found[:k]
+
+    def resolve(self, lat, lon, tolerance=MATCH_TOLERANCE):
+        """Map a request lat/lon to the city of the station within tolerance degrees, or None."""
+        city = self._match(lat, lon, tolerance)
+        if city is None and time.monotonic() - self._loaded_at > REFRESH_INTERVAL:
+            # A station may have been added since the last load
+            self.load()
+            city = self._match(lat, lon, tolerance)
+        return city
+
+    def _match(self, lat, lon, tolerance):
+        for city, s_lat, s_lon, _ in self.nearest(lat, lon, k=3):
+            if abs(s_lat - lat) <= tolerance and abs(s_lon - lon) <= tolerance:
+                return city
+        return None
@@ -1,9 +1,19 @@
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import sqlite3
 import json
 import logging
+import time
 from datetime import datetime, timedelta, timezone
 import database
+import ingest
+import payloads
+import retention
+import storage
+import backends
+from alert_engine import AlertEngine, timestamp_ms
+from node_health import NodeRegistry
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -13,6 +23,9 @@ DB_PATH = "moodcast.db"
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPICS = ["moodcast/sensor/#", "moodcast/source/#", "moodcast/quality/#", "moodcast/forecast/#"]
+STATS_LOG_INTERVAL = 60  # seconds between ingest stats log lines
+ALERT_ACTIVE_SECONDS = 24 * 3600  # retained alerts expire after the /alerts window
+LEGACY_RUN_GAP = 600  # seconds between single-step forecast messages of the same run
 
 # City coordinates
 CITY_COORDS = {
@@ -28,10 +41,18 @@ CITY_COORDS = {
     'Cape Town': (-33.9249, 18.4241)
 }
 
+mqtt_client = None
+alert_engine = AlertEngine()
+node_registry = NodeRegistry()
+known_locations = {}
+published_alert_ids = {}
+legacy_runs = {}  # (city, source) -> [issue_time, last arrival (monotonic), valid times seen]
+last_stats_log = time.monotonic()
+
 def get_db_connection():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        return conn
+        # Reads only: every write goes through the ingest writer's connection
+        return storage.connect(DB_PATH, readonly=True)
     except sqlite3.Error as e:
         logger.error(f"Database connection error: {e}")
         return None
@@ -44,82 +65,6 @@ def calculate_mood_score(temp, clouds):
     except (TypeError, ZeroDivisionError):
         return 50.0
 
-def check_weather_alerts(cursor, city, current_data, source, timestamp):
-    """Check for exceptional weather changes and generate alerts."""
-    try:
-        # Get the previous sensor data for the same city and source
-        cursor.execute("""
-            SELECT temp, pressure, wind_speed, clouds, rain, timestamp
-            FROM sensor_data
-            WHERE city = ? AND source = ?
-            ORDER BY timestamp DESC LIMIT 1 OFFSET 1
-        """, (city, source))
-        prev_row = cursor.fetchone()
-
-        if not prev_row:
-            return
-
-        prev_temp, prev_pressure, prev_wind, prev_clouds, prev_rain, prev_timestamp = prev_row
-        prev_time = datetime.strptime(prev_timestamp, '%Y-%m-%dT%H:%M:%S.%f%z')
-        current_time = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f%z')
-        time_diff_hours = (current_time - prev_time).total_seconds() / 3600
-
-        if time_diff_hours == 0:
-            return
-
-        alerts = []
-        # Temperature change: ±5°C/hour
-        temp_change = abs(current_data['temp'] - prev_temp)
-        if temp_change / time_diff_hours >= 5:
-            alerts.append({
-                'type': 'temperature_change',
-                'message': f"Rapid temperature {'drop' if current_data['temp'] < prev_temp else 'rise'}: {temp_change:.1f}°C in {time_diff_hours:.1f} hours",
-                'severity': 'warning'
-            })
-
-        # Pressure drop: ≥4 hPa in 3 hours
-        pressure_change = prev_pressure - current_data['pressure']
-        if time_diff_hours <= 3 and pressure_change >= 4:
-            alerts.append({
-                'type': 'pressure_drop',
-                'message': f"Rapid pressure drop: {pressure_change:.1f} hPa in {time_diff_hours:.1f} hours, possible storm",
-                'severity': 'critical'
-            })
-
-        # Wind speed: ≥15 m/s
-        if current_data['wind_speed'] >= 15:
-            alerts.append({
-                'type': 'high_wind',
-                'message': f"High wind speed: {current_data['wind_speed']:.1f} m/s",
-                'severity': 'warning'
-            })
-
-        # Rain: ≥5 mm/h
-        if current_data['rain'] >= 5:
-            alerts.append({
-                'type': 'heavy_rain',
-                'message': f"Heavy rain: {current_data['rain']:.1f} mm/h",
-                'severity': 'warning'
-            })
-
-        # Clouds: Increase to ≥80% in 1 hour
-        cloud_change = current_data['clouds'] - prev_clouds
-        if time_diff_hours <= 1 and current_data['clouds'] >= 80 and cloud_change >= 50:
-            alerts.append({
-                'type': 'sudden_clouds',
-                'message': f"Sudden cloud cover increase: {cloud_change:.1f}% to {current_data['clouds']}%",
-                'severity': 'warning'
-            })
-
-        for alert in alerts:
-            cursor.execute("""
-                INSERT INTO alerts (city, type, message, timestamp, severity)
-                VALUES (?, ?, ?, ?, ?)
-            """, (city, alert['type'], alert['message'], timestamp, alert['severity']))
-
-    except Exception as e:
-        logger.error(f"Error checking alerts for {city}: {e}")
-
 def on_connect(client, userdata, flags, reason_code, properties=None):
     if reason_code.is_failure:
         logger.error(f"Failed to connect to MQTT broker with code {reason_code}")
@@ -130,18 +75,11 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
             logger.info(f"Subscribed to {topic}")
 
 def on_message(client, userdata, msg):
+    topic = msg.topic
     try:
-        payload = json.loads(msg.payload.decode())
-        topic = msg.topic
+        payload = payloads.decode(msg.payload, msg.properties)
         logger.debug(f"Received message on {topic}: {payload}")
 
-        conn = get_db_connection()
-        if not conn:
-            logger.error("Failed to connect to database")
-            return
-        
-        cursor = conn.cursor()
-
         if topic.startswith("moodcast/sensor/"):
             city = topic.split('/')[-1]
             weather = {
@@ -157,27 +95,23 @@ def on_message(client, userdata, msg):
             source = payload.get('source', 'unknown')
             timestamp = payload.get('timestamp', datetime.now(timezone.utc).isoformat())
             mood_score = payload.get('mood_score', calculate_mood_score(weather['temp'], weather['clouds']))
+            # Parsed once here; stored as ts_ms and used for every range query and sort
+            ts_ms = timestamp_ms(timestamp)
 
             # Check for alerts
-            if source == 'openweathermap':
-                check_weather_alerts(cursor, city, weather, source, timestamp)
+            queue_alerts(city, weather, source, timestamp, ts_ms)
 
-            cursor.execute("""
-                INSERT INTO sensor_data (city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+            writer.put('sensor_data', (
                 city, lat, lon,
                 weather['temp'], weather['humidity'], weather['pressure'],
                 weather['wind_speed'], weather['clouds'], weather['rain'],
-                timestamp, source, mood_score
+                timestamp, source, mood_score, ts_ms
             ))
+            register_location(city, lat, lon, timestamp)
 
         elif topic.startswith("moodcast/source/"):
             city = topic.split('/')[-1]
-            cursor.execute("""
-                INSERT INTO quality_metrics (city, completeness, freshness, missing_fields, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
+            writer.put('quality_metrics', (
                 city,
                 payload.get('completeness', 100),
                 payload.get('freshness', 60),
@@ -188,71 +122,205 @@ def on_message(client, userdata, msg):
         elif topic.startswith("moodcast/quality/"):
             city = topic.split('/')[-1]
             lat, lon = CITY_COORDS.get(city, (0, 0))
-            cursor.execute("""
-                INSERT OR REPLACE INTO iot_nodes (city, pi_id, sensor_id, last_seen, lat, lon)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
+            last_seen = payload.get('last_seen', datetime.now(timezone.utc).isoformat())
+            writer.put('iot_nodes', (
                 city, payload.get('pi_id'), payload.get('sensor_id'),
-                payload.get('last_seen', datetime.now(timezone.utc).isoformat()),
-                lat, lon
+                last_seen, lat, lon
             ))
+            health = node_registry.observe(city, payload.get('pi_id'), payload.get('sensor_id'), last_seen, lat, lon)
+            if health:
+                writer.put('node_health', health)
 
         elif topic.startswith("moodcast/forecast/"):
             city = topic.split('/')[-1]
-            weather = payload.get('weather', {})
-            lat = payload.get('lat', CITY_COORDS.get(city, (0, 0))[0])
-            lon = payload.get('lon', CITY_COORDS.get(city, (0, 0))[1])
-            source = payload.get('source', 'unknown')
-            timestamp = payload.get('timestamp', datetime.now(timezone.utc).isoformat())
-            mood_score = payload.get('mood_score', calculate_mood_score(weather.get('temp'), weather.get('clouds', 0)))
-
-            # Check for forecast alerts (e.g., high wind in next 48 hours)
-            if source == 'openweathermap_forecast':
-                check_weather_alerts(cursor, city, weather, source, timestamp)
-
-            cursor.execute("""
-                INSERT INTO sensor_data (city, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, timestamp, source, mood_score)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                city, lat, lon,
-                weather.get('temp'), weather.get('humidity'), weather.get('pressure'),
-                weather.get('wind_speed'), weather.get('clouds', 0), weather.get('rain', 0),
-                timestamp, source, mood_score
-            ))
-
-        conn.commit()
-        logger.debug(f"Stored data for {topic}")
-
-        # Publish alerts to MQTT
-        cursor.execute("SELECT city, type, message, timestamp, severity FROM alerts WHERE city = ? ORDER BY timestamp DESC LIMIT 5", (city,))
-        for alert in cursor.fetchall():
-            alert_topic = f"moodcast/alert/{city}"
-            alert_payload = json.dumps({
-                'city': alert[0],
-                'type': alert[1],
-                'message': alert[2],
-                'timestamp': alert[3],
-                'severity': alert[4]
-            })
-            client.publish(alert_topic, alert_payload, qos=1)
-            logger.debug(f"Published alert to {alert_topic}")
+            # A run message carries every step of one forecast run; a legacy
+            # message carries a single step. Either way the steps and their
+            # alerts are written in one transaction.
+            if not payload.get('issue_time'):
+                if payloads.is_forecast_run(payload):
+                    payload['issue_time'] = default_issue_time()
+                else:
+                    payload['issue_time'] = legacy_issue_time(city, payload.get('source', 'unknown'),
+                                                              payload.get('timestamp'))
+            steps = payloads.forecast_steps(payload)
+            records = [forecast_record(city, step) for step in steps]
+            records.extend(forecast_alert_records(city, steps))
+            writer.put_many(records)
+
+        log_ingest_stats()
 
     except Exception as e:
         logger.error(f"Error processing message on {topic}: {e}")
-    finally:
-        if conn:
-            conn.close()
+
+def forecast_record(city, payload):
+    """Ingest record for one forecast step's forecasts row."""
+    weather = payload.get('weather', {})
+    lat = payload.get('lat', CITY_COORDS.get(city, (0, 0))[0])
+    lon = payload.get('lon', CITY_COORDS.get(city, (0, 0))[1])
+    source = payload.get('source', 'unknown')
+    timestamp = payload.get('timestamp', datetime.now(timezone.utc).isoformat())
+    issue_time = payload.get('issue_time') or default_issue_time()
+    mood_score = payload.get('mood_score', calculate_mood_score(weather.get('temp'), weather.get('clouds', 0)))
+
+    return ('forecasts', (
+        city, source, issue_time, timestamp, lat, lon,
+        weather.get('temp'), weather.get('humidity'), weather.get('pressure'),
+        weather.get('wind_speed'), weather.get('clouds', 0), weather.get('rain', 0),
+        mood_score
+    ))
+
+def forecast_alert_records(city, steps):
+    """Check a forecast run for alerts (e.g., high wind in next 48 hours); returns ('alerts', row) records.
+
+    The steps of a run are evaluated together and apart from the
+    observations, and each (type, valid time) is only alerted once.
+    """
+    runs = {}
+    for step in steps:
+        source = step.get('source', 'unknown')
+        if source not in alert_engine.forecast_sources:
+            continue
+        timestamp = step.get('timestamp')
+        ts_ms = timestamp_ms(timestamp)
+        if ts_ms is None:
+            logger.error(f"Error checking forecast alerts for {city}: invalid timestamp {timestamp!r}")
+            continue
+        runs.setdefault(source, []).append((ts_ms, timestamp, step.get('weather', {})))
+    return [('alerts', (city, alert['type'], alert['message'], timestamp, alert['severity'], ts_ms))
+            for source, run in runs.items()
+            for ts_ms, timestamp, alert in alert_engine.observe_forecast_run(city, source, run)]
+
+def default_issue_time():
+    """Issue time for forecast runs that do not carry one: producers run hourly, so the current hour."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:00:00')
+
+def legacy_issue_time(city, source, timestamp):
+    """Issue time for a single-step forecast message that carries none.
+
+    The steps of a run arrive back to back, so a step within
+    LEGACY_RUN_GAP seconds of the previous one for the same city and
+    source, and for a valid time not seen yet, joins that run and keeps
+    its issue time even if the hour turns meanwhile.
+    """
+    now = time.monotonic()
+    run = legacy_runs.get((city, source))
+    if run is None or now - run[1] > LEGACY_RUN_GAP or timestamp in run[2]:
+        run = legacy_runs[(city, source)] = [default_issue_time(), now, set()]
+    run[1] = now
+    run[2].add(timestamp)
+    return run[0]
+
+def alert_records(city, weather, source, timestamp, ts_ms):
+    """Evaluate alert rules in memory; returns ('alerts', row) records for the writer."""
+    if ts_ms is None:
+        if source in alert_engine.sources:
+            logger.error(f"Error checking alerts for {city}: invalid timestamp {timestamp!r}")
+        return []
+    return [('alerts', (city, alert['type'], alert['message'], timestamp, alert['severity'], ts_ms))
+            for alert in alert_engine.observe(city, source, weather, timestamp, ts_ms / 1000)]
+
+def queue_alerts(city, weather, source, timestamp, ts_ms):
+    """Evaluate alert rules in memory and queue any alerts for the writer."""
+    for table, row in alert_records(city, weather, source, timestamp, ts_ms):
+        writer.put(table, row)
+
+def register_location(city, lat, lon, timestamp):
+    """Upsert the station registry only when a city's coordinates change."""
+    if lat is None or lon is None or known_locations.get(city) == (lat, lon):
+        return
+    if writer.put('locations', (city, lat, lon, timestamp)):
+        known_locations[city] = (lat, lon)
+
+# Committed rows copied to the history backend when MOODCAST_HISTORY_BACKEND selects one
+timeseries = backends.open_backend() if backends.HISTORY_BACKEND != 'sqlite' else None
+MIRRORED_TABLES = {'sensor_data': 'append_readings', 'alerts': 'append_alerts', 'iot_nodes': 'upsert_nodes'}
+
+def mirror_batch(batch):
+    grouped = {}
+    for table, row in batch:
+        if table in MIRRORED_TABLES:
+            grouped.setdefault(table, []).append(row)
+    for table, rows in grouped.items():
+        getattr(timeseries, MIRRORED_TABLES[table])(rows)
+
+def on_commit(batch, row_ids):
+    """Mirror the batch to the history backend and publish each newly committed alert exactly once.
+
+    Alerts go to moodcast/alert/{city} as retained messages with a message
+    expiry, so late subscribers receive the latest active alert per city
+    and the broker drops it once it is no longer active.
+    """
+    if timeseries:
+        try:
+            mirror_batch(batch)
+        except Exception as e:
+            logger.error(f"Error mirroring batch to {timeseries.name} storage: {e}")
+    if not mqtt_client:
+        return
+
+    for alert_id, (city, alert_type, message, timestamp, severity, _) in row_ids.get('alerts', []):
+        # Ids only grow, so anything at or below the mark was already published
+        if alert_id <= published_alert_ids.get(city, 0):
+            continue
+        alert_topic = f"moodcast/alert/{city}"
+        alert_payload = json.dumps({
+            'id': alert_id,
+            'city': city,
+            'type': alert_type,
+            'message': message,
+            'timestamp': timestamp,
+            'severity': severity
+        })
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.MessageExpiryInterval = ALERT_ACTIVE_SECONDS
+        mqtt_client.publish(alert_topic, alert_payload, qos=1, retain=True, properties=properties)
+        published_alert_ids[city] = alert_id
+        logger.debug(f"Published alert {alert_id} to {alert_topic}")
+
+def log_ingest_stats():
+    global last_stats_log
+    now = time.monotonic()
+    if now - last_stats_log < STATS_LOG_INTERVAL:
+        return
+    last_stats_log = now
+    stats = writer.stats()
+    logger.info(
+        f"Ingest queue depth {stats['queue_depth']}/{stats['queue_capacity']}, "
+        f"written {stats['written']} in {stats['batches']} batches, "
+        f"flush latency last {stats['last_flush_ms']} ms / avg {stats['avg_flush_ms']} ms / max {stats['max_flush_ms']} ms, "
+        f"dropped {stats['dropped']}, errors {stats['errors']}"
+    )
+
+# Partition rotation and rollups run on the writer's own connection
+retention_manager = retention.RetentionManager()
+
+# Batched writer shared by all message handlers
+writer = ingest.IngestWriter(DB_PATH, on_commit=on_commit, maintenance=retention_manager.run_if_due)
 
 def main():
+    global mqtt_client
     database.init_db()  # Ensure database schema
+    conn = get_db_connection()
+    if conn:
+        try:
+            alert_engine.warm(conn)
+            node_registry.warm(conn)
+        finally:
+            conn.close()
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5)
     client.on_connect = on_connect
     client.on_message = on_message
+    mqtt_client = client
+    writer.start()
     try:
         client.connect(MQTT_BROKER, MQTT_PORT)
         client.loop_forever()
     except Exception as e:
         logger.error(f"Error in MQTT client: {e}")
+    finally:
+        writer.stop()
+        if timeseries:
+            timeseries.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
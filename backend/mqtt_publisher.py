@@ -1,7 +1,9 @@
 import paho.mqtt.client as mqtt
-import json
 import logging
-import time
+import os
+import threading
+from concurrent.futures import Future, wait
+import payloads
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -10,50 +12,186 @@ logger = logging.getLogger(__name__)
 BROKER = "localhost"
 PORT = 1883
 CLIENT_ID = "moodcast_publisher"
+MAX_INFLIGHT = 20        # QoS 1 messages awaiting PUBACK at once
+MAX_QUEUED = 10000       # messages paho buffers beyond the in-flight window (0 = unbounded)
+# _publish kind -> payloads encoding kind
+PAYLOAD_KINDS = {'weather': 'sensor'}
+
+class MQTTPublisher:
+    """Long-lived MQTT publisher with a background network loop.
+
+    The client connects once and reconnects on its own; paho keeps QoS 1
+    messages queued across reconnects. publish() returns a Future that
+    resolves with the message id once the broker acknowledges it (PUBACK
+    for QoS 1, on send for QoS 0).
+    """
+
+    def __init__(self, broker=BROKER, port=PORT, client_id=None,
+                 max_inflight=MAX_INFLIGHT, max_queued=MAX_QUEUED, keepalive=60):
+        self.broker = broker
+        self.port = port
+        self.keepalive = keepalive
+        self.client = mqtt.Client(
+            # Per-process id so a second process does not take over this session
+            client_id=client_id or f"{CLIENT_ID}_{os.getpid()}",
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            protocol=mqtt.MQTTv5
+        )
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.max_queued_messages_set(max_queued)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._early_acks = set()
+        self._started = False
+        self._stats = {'published': 0, 'acked': 0, 'failed': 0}
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.client.connect_async(self.broker, self.port, keepalive=self.keepalive)
+        self.client.loop_start()
+
+    def stop(self, timeout=10):
+        """Wait up to timeout seconds for outstanding acks, then disconnect."""
+        self.flush(timeout)
+        self.client.disconnect()
+        self.client.loop_stop()
+        with self._lock:
+            self._started = False
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code.is_failure:
+            logger.error(f"Publisher failed to connect to MQTT broker with code {reason_code}")
+        else:
+            logger.info(f"Publisher connected to MQTT broker at {self.broker}:{self.port}")
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code != 0:
+            logger.warning(f"Publisher disconnected from MQTT broker ({reason_code}), reconnecting")
+
+    def _on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        with self._lock:
+            future = self._pending.pop(mid, None)
+            if future is None:
+                # Ack arrived before publish() registered the future
+                self._early_acks.add(mid)
+                return
+            self._stats['acked'] += 1
+        future.set_result(mid)
+
+    def publish(self, topic, payload, qos=1, retain=False, properties=None):
+        """Queue one message and return a Future for its delivery."""
+        self.start()
+        future = Future()
+        try:
+            info = self.client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+        except Exception as e:
+            with self._lock:
+                self._stats['failed'] += 1
+            future.set_exception(e)
+            return future
+
+        # NO_CONN still queues QoS > 0 messages for delivery after reconnect
+        queued = info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0)
+        if not queued:
+            with self._lock:
+                self._stats['failed'] += 1
+            future.set_exception(RuntimeError(f"Publish to {topic} failed, rc={info.rc}"))
+            return future
+
+        with self._lock:
+            self._stats['published'] += 1
+            if info.mid in self._early_acks:
+                self._early_acks.discard(info.mid)
+                self._stats['acked'] += 1
+                acked = True
+            else:
+                self._pending[info.mid] = future
+                acked = False
+        if acked:
+            future.set_result(info.mid)
+        return future
+
+    def publish_many(self, messages, qos=1, retain=False):
+        """Publish an iterable of (topic, payload) pairs; returns one Future per message."""
+        return [self.publish(topic, payload, qos=qos, retain=retain) for topic, payload in messages]
+
+    def flush(self, timeout=None):
+        """Block until every pending message is acknowledged; returns True if none remain."""
+        with self._lock:
+            pending = list(self._pending.values())
+        if not pending:
+            return True
+        _, not_done = wait(pending, timeout=timeout)
+        return not not_done
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['in_flight'] = len(self._pending)
+        snapshot['connected'] = self.client.is_connected()
+        return snapshot
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+    """Return the process-wide publisher, connecting it on first use."""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = MQTTPublisher()
+            _publisher.start()
+        return _publisher
 
 def get_mqtt_client():
-    client = mqtt.Client(client_id=CLIENT_ID)
-    client.connect(BROKER, PORT, keepalive=60)
-    return client
+    return get_publisher().client
 
-def publish_weather(city, weather_data):
+def _publish(kind, topic, data, log_payload=True):
     try:
-        client = get_mqtt_client()
-        topic = f"moodcast/sensor/{city}"
-        payload = json.dumps(weather_data)
-        result = client.publish(topic, payload, qos=1)
-        client.disconnect()
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            logger.info(f"Published weather to {topic}: {payload[:100]}...")
+        payload, properties = payloads.encode(PAYLOAD_KINDS.get(kind, kind), data)
+        future = get_publisher().publish(topic, payload, qos=1, properties=properties)
+        if future.done() and future.exception():
+            logger.error(f"Failed to publish {kind} to {topic}: {future.exception()}")
         else:
-            logger.error(f"Failed to publish weather to {topic}, rc={result.rc}")
+            logger.info(f"Published {kind} to {topic}: {data if log_payload else str(data)[:100] + '...'}")
+        return future
     except Exception as e:
-        logger.error(f"Error publishing weather: {e}")
+        logger.error(f"Error publishing {kind}: {e}")
+        return None
+
+def publish_weather(city, weather_data):
+    return _publish("weather", f"moodcast/sensor/{city}", weather_data, log_payload=False)
 
 def publish_forecast(city, forecast_data):
-    try:
-        client = get_mqtt_client()
-        topic = f"moodcast/forecast/{city}"
-        payload = json.dumps(forecast_data)
-        result = client.publish(topic, payload, qos=1)
-        client.disconnect()
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            logger.info(f"Published forecast to {topic}: {payload[:100]}...")
-        else:
-            logger.error(f"Failed to publish forecast to {topic}, rc={result.rc}")
-    except Exception as e:
-        logger.error(f"Error publishing forecast: {e}")
+    """Publish one forecast step, or a whole run built with payloads.forecast_run()."""
+    kind = "forecast_run" if payloads.is_forecast_run(forecast_data) else "forecast"
+    return _publish(kind, f"moodcast/forecast/{city}", forecast_data, log_payload=False)
 
 def publish_quality(city, quality_data):
-    try:
-        client = get_mqtt_client()
-        topic = f"moodcast/quality/{city}"
-        payload = json.dumps(quality_data)
-        result = client.publish(topic, payload, qos=1)
-        client.disconnect()
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            logger.info(f"Published quality to {topic}: {payload}")
-        else:
-            logger.error(f"Failed to publish quality to {topic}, rc={result.rc}")
-    except Exception as e:
-        logger.error(f"Error publishing quality: {e}")
\ No newline at end of file
+    return _publish("quality", f"moodcast/quality/{city}", quality_data)
+
+def publish_batch(kind, city, items):
+    """Publish several payloads to one topic kind ('sensor', 'forecast' or 'quality').
+
+    Forecast steps are sent together as one run message.
+    """
+    topic = f"moodcast/{kind}/{city}"
+    publisher = get_publisher()
+    if kind == 'forecast':
+        run = payloads.forecast_run(list(items))
+        if run is None:
+            return []
+        payload, properties = payloads.encode('forecast_run', run)
+        return [publisher.publish(topic, payload, qos=1, properties=properties)]
+    futures = []
+    for item in items:
+        payload, properties = payloads.encode(kind, item)
+        futures.append(publisher.publish(topic, payload, qos=1, properties=properties))
+    return futures
@@ -3,9 +3,12 @@ import requests
 import json
 import time
 import logging
+import os
 import sys
 from datetime import datetime, timezone
 from fetch_weather import fetch_openweathermap, fetch_openmeteo
+import payloads
+from adaptive_schedule import AdaptiveSchedule
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,6 +18,10 @@ logger = logging.getLogger(__name__)
 BROKER = "localhost"
 PORT = 1883
 QOS = 1
+POLL_INTERVAL = 60  # seconds between fetches while readings change (see adaptive_schedule)
+# Quality heartbeats go out on their own timer, since adaptive polling can back
+# off past node_health.OFFLINE_AFTER; keep this well under it
+HEARTBEAT_INTERVAL = float(os.getenv("MOODCAST_HEARTBEAT_INTERVAL", "60"))
 
 # City coordinates
 CITY_COORDS = {
@@ -47,13 +54,13 @@ def on_connect(client, userdata, flags, reason_code, properties=None):
 def on_publish(client, userdata, mid, reason_code, properties=None):
     logger.debug(f"Successfully published message ID {mid} for {userdata['city']}")
 
-def publish_weather(client, city, data, source):
+def publish_weather(client, city, data, source, lat=None, lon=None):
     topic = f"moodcast/sensor/{city}"
     mood_score = calculate_mood_score(data.get("temp"), data.get("clouds", 0))
-    payload = json.dumps({
+    payload, properties = payloads.encode("sensor", {
         "city": city,
-        "lat": CITY_COORDS[city]["lat"],
-        "lon": CITY_COORDS[city]["lon"],
+        "lat": lat if lat is not None else CITY_COORDS[city]["lat"],
+        "lon": lon if lon is not None else CITY_COORDS[city]["lon"],
         "temp": data.get("temp"),
         "humidity": data.get("humidity"),
         "pressure": data.get("pressure"),
@@ -65,7 +72,7 @@ def publish_weather(client, city, data, source):
         "mood_score": mood_score
     })
     try:
-        result = client.publish(topic, payload, qos=QOS)
+        result = client.publish(topic, payload, qos=QOS, properties=properties)
         if result.rc != mqtt.MQTT_ERR_SUCCESS:
             logger.error(f"Failed to publish weather data for {city}, code: {result.rc}")
     except Exception as e:
@@ -129,35 +136,48 @@ def main():
         logger.error(f"Failed to start MQTT loop: {e}")
         sys.exit(1)
     
+    schedule = AdaptiveSchedule(POLL_INTERVAL)
+    healthy = False
+    next_fetch = next_heartbeat = time.monotonic()
     while True:
-        try:
-            logger.debug(f"Fetching weather data for {city}")
-            # Try OpenWeatherMap first
-            data = fetch_openweathermap(lat, lon)
-            source = "openweathermap"
-            if not data:
-                logger.warning(f"OpenWeatherMap failed for {city}, falling back to Open-Meteo")
-                data = fetch_openmeteo(lat, lon)
-                source = "openmeteo"
-            
-            if data:
-                publish_weather(client, city, data, source)
-                # Publish source selection
-                source_payload = json.dumps({"source": source})
-                try:
-                    client.publish(f"moodcast/source/{city}", source_payload, qos=QOS)
-                    logger.info(f"Published source {source} for {city} to moodcast/source/{city}")
-                except Exception as e:
-                    logger.error(f"Error publishing source for {city}: {e}")
-                # Publish quality data
-                publish_quality(client, city, pi_id, sensor_id)
-            else:
-                logger.error(f"No weather data available for {city}")
-        
-        except Exception as e:
-            logger.error(f"Error fetching/publishing data for {city}: {e}")
-        
-        time.sleep(60)  # Fetch every 60 seconds
+        if time.monotonic() >= next_fetch:
+            try:
+                logger.debug(f"Fetching weather data for {city}")
+                # Try OpenWeatherMap first
+                data = fetch_openweathermap(lat, lon)
+                source = "openweathermap"
+                if not data:
+                    logger.warning(f"OpenWeatherMap failed for {city}, falling back to Open-Meteo")
+                    data = fetch_openmeteo(lat, lon)
+                    source = "openmeteo"
+
+                healthy = bool(data)
+                if data:
+                    schedule.observe(data, data.get("observed_at"))
+                    publish_weather(client, city, data, source)
+                    # Publish source selection
+                    source_payload = json.dumps({"source": source})
+                    try:
+                        client.publish(f"moodcast/source/{city}", source_payload, qos=QOS)
+                        logger.info(f"Published source {source} for {city} to moodcast/source/{city}")
+                    except Exception as e:
+                        logger.error(f"Error publishing source for {city}: {e}")
+                else:
+                    logger.error(f"No weather data available for {city}")
+
+            except Exception as e:
+                healthy = False
+                logger.error(f"Error fetching/publishing data for {city}: {e}")
+
+            next_fetch = time.monotonic() + schedule.interval
+            logger.debug(f"Next fetch for {city} in {schedule.interval:.0f}s "
+                         f"({'trending' if schedule.trending else 'steady'}, {schedule.saved()} API calls saved)")
+
+        # Heartbeat while the last fetch succeeded, however long the fetch interval
+        if healthy and time.monotonic() >= next_heartbeat:
+            publish_quality(client, city, pi_id, sensor_id)
+            next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+        time.sleep(max(min(next_fetch, next_heartbeat if healthy else next_fetch) - time.monotonic(), 0))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,155 @@
+import sqlite3
+import json
+import time
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from alert_engine import parse_timestamp
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+OFFLINE_AFTER = 300          # seconds without a message before a node counts as offline
+UPTIME_WINDOW = 24 * 3600    # rolling window for uptime
+RATE_WINDOW = 3600           # rolling window for message rate and gap statistics
+MAX_LOGS = 20                # recent events kept per node
+
+# Column order of node_health rows, as written by the ingest writer and read by the API
+COLUMNS = ('city', 'pi_id', 'sensor_id', 'lat', 'lon', 'last_seen', 'first_seen', 'messages',
+           'uptime_pct', 'message_rate', 'gap_avg', 'gap_max', 'outages', 'logs')
+
+def format_time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat(timespec='seconds')
+
+class NodeState:
+    """Rolling health statistics for one IoT node, updated per quality message."""
+
+    def __init__(self, city):
+        self.city = city
+        self.pi_id = None
+        self.sensor_id = None
+        self.lat = None
+        self.lon = None
+        self.first_seen = None
+        self.last_seen = None
+        # Start of the uptime and rate windows: the first message since this
+        # process started, as statistics before a restart are not persisted
+        self.since = None
+        self.messages = 0
+        self.outages = 0
+        # (epoch, seconds of online time credited since the previous message)
+        self.coverage = deque()
+        self.covered = 0.0
+        # (epoch, gap since the previous message) within RATE_WINDOW
+        self.gaps = deque()
+        self.logs = deque(maxlen=MAX_LOGS)
+
+    def log(self, epoch, message):
+        self.logs.append({'timestamp': format_time(epoch), 'message': message})
+
+    def observe(self, epoch):
+        if self.last_seen is None:
+            self.first_seen = epoch
+            self.log(epoch, "Node came online")
+        elif epoch <= self.last_seen:
+            # Duplicate or out-of-order report: counts as a message, not as time
+            self.messages += 1
+            return
+        elif self.since is None:
+            # First message after a restart: the gap spans our own downtime, not the node's
+            pass
+        else:
+            gap = epoch - self.last_seen
+            if gap > OFFLINE_AFTER:
+                self.outages += 1
+                self.log(epoch, f"Node back online after {gap / 60:.1f} min offline")
+            # A node is online for OFFLINE_AFTER seconds after each message
+            credited = min(gap, OFFLINE_AFTER)
+            self.coverage.append((epoch, credited))
+            self.covered += credited
+            self.gaps.append((epoch, gap))
+        if self.since is None:
+            self.since = epoch
+        self.last_seen = epoch
+        self.messages += 1
+        while self.coverage and self.coverage[0][0] < epoch - UPTIME_WINDOW:
+            self.covered -= self.coverage.popleft()[1]
+        while self.gaps and self.gaps[0][0] < epoch - RATE_WINDOW:
+            self.gaps.popleft()
+
+    def row(self):
+        since = self.since if self.since is not None else self.last_seen
+        span = min(UPTIME_WINDOW, self.last_seen - since)
+        uptime = min(100.0, 100.0 * self.covered / span) if span > 0 else 100.0
+        gaps = [gap for _, gap in self.gaps]
+        rate_span = min(RATE_WINDOW, self.last_seen - since)
+        rate = len(gaps) / (rate_span / 60) if rate_span > 0 else 0.0
+        return (
+            self.city, self.pi_id, self.sensor_id, self.lat, self.lon,
+            self.last_seen, self.first_seen, self.messages,
+            round(uptime, 2), round(rate, 3),
+            round(sum(gaps) / len(gaps), 1) if gaps else None,
+            round(max(gaps), 1) if gaps else None,
+            self.outages, json.dumps(list(self.logs))
+        )
+
+class NodeRegistry:
+    """Per-node health maintained as moodcast/quality/# messages are processed.
+
+    observe() parses the reported last_seen once and returns the node's
+    node_health row (see COLUMNS), so readers get last_seen as epoch
+    seconds plus rolling uptime, message rate and gap statistics without
+    parsing or aggregating anything per request.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+
+    def warm(self, conn):
+        """Restore last_seen, counters and logs from node_health after a restart.
+
+        Uptime and message rate start over from each node's next message.
+        """
+        try:
+            rows = conn.execute(
+                "SELECT city, pi_id, sensor_id, lat, lon, last_seen, first_seen, messages, outages, logs FROM node_health"
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error warming node registry: {e}")
+            return 0
+        for city, pi_id, sensor_id, lat, lon, last_seen, first_seen, messages, outages, logs in rows:
+            state = NodeState(city)
+            state.pi_id, state.sensor_id, state.lat, state.lon = pi_id, sensor_id, lat, lon
+            state.last_seen, state.first_seen = last_seen, first_seen
+            state.messages, state.outages = messages or 0, outages or 0
+            try:
+                state.logs.extend(json.loads(logs or '[]'))
+            except ValueError:
+                pass
+            self._nodes[city] = state
+        logger.info(f"Warmed node registry with {len(rows)} nodes")
+        return len(rows)
+
+    def observe(self, city, pi_id, sensor_id, last_seen, lat=None, lon=None):
+        """Record one quality message; returns the node_health row, or None if last_seen is invalid."""
+        try:
+            epoch = parse_timestamp(last_seen) if isinstance(last_seen, str) else float(last_seen)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Invalid last_seen {last_seen!r} for node {city}: {e}")
+            return None
+        state = self._nodes.get(city)
+        if state is None:
+            state = self._nodes[city] = NodeState(city)
+        state.pi_id, state.sensor_id = pi_id, sensor_id
+        if lat is not None and lon is not None:
+            state.lat, state.lon = lat, lon
+        state.observe(epoch)
+        return state.row()
+
+def node_status(last_seen, now=None):
+    """('Online' | 'Offline', freshness seconds or None) for an epoch last_seen."""
+    if last_seen is None:
+        return 'Offline', None
+    freshness = (now or time.time()) - last_seen
+    return ('Online' if freshness < OFFLINE_AFTER else 'Offline'), round(freshness, 1)
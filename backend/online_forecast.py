@@ -0,0 +1,345 @@
+import paho.mqtt.client as mqtt
+import sqlite3
+import numpy as np
+import json
+import struct
+import threading
+import time
+import logging
+import os
+from datetime import datetime, timezone
+from alert_engine import parse_timestamp
+import retention
+import payloads
+import storage
+from predict_weather import TARGETS, HORIZON_HOURS, CLAMP_LOW, CLAMP_HIGH, build_forecasts, cities
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DB_PATH = "moodcast.db"
+MQTT_BROKER = "localhost"
+MQTT_PORT = 1883
+MQTT_TOPIC = "moodcast/forecast"
+SENSOR_TOPIC = "moodcast/sensor/#"
+CLIENT_ID = "moodcast_online_forecast"
+SOURCE = "model_online"     # kept apart from predict_weather's model_prediction runs
+
+CHECKPOINT_PATH = os.getenv("MOODCAST_FORECAST_CHECKPOINT", "online_forecast.json")
+CHECKPOINT_VERSION = 1
+CHECKPOINT_INTERVAL = 300   # seconds between checkpoints
+PUBLISH_INTERVAL = 3600     # seconds between forecast runs
+HALF_LIFE_HOURS = float(os.getenv("MOODCAST_FORECAST_HALF_LIFE", "24"))  # weight of a reading halves after this
+MIN_READINGS = 12           # readings needed before a city is forecast
+WARM_HOURS = 72             # history replayed when a city has no checkpointed state
+RIDGE = 1e-6                # keeps the normal equations solvable on degenerate data
+OBSERVED_SOURCES = ('openweathermap', 'openmeteo')
+
+def features(epoch, origin):
+    """Feature row [1, hours since origin, UTC hour of day], as in predict_weather.fit_and_predict."""
+    return np.array([1.0, (epoch - origin) / 3600, (epoch // 3600) % 24])
+
+class CityModel:
+    """Exponentially weighted least squares over one city's readings.
+
+    Holds the sufficient statistics X'WX and X'WY of the linear model used
+    by predict_weather, so a reading updates it in O(1) and a forecast is
+    one 3x3 solve. Time is measured from the newest reading (origin); when
+    a newer reading arrives the statistics are shifted to the new origin
+    and decayed by the elapsed time, and a late reading from before the
+    origin is folded in already decayed by its age.
+    """
+
+    def __init__(self, half_life_hours=HALF_LIFE_HOURS, lat=None, lon=None):
+        self.half_life_hours = half_life_hours
+        self.lat = lat
+        self.lon = lon
+        self.origin = None
+        self.count = 0
+        self.weight = 0.0
+        self.xtx = np.zeros((3, 3))
+        self.xty = np.zeros((3, len(TARGETS)))
+
+    def update(self, epoch, values):
+        weight = 1.0
+        if self.origin is None:
+            self.origin = epoch
+        elif epoch < self.origin:
+            weight = 0.5 ** ((self.origin - epoch) / 3600 / self.half_life_hours)
+        elif epoch > self.origin:
+            hours = (epoch - self.origin) / 3600
+            decay = 0.5 ** (hours / self.half_life_hours)
+            # Re-express t relative to the new origin: t' = t - hours
+            shift = np.array([[1.0, 0.0, 0.0], [-hours, 1.0, 0.0], [0.0, 0.0, 1.0]])
+            self.xtx = decay * (shift @ self.xtx @ shift.T)
+            self.xty = decay * (shift @ self.xty)
+            self.weight *= decay
+            self.origin = epoch
+        x = features(epoch, self.origin)
+        self.xtx += weight * np.outer(x, x)
+        self.xty += weight * np.outer(x, values)
+        self.weight += weight
+        self.count += 1
+
+    def predict(self, now):
+        """Return (future_epochs, predictions) clamped per target, like fit_and_predict."""
+        coef = np.linalg.solve(self.xtx + RIDGE * np.eye(3), self.xty)
+        future_epochs = now + HORIZON_HOURS * 3600
+        future_X = np.column_stack((
+            np.ones(len(future_epochs)),
+            (future_epochs - self.origin) / 3600,
+            (future_epochs // 3600) % 24
+        ))
+        return future_epochs, np.clip(future_X @ coef, CLAMP_LOW, CLAMP_HIGH)
+
+    def to_dict(self):
+        return {
+            'lat': self.lat,
+            'lon': self.lon,
+            'origin': self.origin,
+            'count': self.count,
+            'weight': self.weight,
+            'xtx': self.xtx.tolist(),
+            'xty': self.xty.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data, half_life_hours=HALF_LIFE_HOURS):
+        model = cls(half_life_hours, data.get('lat'), data.get('lon'))
+        model.origin = data['origin']
+        model.count = data['count']
+        model.weight = data['weight']
+        model.xtx = np.array(data['xtx'], dtype=float)
+        model.xty = np.array(data['xty'], dtype=float)
+        return model
+
+class OnlineForecaster:
+    """Per-city online forecast models, fed one reading at a time.
+
+    update() folds a reading into its city's model; forecasts() serves a
+    prediction on demand without touching the database. State is written
+    to checkpoint_path so a restart only replays readings newer than the
+    checkpoint instead of refitting on 72 hours of history.
+    """
+
+    def __init__(self, checkpoint_path=CHECKPOINT_PATH, half_life_hours=HALF_LIFE_HOURS,
+                 min_readings=MIN_READINGS):
+        self.checkpoint_path = checkpoint_path
+        self.half_life_hours = half_life_hours
+        self.min_readings = min_readings
+        self._lock = threading.Lock()
+        self._models = {}
+        self._stats = {'updates': 0, 'rejected': 0, 'forecasts': 0, 'checkpoints': 0}
+
+    def update(self, city, timestamp, reading, lat=None, lon=None):
+        """Fold one reading (dict with TARGETS keys) into city's model; returns False if unusable."""
+        try:
+            epoch = parse_timestamp(timestamp) if isinstance(timestamp, str) else float(timestamp)
+            # Missing clouds/rain mean none, as in main.on_message
+            values = np.array([
+                float(reading['temp']), float(reading['humidity']),
+                float(reading.get('clouds') or 0), float(reading.get('rain') or 0)
+            ])
+        except (KeyError, TypeError, ValueError):
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        with self._lock:
+            model = self._models.get(city)
+            if model is None:
+                model = self._models[city] = CityModel(self.half_life_hours, lat, lon)
+            if lat is not None and lon is not None:
+                model.lat, model.lon = lat, lon
+            model.update(epoch, values)
+            self._stats['updates'] += 1
+        return True
+
+    def forecasts(self, city, now=None):
+        """Return predict_weather-style forecast dicts for city, or [] if it has too few readings."""
+        now = datetime.now(timezone.utc).timestamp() if now is None else now
+        with self._lock:
+            model = self._models.get(city)
+            if model is None or model.count < self.min_readings:
+                return []
+            future_epochs, predictions = model.predict(now)
+            lat, lon = model.lat, model.lon
+            self._stats['forecasts'] += 1
+        return build_forecasts(city, lat, lon, future_epochs, predictions, now, SOURCE)
+
+    def cities(self):
+        with self._lock:
+            return list(self._models)
+
+    def warm(self, conn, city_list):
+        """Replay readings newer than each city's checkpointed state, at most WARM_HOURS back."""
+        floor = datetime.now(timezone.utc).timestamp() - WARM_HOURS * 3600
+        with self._lock:
+            origins = {city['name']: max(self._models[city['name']].origin, floor)
+                       if city['name'] in self._models else floor for city in city_list}
+        if not origins:
+            return 0
+        since = datetime.fromtimestamp(min(origins.values()), timezone.utc)
+        coords = {city['name']: (city['lat'], city['lon']) for city in city_list}
+        city_marks = ','.join('?' for _ in origins)
+        source_marks = ','.join('?' for _ in OBSERVED_SOURCES)
+        try:
+            _, source, source_params = retention.range_source(conn, since, resolution='raw')
+            rows = conn.execute(f"""
+                SELECT city, ts_ms, temp, humidity, clouds, rain
+                FROM {source}
+                WHERE city IN ({city_marks}) AND source IN ({source_marks}) AND ts_ms >= ?
+                ORDER BY city, ts_ms ASC
+            """, (*source_params, *origins, *OBSERVED_SOURCES, retention.sql_ms(since))).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error warming online forecaster: {e}")
+            return 0
+
+        replayed = 0
+        for city, ts_ms, temp, humidity, clouds, rain in rows:
+            epoch = ts_ms / 1000
+            # Rows at or before the checkpoint are already in the statistics
+            if epoch <= origins[city]:
+                continue
+            lat, lon = coords.get(city, (None, None))
+            reading = {'temp': temp, 'humidity': humidity, 'clouds': clouds, 'rain': rain}
+            if self.update(city, epoch, reading, lat, lon):
+                replayed += 1
+        logger.info(f"Replayed {replayed} readings since {retention.sql_time(since)} into the online forecaster")
+        return replayed
+
+    def save(self, path=None):
+        """Write every city's state atomically to the checkpoint file."""
+        path = path or self.checkpoint_path
+        with self._lock:
+            state = {
+                'version': CHECKPOINT_VERSION,
+                'half_life_hours': self.half_life_hours,
+                'saved_at': datetime.now(timezone.utc).isoformat(),
+                'cities': {city: model.to_dict() for city, model in self._models.items()}
+            }
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error writing forecast checkpoint {path}: {e}")
+            return False
+        with self._lock:
+            self._stats['checkpoints'] += 1
+        logger.debug(f"Checkpointed {len(state['cities'])} online models to {path}")
+        return True
+
+    def load(self, path=None):
+        """Restore state from the checkpoint file; returns the number of cities loaded."""
+        path = path or self.checkpoint_path
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading forecast checkpoint {path}: {e}")
+            return 0
+        if state.get('version') != CHECKPOINT_VERSION or state.get('half_life_hours') != self.half_life_hours:
+            logger.warning(f"Ignoring forecast checkpoint {path} written with different settings")
+            return 0
+        try:
+            models = {city: CityModel.from_dict(data, self.half_life_hours)
+                      for city, data in state.get('cities', {}).items()}
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Invalid forecast checkpoint {path}: {e}")
+            return 0
+        with self._lock:
+            self._models = models
+        logger.info(f"Loaded {len(models)} online models from {path}")
+        return len(models)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['cities'] = len(self._models)
+            snapshot['ready'] = sum(1 for model in self._models.values() if model.count >= self.min_readings)
+        return snapshot
+
+def on_connect(client, userdata, flags, reason_code, properties=None):
+    if reason_code.is_failure:
+        logger.error(f"Failed to connect to MQTT broker with code {reason_code}")
+    else:
+        logger.info("Connected to MQTT broker")
+        client.subscribe(SENSOR_TOPIC, qos=1)
+
+def on_message(client, forecaster, msg):
+    city = msg.topic.split('/')[-1]
+    try:
+        payload = payloads.decode(msg.payload, msg.properties)
+    except (UnicodeDecodeError, ValueError, IndexError, struct.error) as e:
+        logger.error(f"Error decoding message on {msg.topic}: {e}")
+        return
+    timestamp = payload.get('timestamp', datetime.now(timezone.utc).isoformat())
+    forecaster.update(city, timestamp, payload, payload.get('lat'), payload.get('lon'))
+
+def publish_forecasts(client, forecaster):
+    for city in forecaster.cities():
+        run = payloads.forecast_run(forecaster.forecasts(city))
+        if run is None:
+            continue
+        topic = f"{MQTT_TOPIC}/{city}"
+        try:
+            data, properties = payloads.encode('forecast_run', run)
+            client.publish(topic, data, qos=1, properties=properties)
+            logger.debug(f"Published {len(run['steps'])}-step online model run to {topic}")
+        except Exception as e:
+            logger.error(f"Error publishing to {topic}: {e}")
+
+def main():
+    forecaster = OnlineForecaster()
+    forecaster.load()
+    try:
+        conn = storage.connect(DB_PATH, readonly=True)
+        try:
+            forecaster.warm(conn, cities)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Database connection error: {e}")
+
+    client = mqtt.Client(
+        client_id=CLIENT_ID,
+        userdata=forecaster,
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        protocol=mqtt.MQTTv5
+    )
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
+    try:
+        client.connect(MQTT_BROKER, MQTT_PORT)
+        client.loop_start()
+    except Exception as e:
+        logger.error(f"Error connecting to MQTT broker: {e}")
+        return
+
+    next_publish = time.monotonic()
+    next_checkpoint = time.monotonic() + CHECKPOINT_INTERVAL
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= next_publish:
+                publish_forecasts(client, forecaster)
+                logger.info(f"Online forecaster stats: {forecaster.stats()}")
+                next_publish = now + PUBLISH_INTERVAL
+            if now >= next_checkpoint:
+                forecaster.save()
+                next_checkpoint = now + CHECKPOINT_INTERVAL
+            time.sleep(max(min(next_publish, next_checkpoint) - time.monotonic(), 0.1))
+    except KeyboardInterrupt:
+        logger.info("Stopping online forecaster")
+    finally:
+        forecaster.save()
+        client.loop_stop()
+        client.disconnect()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import struct
+import json
+import math
+import os
+from datetime import datetime, timezone
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from alert_engine import parse_timestamp
+
+# MQTT v5 content types. Messages without one are JSON, so old
+# publishers and subscribers keep working.
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_SENSOR_V2 = "application/vnd.moodcast.sensor.v2"
+CONTENT_TYPE_FORECAST_V2 = "application/vnd.moodcast.forecast.v2"
+CONTENT_TYPE_FORECAST_RUN_V2 = "application/vnd.moodcast.forecast-run.v2"
+
+# 'compact' publishes sensor readings and forecast steps in the binary
+# layouts below; 'json' keeps everything as JSON
+PAYLOAD_FORMAT = os.getenv("MOODCAST_PAYLOAD_FORMAT", "compact")
+
+VERSION = 2  # 1 packed the measurements as float32
+# version, epoch, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, mood_score
+# followed by source and city as u8-length-prefixed UTF-8. NaN encodes a missing field.
+# Measurements are doubles, so they decode to exactly the values JSON carries.
+SENSOR_V2 = struct.Struct('<Bddd7d')
+SENSOR_FIELDS = ('temp', 'humidity', 'pressure', 'wind_speed', 'clouds', 'rain', 'mood_score')
+# version, valid epoch, issue epoch, lat, lon, temp, humidity, pressure, wind_speed, clouds, rain, mood_score
+# followed by source and city, as above
+FORECAST_V2 = struct.Struct('<Bdddd7d')
+WEATHER_FIELDS = ('temp', 'humidity', 'pressure', 'wind_speed', 'clouds', 'rain')
+FORECAST_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# A whole forecast run: version, issue epoch, lat, lon, step count, then source
+# and city as above, then one FORECAST_STEP_V2 per step
+# (valid epoch, temp, humidity, pressure, wind_speed, clouds, rain, mood_score)
+FORECAST_RUN_V2 = struct.Struct('<BdddH')
+FORECAST_STEP_V2 = struct.Struct('<d7d')
+MAX_RUN_STEPS = 0xFFFF
+
+NAN = float('nan')
+
+def _num(value):
+    return NAN if value is None else float(value)
+
+def _present(names, values):
+    # NaN marks a field the sender left out; omit it so receivers' .get() defaults apply
+    return {name: value for name, value in zip(names, values) if not math.isnan(value)}
+
+def _epoch(timestamp):
+    return NAN if timestamp is None else parse_timestamp(timestamp)
+
+def _format_epoch(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(FORECAST_TIME_FORMAT)
+
+def _pack_text(*values):
+    parts = []
+    for value in values:
+        # Up to 255 bytes, cut on a character boundary so the text still decodes
+        data = (value or '').encode()[:255].decode('utf-8', 'ignore').encode()
+        parts.append(bytes((len(data),)) + data)
+    return b''.join(parts)
+
+def _unpack_text(payload, offset, count):
+    values = []
+    for _ in range(count):
+        length = payload[offset]
+        values.append(payload[offset + 1:offset + 1 + length].decode() or None)
+        offset += 1 + length
+    return values, offset
+
+def encode_sensor(data):
+    """Pack a sensor reading dict (as published on moodcast/sensor/#) into SENSOR_V2."""
+    head = SENSOR_V2.pack(
+        VERSION, _epoch(data.get('timestamp')), _num(data.get('lat')), _num(data.get('lon')),
+        *(_num(data.get(field)) for field in SENSOR_FIELDS)
+    )
+    return head + _pack_text(data.get('source'), data.get('city'))
+
+def decode_sensor(payload):
+    fields = SENSOR_V2.unpack_from(payload)
+    if fields[0] != VERSION:
+        raise ValueError(f"Unsupported sensor payload version {fields[0]}")
+    (source, city), _ = _unpack_text(payload, SENSOR_V2.size, 2)
+    data = {'city': city}
+    data.update(_present(('lat', 'lon') + SENSOR_FIELDS, fields[2:]))
+    if not math.isnan(fields[1]):
+        data['timestamp'] = datetime.fromtimestamp(fields[1], timezone.utc).isoformat()
+    if source:
+        data['source'] = source
+    return data
+
+def encode_forecast(data):
+    """Pack one forecast step dict (as published on moodcast/forecast/#) into FORECAST_V2."""
+    weather = data.get('weather', {})
+    head = FORECAST_V2.pack(
+        VERSION, _epoch(data.get('timestamp')), _epoch(data.get('issue_time')),
+        _num(data.get('lat')), _num(data.get('lon')),
+        *(_num(weather.get(field)) for field in WEATHER_FIELDS), _num(data.get('mood_score'))
+    )
+    return head + _pack_text(data.get('source'), data.get('city'))
+
+def decode_forecast(payload):
+    fields = FORECAST_V2.unpack_from(payload)
+    if fields[0] != VERSION:
+        raise ValueError(f"Unsupported forecast payload version {fields[0]}")
+    (source, city), _ = _unpack_text(payload, FORECAST_V2.size, 2)
+    data = {'city': city}
+    data.update(_present(('lat', 'lon'), fields[3:5]))
+    data['weather'] = _present(WEATHER_FIELDS, fields[5:11])
+    if source:
+        data['source'] = source
+    data.update(_present(('mood_score',), fields[11:]))
+    if not math.isnan(fields[1]):
+        data['timestamp'] = _format_epoch(fields[1])
+    if not math.isnan(fields[2]):
+        data['issue_time'] = _format_epoch(fields[2])
+    return data
+
+def forecast_run(forecasts):
+    """Group per-step forecast dicts of one city run into a single run message.
+
+    The run carries city, coordinates, source and issue_time once and the
+    steps as a list of {'timestamp', 'weather', 'mood_score'}. Returns None
+    for an empty list.
+    """
+    if not forecasts:
+        return None
+    first = forecasts[0]
+    run = {key: first.get(key) for key in ('city', 'lat', 'lon', 'source', 'issue_time')}
+    run['steps'] = [
+        {'timestamp': step.get('timestamp'), 'weather': step.get('weather', {}), 'mood_score': step.get('mood_score')}
+        for step in forecasts
+    ]
+    return run
+
+def is_forecast_run(data):
+    return isinstance(data.get('steps'), list)
+
+def forecast_steps(data):
+    """Per-step forecast dicts for a message: the steps of a run, or the message itself."""
+    if not is_forecast_run(data):
+        return [data]
+    header = {key: value for key, value in data.items() if key != 'steps'}
+    return [{**header, **step} for step in data['steps']]
+
+def encode_forecast_run(data):
+    """Pack a forecast run dict (see forecast_run) into FORECAST_RUN_V2."""
+    steps = data['steps']
+    if len(steps) > MAX_RUN_STEPS:
+        raise ValueError(f"Forecast run has {len(steps)} steps, at most {MAX_RUN_STEPS} fit")
+    parts = [
+        FORECAST_RUN_V2.pack(VERSION, _epoch(data.get('issue_time')), _num(data.get('lat')),
+                             _num(data.get('lon')), len(steps)),
+        _pack_text(data.get('source'), data.get('city'))
+    ]
+    for step in steps:
+        weather = step.get('weather', {})
+        parts.append(FORECAST_STEP_V2.pack(
+            _epoch(step.get('timestamp')),
+            *(_num(weather.get(field)) for field in WEATHER_FIELDS), _num(step.get('mood_score'))
+        ))
+    return b''.join(parts)
+
+def decode_forecast_run(payload):
+    fields = FORECAST_RUN_V2.unpack_from(payload)
+    if fields[0] != VERSION:
+        raise ValueError(f"Unsupported forecast run payload version {fields[0]}")
+    (source, city), offset = _unpack_text(payload, FORECAST_RUN_V2.size, 2)
+    data = {'city': city}
+    data.update(_present(('lat', 'lon'), fields[2:4]))
+    if source:
+        data['source'] = source
+    if not math.isnan(fields[1]):
+        data['issue_time'] = _format_epoch(fields[1])
+    steps = []
+    for values in FORECAST_STEP_V2.iter_unpack(payload[offset:offset + fields[4] * FORECAST_STEP_V2.size]):
+        step = {'weather': _present(WEATHER_FIELDS, values[1:7])}
+        step.update(_present(('mood_score',), values[7:]))
+        if not math.isnan(values[0]):
+            step['timestamp'] = _format_epoch(values[0])
+        steps.append(step)
+    if len(steps) != fields[4]:
+        raise ValueError(f"Truncated forecast run payload: {len(steps)} of {fields[4]} steps")
+    data['steps'] = steps
+    return data
+
+ENCODERS = {
+    'sensor': (CONTENT_TYPE_SENSOR_V2, encode_sensor),
+    'forecast': (CONTENT_TYPE_FORECAST_V2, encode_forecast),
+    'forecast_run': (CONTENT_TYPE_FORECAST_RUN_V2, encode_forecast_run)
+}
+DECODERS = {
+    CONTENT_TYPE_SENSOR_V2: decode_sensor,
+    CONTENT_TYPE_FORECAST_V2: decode_forecast,
+    CONTENT_TYPE_FORECAST_RUN_V2: decode_forecast_run
+}
+
+def content_properties(content_type):
+    properties = Properties(PacketTypes.PUBLISH)
+    properties.ContentType = content_type
+    return properties
+
+def encode(kind, data, fmt=None):
+    """Return (payload, properties) for a message of kind ('sensor', 'forecast', ...).
+
+    Kinds without a compact layout, and everything when fmt is 'json',
+    are sent as JSON.
+    """
+    fmt = fmt or PAYLOAD_FORMAT
+    if fmt == 'compact' and kind in ENCODERS:
+        content_type, encoder = ENCODERS[kind]
+        try:
+            return encoder(data), content_properties(content_type)
+        except (TypeError, ValueError, struct.error):
+            # e.g. an unparseable timestamp: JSON carries it through unchanged
+            pass
+    return json.dumps(data), content_properties(CONTENT_TYPE_JSON)
+
+def content_type_of(properties):
+    return getattr(properties, 'ContentType', None) if properties is not None else None
+
+def decode(payload, properties=None):
+    """Decode a received payload into a dict, by its MQTT v5 content type (JSON when absent)."""
+    decoder = DECODERS.get(content_type_of(properties))
+    if decoder:
+        return decoder(payload)
+    return json.loads(payload.decode() if isinstance(payload, (bytes, bytearray)) else payload)
+
+def is_json(properties):
+    return content_type_of(properties) in (None, CONTENT_TYPE_JSON)
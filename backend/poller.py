@@ -0,0 +1,249 @@
+import paho.mqtt.client as mqtt
+import json
+import heapq
+import random
+import threading
+import time
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from fetch_weather import fetch_openweathermap, fetch_openmeteo
+import upstream
+from adaptive_schedule import AdaptiveSchedule, MIN_INTERVAL, MAX_INTERVAL
+from mqtt_sensor import CITY_COORDS, HEARTBEAT_INTERVAL, publish_weather, publish_quality
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# MQTT settings
+BROKER = "localhost"
+PORT = 1883
+QOS = 1
+CLIENT_ID = "moodcast_poller"
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+DEFAULT_INTERVAL = 60       # seconds between polls of one location
+DEFAULT_JITTER = 0.1        # +/- fraction of the interval
+DEFAULT_CONCURRENCY = 16    # max fetches in flight
+STATS_LOG_INTERVAL = 300
+
+def load_config(path=CONFIG_PATH):
+    """Read cities and poller settings from config.json, falling back to CITY_COORDS."""
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read {path}: {e}; using built-in cities")
+        config = {}
+    cities = config.get("cities") or [
+        {"name": name, "lat": coords["lat"], "lon": coords["lon"]} for name, coords in CITY_COORDS.items()
+    ]
+    return cities, config.get("poller", {})
+
+class Poller:
+    """Poll many locations from one process.
+
+    Each location is rescheduled after its last fetch finished, after the
+    interval its AdaptiveSchedule picks (+/- jitter): interval seconds while
+    its data keeps changing, backing off towards max_interval while it is
+    static and down to min_interval while an alert condition builds.
+    Fetches run on a bounded thread pool over one pooled HTTP session, and
+    everything is published through one shared MQTT client. Quality
+    heartbeats go out every heartbeat_interval for each location whose
+    last poll succeeded, independent of how far its polling backed off.
+    """
+
+    def __init__(self, client, cities, interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER,
+                 max_concurrency=DEFAULT_CONCURRENCY, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.client = client
+        self.locations = {city["name"]: city for city in cities}
+        self.interval = interval
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.heartbeat_interval = heartbeat_interval
+        self.schedules = {name: AdaptiveSchedule(interval, min_interval, max_interval) for name in self.locations}
+        # Pool large enough for every worker
+        self.session = upstream.make_session(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="poller")
+        self._cond = threading.Condition()
+        self._heap = []
+        self._in_flight = 0
+        self._healthy = set()  # locations whose last poll succeeded
+        self._stop = threading.Event()
+        self._stats = {'polls': 0, 'failures': 0, 'fallbacks': 0, 'total_fetch_s': 0.0}
+
+        # Spread the first round over one interval so fetches do not burst
+        now = time.monotonic()
+        for i, name in enumerate(self.locations):
+            offset = self.interval * i / max(len(self.locations), 1)
+            heapq.heappush(self._heap, (now + offset, name))
+
+    def _next_delay(self, name):
+        return self.schedules[name].interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def poll(self, name):
+        """Fetch one location and publish its weather and source messages."""
+        location = self.locations[name]
+        lat, lon = location["lat"], location["lon"]
+        started = time.monotonic()
+        data = fetch_openweathermap(lat, lon, session=self.session)
+        source = "openweathermap"
+        if not data:
+            logger.warning(f"OpenWeatherMap failed for {name}, falling back to Open-Meteo")
+            data = fetch_openmeteo(lat, lon, session=self.session)
+            source = "openmeteo"
+            self._count('fallbacks')
+        elapsed = time.monotonic() - started
+
+        with self._cond:
+            self._stats['polls'] += 1
+            self._stats['total_fetch_s'] += elapsed
+        if not data:
+            self._count('failures')
+            with self._cond:
+                self._healthy.discard(name)
+            logger.error(f"No weather data available for {name}")
+            return
+        with self._cond:
+            self.schedules[name].observe(data, data.get("observed_at"))
+            recovered = name not in self._healthy
+            self._healthy.add(name)
+
+        publish_weather(self.client, name, data, source, lat=lat, lon=lon)
+        try:
+            self.client.publish(f"moodcast/source/{name}", json.dumps({"source": source}), qos=QOS)
+        except Exception as e:
+            logger.error(f"Error publishing source for {name}: {e}")
+        if recovered:
+            self.heartbeat(name)
+
+    def heartbeat(self, name):
+        publish_quality(self.client, name, f"pi_{name.lower()}", f"sensor_{name.lower()}")
+
+    def heartbeats(self):
+        """Publish a quality heartbeat for every location whose last poll succeeded."""
+        with self._cond:
+            names = list(self._healthy)
+        for name in names:
+            self.heartbeat(name)
+
+    def _count(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    def _run_one(self, name):
+        try:
+            self.poll(name)
+        except Exception as e:
+            self._count('failures')
+            with self._cond:
+                self._healthy.discard(name)
+            logger.error(f"Error fetching/publishing data for {name}: {e}")
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                heapq.heappush(self._heap, (time.monotonic() + self._next_delay(name), name))
+                self._cond.notify()
+
+    def run(self):
+        """Dispatch due locations until stop() is called."""
+        schedule = next(iter(self.schedules.values()), None)
+        bounds = f" ({schedule.min_interval}-{schedule.max_interval}s adaptive)" if schedule else ""
+        logger.info(f"Polling {len(self.locations)} locations every ~{self.interval}s{bounds} "
+                    f"with up to {self.max_concurrency} concurrent fetches")
+        last_stats = time.monotonic()
+        next_heartbeat = last_stats + self.heartbeat_interval
+        while not self._stop.is_set():
+            with self._cond:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now and self._in_flight < self.max_concurrency:
+                    _, name = heapq.heappop(self._heap)
+                    self._in_flight += 1
+                    self._executor.submit(self._run_one, name)
+                if self._in_flight >= self.max_concurrency or not self._heap:
+                    wait = 1.0
+                else:
+                    wait = min(max(self._heap[0][0] - now, 0.01), 1.0)
+                self._cond.wait(wait)
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + self.heartbeat_interval
+                self.heartbeats()
+            if time.monotonic() - last_stats >= STATS_LOG_INTERVAL:
+                last_stats = time.monotonic()
+                logger.info(f"Poller stats: {self.stats()}")
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot['in_flight'] = self._in_flight
+            snapshot['scheduled'] = len(self._heap)
+            snapshot['healthy'] = len(self._healthy)
+            snapshot['calls_saved'] = sum(schedule.saved() for schedule in self.schedules.values())
+            snapshot['trending'] = sum(1 for schedule in self.schedules.values() if schedule.trending)
+            intervals = [schedule.interval for schedule in self.schedules.values()]
+        total = snapshot.pop('total_fetch_s')
+        snapshot['avg_fetch_ms'] = round(total / snapshot['polls'] * 1000, 1) if snapshot['polls'] else 0.0
+        snapshot['avg_interval_s'] = round(sum(intervals) / len(intervals), 1) if intervals else 0.0
+        snapshot['upstream'] = upstream.get_client().stats()
+        return snapshot
+
+def on_connect(client, userdata, flags, reason_code, properties=None):
+    if reason_code.is_failure:
+        logger.error(f"Poller failed to connect to MQTT broker, code: {reason_code}")
+    else:
+        logger.info("Poller connected to MQTT broker")
+
+def main():
+    cities, settings = load_config()
+    if len(sys.argv) > 1:
+        # Optional subset: python poller.py Auckland Tokyo
+        wanted = set(sys.argv[1:])
+        cities = [city for city in cities if city["name"] in wanted]
+    if not cities:
+        logger.error("No cities configured to poll")
+        sys.exit(1)
+
+    client = mqtt.Client(
+        client_id=CLIENT_ID,
+        callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+        protocol=mqtt.MQTTv5
+    )
+    client.on_connect = on_connect
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
+    try:
+        client.connect(BROKER, PORT, keepalive=60)
+        client.loop_start()
+    except Exception as e:
+        logger.error(f"Failed to initialize or connect MQTT client: {e}")
+        sys.exit(1)
+
+    poller = Poller(
+        client, cities,
+        interval=settings.get("interval", DEFAULT_INTERVAL),
+        jitter=settings.get("jitter", DEFAULT_JITTER),
+        max_concurrency=settings.get("max_concurrency", DEFAULT_CONCURRENCY),
+        min_interval=settings.get("min_interval", MIN_INTERVAL),
+        max_interval=settings.get("max_interval", MAX_INTERVAL),
+        heartbeat_interval=settings.get("heartbeat_interval", HEARTBEAT_INTERVAL)
+    )
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        logger.info("Stopping poller")
+    finally:
+        poller.stop()
+        client.loop_stop()
+        client.disconnect()
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 import sqlite3
-import pandas as pd
 import numpy as np
 from sklearn.linear_model import LinearRegression
 import paho.mqtt.client as mqtt
-import json
 import time
 import logging
-from datetime import datetime, timedelta
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import payloads
+import export
+import backends
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -16,6 +19,8 @@ DB_PATH = "moodcast.db"
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPIC = "moodcast/forecast"
+PREDICT_WORKERS = int(os.getenv("MOODCAST_PREDICT_WORKERS", "1"))
+HISTORY_HOURS = 72
 
 cities = [
     {"name": "Auckland", "lat": -36.8485, "lon": 174.7633},
@@ -30,81 +35,128 @@ cities = [
     {"name": "Cape Town", "lat": -33.9249, "lon": 18.4241},
 ]
 
-def get_historical_data(city, lat, lon):
+FEATURES = ['time_diff', 'hour']
+TARGETS = ['temp', 'humidity', 'clouds', 'rain']
+MIN_ROWS = 864  # ~72 hours at 5-minute intervals
+HORIZON_HOURS = np.arange(3, 73, 3)  # next 72 hours at 3-hour intervals
+# Per-target clamp bounds, in TARGETS order
+CLAMP_LOW = np.array([0, 0, 0, 0], dtype=float)
+CLAMP_HIGH = np.array([np.inf, 100, 100, np.inf])
+
+def history_backend():
+    """Storage the training history is read from: moodcast.db, or the backend MOODCAST_HISTORY_BACKEND selects."""
+    if backends.HISTORY_BACKEND == 'sqlite':
+        return backends.SQLiteBackend(DB_PATH, readonly=True)
+    return backends.open_backend(readonly=True)
+
+def get_historical_data_bulk(city_names):
+    """Load the last 72 hours for every city in one range query as NumPy columns, ordered by city then time."""
+    if not city_names:
+        return export.to_columns([])
     try:
-        conn = sqlite3.connect(DB_PATH)
-        query = """
-            SELECT timestamp, temp, humidity, clouds, rain
-            FROM sensor_data
-            WHERE city = ? AND ABS(lat - ?) <= 0.1 AND ABS(lon - ?) <= 0.1
-            AND timestamp >= datetime('now', '-72 hours')
-            ORDER BY timestamp ASC
-        """
-        df = pd.read_sql_query(query, conn, params=(city, lat, lon))
-        conn.close()
-        return df
-    except sqlite3.Error as e:
+        backend = history_backend()
+        try:
+            since = datetime.now(timezone.utc) - timedelta(hours=HISTORY_HOURS)
+            # Raw rows for the window may span the hot table and rotated partitions
+            return backend.range_query(since, cities=list(city_names))
+        finally:
+            backend.close()
+    except (sqlite3.Error, OSError) as e:
         logger.error(f"Database query error: {e}")
-        return pd.DataFrame()
+        return export.to_columns([])
 
-def predict_weather(city, lat, lon):
-    df = get_historical_data(city, lat, lon)
-    if len(df) < 864:  # ~72 hours at 5-minute intervals
-        logger.warning(f"Insufficient data for {city}: {len(df)} rows")
-        return []
-    
-    # Prepare features: time since start, hour of day
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df['time_diff'] = (df['timestamp'] - df['timestamp'].min()).dt.total_seconds() / 3600
-    df['hour'] = df['timestamp'].dt.hour
-    features = ['time_diff', 'hour']
-    targets = ['temp', 'humidity', 'clouds', 'rain']
-    
-    predictions = []
-    now = datetime.utcnow()
-    
-    for target in targets:
-        X = df[features]
-        y = df[target]
-        model = LinearRegression()
-        model.fit(X, y)
-        
-        # Predict for next 72 hours (3-hour intervals)
-        future_times = [now + timedelta(hours=i) for i in range(3, 73, 3)]
-        future_features = pd.DataFrame({
-            'time_diff': [(t - df['timestamp'].min()).total_seconds() / 3600 for t in future_times],
-            'hour': [t.hour for t in future_times]
-        })
-        
-        preds = model.predict(future_features)
-        predictions.append(preds)
-    
-    # Combine predictions
+def fit_and_predict(epochs, values, now):
+    """Fit all targets in one multi-output regression and predict the horizon.
+
+    epochs: reading times in epoch seconds, values: (n, len(TARGETS)) array.
+    Returns (future_epochs, predictions) with predictions clamped per target.
+    """
+    start = epochs.min()
+    X = np.column_stack(((epochs - start) / 3600, (epochs // 3600) % 24))
+    model = LinearRegression()
+    model.fit(X, values)
+
+    future_epochs = now + HORIZON_HOURS * 3600
+    future_X = np.column_stack(((future_epochs - start) / 3600, (future_epochs // 3600) % 24))
+    predictions = np.clip(model.predict(future_X), CLAMP_LOW, CLAMP_HIGH)
+    return future_epochs, predictions
+
+def build_forecasts(city, lat, lon, future_epochs, predictions, issued_at, source='model_prediction'):
+    """Forecast message dicts for one run; issued_at (epoch seconds) and source identify the run."""
+    issue_time = datetime.fromtimestamp(issued_at, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    temp, clouds = predictions[:, 0], predictions[:, 2]
+    mood_scores = np.round(np.clip((100 - clouds) * (temp / 30), 0, 100), 1)
     forecasts = []
-    for i, t in enumerate(future_times):
+    for epoch, row, mood_score in zip(future_epochs, predictions, mood_scores):
+        timestamp = datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
         weather = {
-            'temp': max(predictions[0][i], 0),
-            'humidity': min(max(predictions[1][i], 0), 100),
-            'clouds': min(max(predictions[2][i], 0), 100),
-            'rain': max(predictions[3][i], 0),
-            'timestamp': t.strftime('%Y-%m-%d %H:%M:%S'),
-            'source': 'model_prediction'
+            'temp': float(row[0]),
+            'humidity': float(row[1]),
+            'clouds': float(row[2]),
+            'rain': float(row[3]),
+            'timestamp': timestamp,
+            'source': source,
+            'mood_score': float(mood_score)
         }
-        mood_score = min(max((100 - weather['clouds']) * (weather['temp'] / 30), 0), 100)
-        weather['mood_score'] = round(mood_score, 1)
         forecasts.append({
             'city': city,
             'lat': lat,
             'lon': lon,
             'weather': weather,
-            'timestamp': weather['timestamp'],
+            'timestamp': timestamp,
+            'issue_time': issue_time,
             'source': weather['source'],
             'mood_score': weather['mood_score']
         })
-    
-    logger.debug(f"Generated {len(forecasts)} model predictions for {city}")
     return forecasts
 
+def _prepare(columns, rows):
+    """Turn one city's slice of the history columns into (epochs, values), dropping incomplete rows."""
+    values = np.column_stack([columns[target][rows] for target in TARGETS])
+    epochs = columns['ts_ms'][rows] / 1000
+    complete = ~np.isnan(values).any(axis=1) & ~np.isnan(epochs)
+    return epochs[complete], values[complete]
+
+def _predict_city(args):
+    """Worker entry point: (city dict, epochs, values, now) -> forecasts."""
+    city, epochs, values, now = args
+    future_epochs, predictions = fit_and_predict(epochs, values, now)
+    return build_forecasts(city['name'], city['lat'], city['lon'], future_epochs, predictions, now)
+
+def predict_all(city_list, workers=None):
+    """Predict every city from one bulk query; workers > 1 fits cities in a process pool."""
+    now = datetime.now(timezone.utc).timestamp()
+    columns = get_historical_data_bulk([city['name'] for city in city_list])
+    # Rows come ordered by city, so each city is one contiguous slice
+    names, starts, counts = np.unique(columns['city'], return_index=True, return_counts=True)
+    slices = {name: slice(start, start + count) for name, start, count in zip(names, starts, counts)}
+
+    jobs = []
+    for city in city_list:
+        rows = slices.get(city['name'])
+        count = 0 if rows is None else rows.stop - rows.start
+        if count < MIN_ROWS:
+            logger.warning(f"Insufficient data for {city['name']}: {count} rows")
+            continue
+        epochs, values = _prepare(columns, rows)
+        jobs.append((city, epochs, values, now))
+
+    results = {}
+    if workers and workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for job, forecasts in zip(jobs, pool.map(_predict_city, jobs, chunksize=max(1, len(jobs) // (workers * 4)))):
+                results[job[0]['name']] = forecasts
+    else:
+        for job in jobs:
+            results[job[0]['name']] = _predict_city(job)
+
+    for name, forecasts in results.items():
+        logger.debug(f"Generated {len(forecasts)} model predictions for {name}")
+    return results
+
+def predict_weather(city, lat, lon):
+    return predict_all([{'name': city, 'lat': lat, 'lon': lon}]).get(city, [])
+
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         logger.info("Connected to MQTT broker")
@@ -122,15 +174,18 @@ def main():
         return
 
     while True:
+        results = predict_all(cities, workers=PREDICT_WORKERS)
         for city in cities:
-            forecasts = predict_weather(city['name'], city['lat'], city['lon'])
-            for forecast in forecasts:
-                topic = f"{MQTT_TOPIC}/{city['name']}"
-                try:
-                    client.publish(topic, json.dumps(forecast), qos=1)
-                    logger.debug(f"Published model prediction to {topic}")
-                except Exception as e:
-                    logger.error(f"Error publishing to {topic}: {e}")
+            run = payloads.forecast_run(results.get(city['name'], []))
+            if run is None:
+                continue
+            topic = f"{MQTT_TOPIC}/{city['name']}"
+            try:
+                data, properties = payloads.encode('forecast_run', run)
+                client.publish(topic, data, qos=1, properties=properties)
+                logger.debug(f"Published {len(run['steps'])}-step model prediction run to {topic}")
+            except Exception as e:
+                logger.error(f"Error publishing to {topic}: {e}")
         time.sleep(3600)  # Run every hour
 
 if __name__ == "__main__":
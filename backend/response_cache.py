@@ -0,0 +1,127 @@
+import sqlite3
+import threading
+import hashlib
+import time
+import logging
+from collections import OrderedDict
+import storage
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DB_PATH = "moodcast.db"
+GLOBAL_SCOPE = '*'  # bumped on every ingest batch
+
+def make_etag(body):
+    """Strong entity tag for a response body (unquoted, as werkzeug expects)."""
+    return hashlib.sha1(body).hexdigest()[:20]
+
+class DataVersions:
+    """Read the per-city write counters the ingest writer keeps in data_versions.
+
+    The table is reloaded at most once per poll_interval seconds through one
+    shared connection, so checking freshness costs a dict lookup.
+    """
+
+    def __init__(self, db_path=DB_PATH, poll_interval=0.5):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._versions = {}
+        self._loaded_at = 0.0
+
+    def _refresh(self):
+        if self._conn is None:
+            self._conn = storage.connect(self.db_path, readonly=True, check_same_thread=False)
+        try:
+            self._versions = dict(self._conn.execute("SELECT scope, version FROM data_versions").fetchall())
+        except sqlite3.Error as e:
+            logger.error(f"Error reading data versions: {e}")
+            self._versions = {}
+        self._loaded_at = time.monotonic()
+
+    def get(self, scope):
+        with self._lock:
+            if time.monotonic() - self._loaded_at >= self.poll_interval:
+                self._refresh()
+            return self._versions.get(scope, 0)
+
+class ResponseCache:
+    """TTL + LRU cache of rendered responses, validated against data versions.
+
+    Each entry remembers the version of its scope (a city, or GLOBAL_SCOPE)
+    at the time it was rendered; a newer version means the ingest side wrote
+    rows for that scope and the entry is discarded.
+    """
+
+    def __init__(self, versions, max_entries=512, ttl=60):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'not_modified': 0,
+            'expired': 0,
+            'invalidated': 0,
+            'evicted': 0
+        }
+
+    def get(self, key, scope):
+        """Return (body, mimetype, etag) for a fresh entry, or None."""
+        version = self.versions.get(scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            body, mimetype, etag, entry_version, expires = entry
+            if entry_version != version:
+                del self._entries[key]
+                self._counters['invalidated'] += 1
+                self._counters['misses'] += 1
+                return None
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return body, mimetype, etag
+
+    def put(self, key, scope, body, mimetype, ttl=None, version=None):
+        """Store a rendered body; version should be read before the data was queried."""
+        if version is None:
+            version = self.versions.get(scope)
+        etag = make_etag(body)
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (body, mimetype, etag, version, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evicted'] += 1
+        return etag
+
+    def record_not_modified(self):
+        with self._lock:
+            self._counters['not_modified'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._counters)
+            snapshot['entries'] = len(self._entries)
+        lookups = snapshot['hits'] + snapshot['misses']
+        snapshot['hit_ratio'] = round(snapshot['hits'] / lookups, 3) if lookups else 0.0
+        snapshot['max_entries'] = self.max_entries
+        snapshot['ttl'] = self.ttl
+        return snapshot
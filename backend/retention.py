@@ -0,0 +1,370 @@
+import sqlite3
+import time
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+import storage
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DB_PATH = "moodcast.db"
+
+HOT_TABLE = "sensor_data"
+PARTITION_PREFIX = "sensor_data_p"
+
+# Days each resolution is kept (0 = forever), overridable from the environment
+RETENTION_DAYS = {
+    'raw': float(os.getenv("MOODCAST_RAW_RETENTION_DAYS", "7")),
+    '5m': float(os.getenv("MOODCAST_ROLLUP_5M_DAYS", "30")),
+    '1h': float(os.getenv("MOODCAST_ROLLUP_1H_DAYS", "365")),
+    '1d': float(os.getenv("MOODCAST_ROLLUP_1D_DAYS", "0"))
+}
+RESOLUTIONS = ('raw', '5m', '1h', '1d')  # finest first
+STEP_SECONDS = {'raw': 60, '5m': 300, '1h': 3600, '1d': 86400}
+MAINTENANCE_INTERVAL = float(os.getenv("MOODCAST_RETENTION_INTERVAL", "300"))
+EXPIRE_BATCH = int(os.getenv("MOODCAST_RETENTION_EXPIRE_BATCH", "5000"))  # rollup buckets deleted per run
+
+# Forecasts are predictions, not observations, so they are not rolled up
+FORECAST_SOURCES = ('openweathermap_forecast', 'openmeteo_forecast', 'model_prediction', 'model_online')
+
+# Columns every resolution can serve; rollups hold per-bucket averages
+# (ts_ms is the reading time in epoch milliseconds: filter and sort on it)
+RANGE_COLUMNS = ('city', 'lat', 'lon', 'temp', 'humidity', 'pressure', 'wind_speed',
+                 'clouds', 'rain', 'timestamp', 'source', 'mood_score', 'ts_ms')
+
+# Bucket width of each rollup resolution in milliseconds
+BUCKET_MS = {'5m': 300_000, '1h': 3_600_000, '1d': 86_400_000}
+
+def sql_time(moment):
+    """Format an aware datetime (or epoch seconds) as stored in sensor_partitions and rollup timestamps."""
+    if isinstance(moment, (int, float)):
+        moment = datetime.fromtimestamp(moment, timezone.utc)
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def sql_ms(moment):
+    """Epoch milliseconds of an aware datetime (or epoch seconds), as ts_ms range filters compare."""
+    if isinstance(moment, datetime):
+        moment = moment.timestamp()
+    return int(round(moment * 1000))
+
+def _aggregate_select(table, resolution, where="1"):
+    """GROUP BY select producing sensor_rollup_* rows (in column order) from a raw table.
+
+    where further filters the raw rows (it may use bucket_ms); its
+    parameters follow FORECAST_SOURCES.
+    """
+    marks = ','.join('?' for _ in FORECAST_SOURCES)
+    return f"""
+        SELECT city, source, strftime('%Y-%m-%d %H:%M:%S', bucket_ms / 1000, 'unixepoch') AS timestamp,
+               bucket_ms AS ts_ms, AVG(lat) AS lat, AVG(lon) AS lon,
+               AVG(temp) AS temp, MIN(temp) AS temp_min, MAX(temp) AS temp_max,
+               AVG(humidity) AS humidity, AVG(pressure) AS pressure,
+               AVG(wind_speed) AS wind_speed, MAX(wind_speed) AS wind_speed_max,
+               AVG(clouds) AS clouds, AVG(rain) AS rain, AVG(mood_score) AS mood_score,
+               COUNT(*) AS samples
+        FROM (SELECT *, ts_ms / {BUCKET_MS[resolution]} * {BUCKET_MS[resolution]} AS bucket_ms FROM {table})
+        WHERE bucket_ms IS NOT NULL AND source NOT IN ({marks}) AND ({where})
+        GROUP BY city, source, bucket_ms
+    """
+
+def _weighted(column):
+    """ON CONFLICT merge of two bucket averages, weighted by their sample counts."""
+    return f"""{column} = CASE
+        WHEN excluded.{column} IS NULL THEN {column}
+        WHEN {column} IS NULL THEN excluded.{column}
+        ELSE ({column} * samples + excluded.{column} * excluded.samples) / (samples + excluded.samples) END"""
+
+def _rollup_sql(table, resolution, where="1"):
+    return f"""
+        INSERT INTO sensor_rollup_{resolution} (
+            city, source, timestamp, ts_ms, lat, lon, temp, temp_min, temp_max, humidity, pressure,
+            wind_speed, wind_speed_max, clouds, rain, mood_score, samples
+        )
+        {_aggregate_select(table, resolution, where)}
+        ON CONFLICT(city, source, timestamp) DO UPDATE SET
+            {', '.join(_weighted(c) for c in ('lat', 'lon', 'temp', 'humidity', 'pressure', 'wind_speed', 'clouds', 'rain', 'mood_score'))},
+            temp_min = MIN(COALESCE(temp_min, excluded.temp_min), COALESCE(excluded.temp_min, temp_min)),
+            temp_max = MAX(COALESCE(temp_max, excluded.temp_max), COALESCE(excluded.temp_max, temp_max)),
+            wind_speed_max = MAX(COALESCE(wind_speed_max, excluded.wind_speed_max), COALESCE(excluded.wind_speed_max, wind_speed_max)),
+            samples = samples + excluded.samples
+    """
+
+def partitions(conn, since=None, until=None):
+    """Names of raw partitions overlapping [since, until] (sql_time strings), newest first."""
+    query = "SELECT name FROM sensor_partitions WHERE 1"
+    params = []
+    if since is not None:
+        query += " AND max_ts >= ?"
+        params.append(since)
+    if until is not None:
+        query += " AND min_ts <= ?"
+        params.append(until)
+    try:
+        return [row[0] for row in conn.execute(query + " ORDER BY max_ts DESC", params).fetchall()]
+    except sqlite3.Error:
+        # Schema not migrated yet: only the hot table exists
+        return []
+
+def raw_tables(conn, since=None, until=None):
+    """Hot table plus the raw partitions covering the range, newest first."""
+    return [HOT_TABLE] + partitions(conn, since, until)
+
+def pick_resolution(since, until=None, max_points=None):
+    """Finest resolution still retained at since that keeps the range under max_points per series."""
+    now = datetime.now(timezone.utc)
+    until = until or now
+    for resolution in RESOLUTIONS:
+        days = RETENTION_DAYS[resolution]
+        if days and since < now - timedelta(days=days):
+            continue
+        if max_points and (until - since).total_seconds() / STEP_SECONDS[resolution] > max_points:
+            continue
+        return resolution
+    return RESOLUTIONS[-1]
+
+def range_source(conn, since=None, until=None, resolution=None, columns=RANGE_COLUMNS, max_points=None):
+    """Build a FROM-clause subquery serving sensor rows for a time range.
+
+    Returns (resolution, sql, params): sql is a parenthesised UNION ALL
+    over the raw tables overlapping the range, or over a rollup table plus
+    the hot table's buckets after the last rolled-up one, aggregated on the
+    fly, with the given columns. since and
+    until are aware datetimes; resolution defaults to pick_resolution().
+    Callers add their own WHERE on city/source/ts_ms around it.
+    """
+    if resolution is None:
+        resolution = pick_resolution(since, until, max_points) if since else 'raw'
+    select_list = ', '.join(columns)
+    since_s = sql_time(since) if since else None
+    until_s = sql_time(until) if until else None
+
+    if resolution == 'raw':
+        tables = raw_tables(conn, since_s, until_s)
+        sql = " UNION ALL ".join(f"SELECT {select_list} FROM {table}" for table in tables)
+        return resolution, f"({sql})", []
+
+    # Rollups cover rotated partitions; today's hot rows are aggregated on demand.
+    # Late rows for an already rolled-up bucket wait for the next rotation
+    # rather than returning that bucket twice.
+    newer = f"bucket_ms > IFNULL((SELECT MAX(ts_ms) FROM sensor_rollup_{resolution}), bucket_ms - 1)"
+    live = f"SELECT {select_list} FROM ({_aggregate_select(HOT_TABLE, resolution, newer)})"
+    params = list(FORECAST_SOURCES)
+    rollup_where = ""
+    rollup_params = []
+    if since:
+        rollup_where = " WHERE ts_ms >= ?"
+        rollup_params.append(sql_ms(since))
+    sql = f"SELECT {select_list} FROM sensor_rollup_{resolution}{rollup_where} UNION ALL {live}"
+    return resolution, f"({sql})", rollup_params + params
+
+class RetentionManager:
+    """Rotate, roll up and expire sensor_data partitions.
+
+    sensor_data is the hot partition that ingest writes to. Rows from
+    earlier UTC days are moved into one sensor_data_pYYYYMMDD partition
+    per day, and rolled up into the 5m, 1h and 1d tables as they move, so
+    each partition holds exactly its day and partitions older than the raw
+    retention are dropped whole. Meant to run on the ingest writer's
+    connection.
+    """
+
+    def __init__(self, retention_days=None, interval=MAINTENANCE_INTERVAL, expire_batch=EXPIRE_BATCH):
+        self.retention_days = dict(RETENTION_DAYS, **(retention_days or {}))
+        self.interval = interval
+        self.expire_batch = expire_batch
+        self._last_run = 0.0
+        self._stats = {'rotated': 0, 'dropped': 0, 'rolled_up_rows': 0, 'expired_buckets': 0, 'errors': 0}
+
+    def run_if_due(self, conn):
+        """Maintenance hook: run at most once per interval seconds."""
+        if time.monotonic() - self._last_run < self.interval:
+            return
+        self._last_run = time.monotonic()
+        self.run(conn)
+
+    def run(self, conn, now=None):
+        now = now or datetime.now(timezone.utc)
+        try:
+            self.rotate(conn, now)
+            self.expire(conn, now)
+        except sqlite3.Error as e:
+            self._stats['errors'] += 1
+            logger.error(f"Retention maintenance failed: {e}")
+
+    def rotate(self, conn, now=None):
+        """Move hot rows from before today (UTC) into their day's partition; returns the partitions written.
+
+        Normally this runs shortly after midnight, when nearly every hot row
+        is from yesterday: the hot table is renamed to become yesterday's
+        partition and only today's few rows are copied back into a fresh
+        one, so no bulk DELETE runs on the table ingest writes to. Past rows
+        that are the minority (late readings for a rotated day, or several
+        days at once) are copied out instead, one day per transaction.
+        Rows without a ts_ms go to the newest day moved.
+        """
+        now = now or datetime.now(timezone.utc)
+        today = sql_ms(now.replace(hour=0, minute=0, second=0, microsecond=0))
+        counts = dict(conn.execute(
+            f"SELECT ts_ms / {BUCKET_MS['1d']}, COUNT(*) FROM {HOT_TABLE} GROUP BY 1"
+        ).fetchall())
+        days = sorted(day for day in counts if day is not None and day * BUCKET_MS['1d'] < today)
+        if not days:
+            return []
+
+        started = time.perf_counter()
+        written = []
+        moved = 0
+        rolled_up = 0
+        past = sum(counts[day] for day in days) + counts.get(None, 0)
+        name = self._partition_name(days[0] * BUCKET_MS['1d'])
+        if len(days) == 1 and past >= sum(counts.values()) - past and not self._exists(conn, name):
+            rolled_up += self._rename_hot(conn, name, today, now)
+            written.append(name)
+            moved += past
+        else:
+            for day in days:
+                count, rows = self._copy_day(conn, day, day == days[-1], now)
+                rolled_up += rows
+                written.append(self._partition_name(day * BUCKET_MS['1d']))
+                moved += count
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._stats['rotated'] += len(written)
+        self._stats['rolled_up_rows'] += rolled_up
+        logger.info(f"Rotated {moved} rows into {', '.join(written)}, {rolled_up} rollup rows, in {elapsed_ms:.1f} ms")
+        return written
+
+    @staticmethod
+    def _partition_name(start_ms):
+        return f"{PARTITION_PREFIX}{sql_time(start_ms / 1000)[:10].replace('-', '')}"
+
+    @staticmethod
+    def _exists(conn, name):
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+    @staticmethod
+    def _register(conn, name, now):
+        """Record (or widen) a partition's range in sensor_partitions from rows just added to it."""
+        conn.execute(f"""
+            INSERT INTO sensor_partitions (name, min_ts, max_ts, row_count, created_at)
+            SELECT ?, strftime('%Y-%m-%d %H:%M:%S', MIN(ts_ms) / 1000, 'unixepoch'),
+                   strftime('%Y-%m-%d %H:%M:%S', MAX(ts_ms) / 1000, 'unixepoch'), COUNT(*), ?
+            FROM {name}
+            WHERE 1
+            ON CONFLICT(name) DO UPDATE SET
+                min_ts = MIN(min_ts, excluded.min_ts),
+                max_ts = MAX(max_ts, excluded.max_ts),
+                row_count = excluded.row_count
+        """, (name, sql_time(now)))
+
+    def _rename_hot(self, conn, name, today, now):
+        """Turn the hot table into partition name, keeping its rows from today in a new hot table."""
+        table_sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (HOT_TABLE,)
+        ).fetchone()[0]
+        indexes = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (HOT_TABLE,)
+        ).fetchall()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"ALTER TABLE {HOT_TABLE} RENAME TO {name}")
+            # Index names are global, so the hot table's indexes move back to the new table
+            for index_name, _ in indexes:
+                conn.execute(f"DROP INDEX {index_name}")
+            conn.execute(table_sql)
+            for _, index_sql in indexes:
+                conn.execute(index_sql)
+            # Keep ids increasing across partitions (the rename took the sequence row along)
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT ?, seq FROM sqlite_sequence WHERE name = ?",
+                         (HOT_TABLE, name))
+            conn.execute(f"INSERT INTO {HOT_TABLE} SELECT * FROM {name} WHERE ts_ms >= ?", (today,))
+            conn.execute(f"DELETE FROM {name} WHERE ts_ms >= ?", (today,))
+            conn.execute(f"CREATE INDEX idx_{name}_city_source_ts_ms ON {name} (city, source, ts_ms)")
+            rolled_up = 0
+            for resolution in ('5m', '1h', '1d'):
+                rolled_up += conn.execute(_rollup_sql(name, resolution), FORECAST_SOURCES).rowcount
+            self._register(conn, name, now)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return rolled_up
+
+    def _copy_day(self, conn, day, newest, now):
+        """Copy one past day's hot rows into its partition, roll them up and delete them; returns (rows, rollup rows)."""
+        start_ms = day * BUCKET_MS['1d']
+        where = "ts_ms >= ? AND ts_ms < ?"
+        if newest:
+            where = f"({where}) OR ts_ms IS NULL"
+        params = (start_ms, start_ms + BUCKET_MS['1d'])
+        name = self._partition_name(start_ms)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not self._exists(conn, name):
+                conn.execute(f"CREATE TABLE {name} AS SELECT * FROM {HOT_TABLE} WHERE 0")
+                conn.execute(f"CREATE INDEX idx_{name}_city_source_ts_ms ON {name} (city, source, ts_ms)")
+            count = conn.execute(f"INSERT INTO {name} SELECT * FROM {HOT_TABLE} WHERE {where}", params).rowcount
+            rolled_up = 0
+            for resolution in ('5m', '1h', '1d'):
+                rolled_up += conn.execute(_rollup_sql(HOT_TABLE, resolution, where),
+                                          (*FORECAST_SOURCES, *params)).rowcount
+            conn.execute(f"DELETE FROM {HOT_TABLE} WHERE {where}", params)
+            self._register(conn, name, now)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return count, rolled_up
+
+    def expire(self, conn, now=None):
+        """Drop raw partitions past their retention and delete expired rollup buckets in batches."""
+        now = now or datetime.now(timezone.utc)
+        raw_days = self.retention_days['raw']
+        if raw_days:
+            cutoff = sql_time(now - timedelta(days=raw_days))
+            expired = conn.execute("SELECT name FROM sensor_partitions WHERE max_ts < ?", (cutoff,)).fetchall()
+            for (name,) in expired:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(f"DROP TABLE IF EXISTS {name}")
+                    conn.execute("DELETE FROM sensor_partitions WHERE name = ?", (name,))
+                    conn.execute("COMMIT")
+                except sqlite3.Error:
+                    conn.execute("ROLLBACK")
+                    raise
+                self._stats['dropped'] += 1
+                logger.info(f"Dropped expired raw partition {name}")
+
+        for resolution in ('5m', '1h', '1d'):
+            days = self.retention_days[resolution]
+            if not days:
+                continue
+            # At most expire_batch buckets per run, oldest first, so one pass never
+            # holds the writer long; a backlog drains over the following runs
+            table = f"sensor_rollup_{resolution}"
+            cursor = conn.execute(f"""
+                DELETE FROM {table} WHERE (city, source, timestamp) IN (
+                    SELECT city, source, timestamp FROM {table} WHERE ts_ms < ? ORDER BY ts_ms LIMIT ?
+                )
+            """, (sql_ms(now - timedelta(days=days)), self.expire_batch))
+            self._stats['expired_buckets'] += max(cursor.rowcount, 0)
+
+    def stats(self):
+        return dict(self._stats)
+
+def main():
+    conn = storage.writer_connection(DB_PATH)
+    try:
+        manager = RetentionManager()
+        manager.run(conn)
+        for name, min_ts, max_ts, row_count in conn.execute(
+                "SELECT name, min_ts, max_ts, row_count FROM sensor_partitions ORDER BY max_ts"):
+            logger.info(f"{name}: {row_count} rows, {min_ts} to {max_ts}")
+        logger.info(f"Retention stats: {manager.stats()}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import logging
+
+# The ASGI mode runs under uvicorn; api.py alone still serves through app.run
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Launcher defaults (overridable from the environment or the command line)
+ASGI_HOST = os.getenv("MOODCAST_ASGI_HOST", "0.0.0.0")
+ASGI_PORT = int(os.getenv("MOODCAST_ASGI_PORT", "5000"))
+ASGI_WORKERS = int(os.getenv("MOODCAST_ASGI_WORKERS", str(os.cpu_count() or 1)))
+ASGI_GRACEFUL_TIMEOUT = float(os.getenv("MOODCAST_ASGI_GRACEFUL_TIMEOUT", "15"))  # seconds open connections get on shutdown
+ASGI_KEEPALIVE = float(os.getenv("MOODCAST_ASGI_KEEPALIVE", "5"))
+
+def main():
+    """Serve asgi.application from several worker processes.
+
+    uvicorn supervises the workers, restarting any that die. On SIGINT or
+    SIGTERM each worker stops accepting, gives open connections up to
+    --graceful-timeout seconds (open /stream clients are cut after it),
+    then runs the bridge's lifespan shutdown, which drains in-flight
+    requests and closes the read pool. The workers share nothing but
+    moodcast.db: each has its own read pool, response cache and stream
+    hub.
+    """
+    parser = argparse.ArgumentParser(description="Serve the MoodCast API over ASGI")
+    parser.add_argument('--host', default=ASGI_HOST)
+    parser.add_argument('--port', type=int, default=ASGI_PORT)
+    parser.add_argument('--workers', type=int, default=ASGI_WORKERS)
+    parser.add_argument('--graceful-timeout', type=float, default=ASGI_GRACEFUL_TIMEOUT)
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+    if uvicorn is None:
+        parser.error("serving over ASGI needs uvicorn (pip install uvicorn)")
+
+    logger.info(f"Starting {args.workers} ASGI workers on {args.host}:{args.port}")
+    uvicorn.run(
+        "asgi:application",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan="on",
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=ASGI_KEEPALIVE,
+        backlog=2048,
+        access_log=False,
+        log_level=args.log_level
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import sqlite3
+import queue
+import threading
+import time
+import logging
+import os
+from contextlib import contextmanager
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DB_PATH = "moodcast.db"
+
+# Connection tuning (overridable from the environment)
+DB_SYNCHRONOUS = os.getenv("MOODCAST_DB_SYNCHRONOUS", "NORMAL").upper()     # NORMAL is durable enough under WAL
+DB_BUSY_TIMEOUT = int(os.getenv("MOODCAST_DB_BUSY_TIMEOUT", "5000"))         # ms to wait on a locked database
+DB_MMAP_SIZE = int(os.getenv("MOODCAST_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("MOODCAST_DB_STATEMENT_CACHE", "256"))   # prepared statements kept per connection
+READ_POOL_SIZE = int(os.getenv("MOODCAST_DB_READ_POOL_SIZE", "8"))
+READ_POOL_TIMEOUT = float(os.getenv("MOODCAST_DB_READ_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+def configure(conn, readonly=False):
+    """Apply the shared pragmas to a connection.
+
+    journal_mode is persistent in the database file, so only writer
+    connections set it; readers just pick it up. Under WAL readers and the
+    writer no longer block each other.
+    """
+    if DB_SYNCHRONOUS not in SYNCHRONOUS_MODES:
+        raise ValueError(f"MOODCAST_DB_SYNCHRONOUS must be one of {SYNCHRONOUS_MODES}")
+    # PRAGMA does not accept bound parameters
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT)}")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        if mode.lower() != 'wal':
+            logger.warning(f"Could not switch database to WAL, journal_mode is {mode}")
+    conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    return conn
+
+def connect(db_path=DB_PATH, readonly=False, **kwargs):
+    """Open a configured connection; readonly ones refuse writes (query_only)."""
+    kwargs.setdefault('cached_statements', DB_STATEMENT_CACHE)
+    kwargs.setdefault('timeout', DB_BUSY_TIMEOUT / 1000)
+    conn = sqlite3.connect(db_path, **kwargs)
+    try:
+        return configure(conn, readonly)
+    except Exception:
+        conn.close()
+        raise
+
+def writer_connection(db_path=DB_PATH):
+    """The connection for a process's single writer (autocommit; it issues BEGIN/COMMIT itself)."""
+    return connect(db_path, isolation_level=None)
+
+class ReadPool:
+    """Thread-safe pool of read-only connections.
+
+    Connections are opened on demand up to size and reused, so each keeps
+    its prepared-statement cache warm across requests. acquire() waits up
+    to timeout seconds when all are checked out and then raises
+    sqlite3.OperationalError, which callers already handle as a database
+    error.
+    """
+
+    def __init__(self, db_path=DB_PATH, size=READ_POOL_SIZE, timeout=READ_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # most recently used first: its pages are hot
+        self._lock = threading.Lock()
+        self._open = 0
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+            'timeouts': 0,
+            'opened': 0,
+            'discarded': 0
+        }
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open_or_wait()
+        with self._lock:
+            self._stats['checkouts'] += 1
+        return conn
+
+    def _open_or_wait(self):
+        with self._lock:
+            grow = self._open < self.size
+            if grow:
+                self._open += 1
+        if grow:
+            try:
+                conn = connect(self.db_path, readonly=True, check_same_thread=False)
+            except Exception:
+                with self._lock:
+                    self._open -= 1
+                raise
+            with self._lock:
+                self._stats['opened'] += 1
+            return conn
+
+        started = time.monotonic()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise sqlite3.OperationalError(f"No read connection free after {self.timeout}s")
+        waited = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._stats['waits'] += 1
+            self._stats['wait_ms'] += waited
+            self._stats['max_wait_ms'] = max(self._stats['max_wait_ms'], waited)
+        return conn
+
+    def release(self, conn):
+        """Return a connection; one left mid-transaction is rolled back, a broken one closed."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"Discarding read connection: {e}")
+            conn.close()
+            with self._lock:
+                self._open -= 1
+                self._stats['discarded'] += 1
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close the idle connections (call once requests have stopped)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        stats['avg_wait_ms'] = round(stats['wait_ms'] / stats['waits'], 3) if stats['waits'] else 0.0
+        stats['wait_ms'] = round(stats['wait_ms'], 3)
+        stats['max_wait_ms'] = round(stats['max_wait_ms'], 3)
+        stats['statement_cache'] = DB_STATEMENT_CACHE
+        return stats
@@ -0,0 +1,248 @@
+import paho.mqtt.client as mqtt
+import threading
+import json
+import struct
+import logging
+import os
+from collections import deque
+import payloads
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MQTT_BROKER = "localhost"
+MQTT_PORT = 1883
+CLIENT_ID = "moodcast_stream_hub"
+
+# Topic prefix -> SSE event name
+STREAM_TOPICS = {
+    "moodcast/sensor/": "sensor",
+    "moodcast/forecast/": "forecast",
+    "moodcast/alert/": "alert"
+}
+
+CHANNEL_SIZE = 256      # frames kept per channel ring; a reader further behind loses frames
+MAX_DROPPED = 1024      # a client that has lost this many frames is disconnected
+HEARTBEAT_INTERVAL = 15 # seconds between keep-alive comments on idle streams
+
+def sse_frame(event, data):
+    """Encode one Server-Sent Events frame; data may span several lines."""
+    lines = ''.join(f"data: {line}\n" for line in data.splitlines() or [''])
+    return f"event: {event}\n{lines}\n".encode()
+
+class Channel:
+    """Bounded broadcast ring shared by every reader of one city (or of all cities).
+
+    Publishing appends once and wakes the readers, so its cost does not grow
+    with the number of subscribers. Each reader keeps its own cursor; when it
+    falls more than the ring size behind, the overwritten frames count as
+    dropped for that reader only. Every entry also carries how many frames
+    its city has had so far, so a reader filtering on cities can tell which
+    of its own cities' frames it lost.
+    """
+
+    def __init__(self, size=CHANNEL_SIZE):
+        self._cond = threading.Condition()
+        self._frames = deque(maxlen=size)
+        self._next_seq = 0
+        self._city_counts = {}
+
+    @property
+    def next_seq(self):
+        return self._next_seq
+
+    def position(self, cities=()):
+        """Return (next_seq, {city: frames so far}) at one instant, for a new reader's cursor."""
+        with self._cond:
+            return self._next_seq, {city: self._city_counts.get(city, 0) for city in cities}
+
+    def append(self, city, frame):
+        with self._cond:
+            count = self._city_counts[city] = self._city_counts.get(city, 0) + 1
+            self._frames.append((city, frame, count))
+            self._next_seq += 1
+            self._cond.notify_all()
+
+    def read(self, cursor, timeout):
+        """Return (entries, new_cursor, lost) for everything after cursor, waiting up to timeout.
+
+        entries are (city, frame, city_count); lost counts overwritten frames of every city.
+        """
+        with self._cond:
+            if cursor >= self._next_seq:
+                self._cond.wait(timeout)
+            oldest = self._next_seq - len(self._frames)
+            lost = max(0, oldest - cursor)
+            start = max(cursor, oldest) - oldest
+            entries = [self._frames[i] for i in range(start, len(self._frames))]
+            return entries, self._next_seq, lost
+
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+class Subscription:
+    """One streaming client's cursor into a channel.
+
+    A client that reads slower than frames arrive skips the frames the ring
+    has overwritten, and after MAX_DROPPED lost frames it is closed, so a
+    slow client never holds memory or delays anyone else.
+    """
+
+    def __init__(self, channel, cities, max_dropped=MAX_DROPPED):
+        self.channel = channel
+        self.cities = cities
+        self.max_dropped = max_dropped
+        self.dropped = 0
+        self.closed = False
+        # Frames seen per city, so only lost frames of our own cities count as dropped
+        self._cursor, self._seen = channel.position(cities or ())
+
+    def get(self, timeout=HEARTBEAT_INTERVAL):
+        """Return the frames published since the last call (empty after timeout)."""
+        if self.closed:
+            return []
+        entries, self._cursor, lost = self.channel.read(self._cursor, timeout)
+        if self.cities is None:
+            frames = [frame for _, frame, _ in entries]
+        else:
+            frames = []
+            lost = 0
+            for city, frame, count in entries:
+                if city in self.cities:
+                    lost += count - self._seen[city] - 1
+                    self._seen[city] = count
+                    frames.append(frame)
+        if lost:
+            self.dropped += lost
+            if self.dropped >= self.max_dropped:
+                self.closed = True
+                return []
+        return frames
+
+    def backlog(self):
+        return self.channel.next_seq - self._cursor
+
+    def close(self):
+        self.closed = True
+        self.channel.wake()
+
+class StreamHub:
+    """One shared MQTT subscriber fanning messages out to streaming clients.
+
+    Frames are encoded once per MQTT message and appended to that city's
+    channel and to the all-cities channel; single-city clients read the
+    former and everyone else reads the latter with a city filter. The
+    broker sees a single connection however many clients are attached.
+    """
+
+    def __init__(self, broker=MQTT_BROKER, port=MQTT_PORT):
+        self.broker = broker
+        self.port = port
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._all_cities = Channel()
+        self._subscriptions = set()
+        self._client = None
+        self._counters = {'messages': 0, 'disconnected_slow': 0}
+
+    def start(self):
+        """Connect the shared MQTT subscriber (idempotent, reconnects in the background)."""
+        with self._lock:
+            if self._client:
+                return
+            client = mqtt.Client(
+                client_id=f"{CLIENT_ID}_{os.getpid()}",
+                callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                protocol=mqtt.MQTTv5
+            )
+            client.on_connect = self._on_connect
+            client.on_message = self._on_message
+            client.reconnect_delay_set(min_delay=1, max_delay=30)
+            self._client = client
+        try:
+            client.connect_async(self.broker, self.port, keepalive=60)
+            client.loop_start()
+            logger.info(f"Stream hub connecting to MQTT broker at {self.broker}:{self.port}")
+        except Exception as e:
+            logger.error(f"Stream hub failed to start MQTT client: {e}")
+
+    def stop(self):
+        with self._lock:
+            client, self._client = self._client, None
+            subscriptions = list(self._subscriptions)
+        if client:
+            client.loop_stop()
+            client.disconnect()
+        for subscription in subscriptions:
+            subscription.close()
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code.is_failure:
+            logger.error(f"Stream hub failed to connect to MQTT broker with code {reason_code}")
+            return
+        for prefix in STREAM_TOPICS:
+            client.subscribe(f"{prefix}#", qos=0)
+        logger.info("Stream hub subscribed to sensor, forecast and alert topics")
+
+    def _on_message(self, client, userdata, msg):
+        for prefix, event in STREAM_TOPICS.items():
+            if msg.topic.startswith(prefix):
+                city = msg.topic[len(prefix):].split('/')[0]
+                try:
+                    if payloads.is_json(msg.properties):
+                        data = msg.payload.decode()
+                    else:
+                        # Binary payloads are re-encoded once so SSE clients always get JSON
+                        data = json.dumps(payloads.decode(msg.payload, msg.properties))
+                except (UnicodeDecodeError, ValueError, IndexError, struct.error):
+                    logger.error(f"Stream hub dropped undecodable payload on {msg.topic}")
+                    return
+                self.publish(city, event, data)
+                return
+
+    def publish(self, city, event, data):
+        """Fan one message out to every subscription for city."""
+        frame = sse_frame(event, data)
+        with self._lock:
+            channel = self._channels.get(city)
+            self._counters['messages'] += 1
+        if channel:
+            channel.append(city, frame)
+        self._all_cities.append(city, frame)
+
+    def subscribe(self, cities=None):
+        """Register a client for a set of cities (None for all) and return its Subscription."""
+        cities = frozenset(cities) if cities else None
+        with self._lock:
+            if cities and len(cities) == 1:
+                (city,) = cities
+                channel = self._channels.get(city)
+                if channel is None:
+                    channel = self._channels[city] = Channel()
+            else:
+                channel = self._all_cities
+            subscription = Subscription(channel, cities)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        slow = subscription.closed and subscription.dropped >= subscription.max_dropped
+        subscription.close()
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.discard(subscription)
+                if slow:
+                    self._counters['disconnected_slow'] += 1
+
+    def stats(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            snapshot = dict(self._counters)
+            snapshot['channels'] = len(self._channels) + 1
+        snapshot['subscribers'] = len(subscriptions)
+        snapshot['max_backlog'] = max((s.backlog() for s in subscriptions), default=0)
+        snapshot['dropped_frames'] = sum(s.dropped for s in subscriptions)
+        snapshot['connected'] = bool(self._client and self._client.is_connected())
+        return snapshot
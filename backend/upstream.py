@@ -0,0 +1,201 @@
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import time
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+
+# Setup logging
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Upstream fetch tuning (overridable from the environment)
+FETCH_CACHE_TTL = float(os.getenv("MOODCAST_FETCH_CACHE_TTL", "60"))          # seconds, when upstream sends no max-age
+FETCH_CACHE_MAX_TTL = float(os.getenv("MOODCAST_FETCH_CACHE_MAX_TTL", "900"))  # cap on upstream max-age/Expires
+FETCH_CACHE_SIZE = int(os.getenv("MOODCAST_FETCH_CACHE_SIZE", "1024"))         # cached responses kept (LRU)
+FETCH_POOL_SIZE = int(os.getenv("MOODCAST_FETCH_POOL_SIZE", "16"))             # keep-alive connections per host
+FETCH_TIMEOUT = float(os.getenv("MOODCAST_FETCH_TIMEOUT", "10"))
+# Decimal places coordinates are rounded to before they reach the upstream
+# request, so sensors in the same ~1 km cell share one cached response
+COORD_PRECISION = int(os.getenv("MOODCAST_COORD_PRECISION", "2"))
+
+def round_coord(value, precision=COORD_PRECISION):
+    return round(float(value), precision)
+
+def make_session(pool_size=FETCH_POOL_SIZE):
+    """requests.Session with a keep-alive pool of pool_size connections per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def freshness(headers, default_ttl=FETCH_CACHE_TTL, max_ttl=FETCH_CACHE_MAX_TTL, now=None):
+    """(store, ttl seconds) for a response from its Cache-Control / Expires / Age headers."""
+    directives = {}
+    for part in headers.get('Cache-Control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives:
+        return False, 0.0
+    if 'no-cache' in directives:
+        # Stored only for its validators: every use revalidates
+        return True, 0.0
+    ttl = None
+    for name in ('s-maxage', 'max-age'):
+        try:
+            ttl = float(directives[name])
+            break
+        except (KeyError, ValueError):
+            continue
+    if ttl is None and headers.get('Expires'):
+        try:
+            ttl = parsedate_to_datetime(headers['Expires']).timestamp() - (now or time.time())
+        except (TypeError, ValueError):
+            ttl = 0.0
+    if ttl is None:
+        return True, default_ttl
+    try:
+        ttl -= float(headers.get('Age', 0))
+    except ValueError:
+        pass
+    return True, min(max(ttl, 0.0), max_ttl)
+
+class _Entry:
+    __slots__ = ('data', 'expires', 'etag', 'last_modified')
+
+    def __init__(self, data, expires, etag, last_modified):
+        self.data = data
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+
+class UpstreamClient:
+    """Shared JSON fetch layer for the upstream weather APIs.
+
+    Requests go through one pooled requests.Session. Responses are cached
+    in memory for as long as the upstream Cache-Control / Expires headers
+    allow (FETCH_CACHE_TTL when they say nothing); expired entries that
+    carry an ETag or Last-Modified are revalidated with a conditional
+    request, so an unchanged upstream answers 304 without a body.
+    Concurrent requests for the same URL and params share one upstream
+    call.
+    """
+
+    def __init__(self, session=None, max_entries=FETCH_CACHE_SIZE, default_ttl=FETCH_CACHE_TTL,
+                 max_ttl=FETCH_CACHE_MAX_TTL, timeout=FETCH_TIMEOUT):
+        self.session = session or make_session()
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        self.timeout = timeout
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'hits': 0, 'coalesced': 0, 'upstream': 0,
+                       'not_modified': 0, 'errors': 0, 'total_upstream_s': 0.0}
+
+    @staticmethod
+    def cache_key(url, params):
+        return url, tuple(sorted((params or {}).items()))
+
+    def get_json(self, url, params=None, session=None):
+        """Return the decoded JSON body for url and params, from cache when still fresh.
+
+        session overrides the client's own for the upstream request (e.g.
+        a caller's pool). Raises requests.RequestException on failure.
+        """
+        key = self.cache_key(url, params)
+        with self._lock:
+            self._stats['requests'] += 1
+            entry = self._cache.get(key)
+            if entry is not None and entry.expires > time.monotonic():
+                self._cache.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry.data
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self._stats['coalesced'] += 1
+        if not leader:
+            return future.result()
+        try:
+            data = self._fetch(key, url, params, entry, session or self.session)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
+            return data
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _fetch(self, key, url, params, entry, session):
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        started = time.monotonic()
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=self.timeout)
+            if response.status_code != 304 or entry is None:
+                response.raise_for_status()
+        except requests.RequestException:
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._stats['upstream'] += 1
+                self._stats['total_upstream_s'] += time.monotonic() - started
+
+        store, ttl = freshness(response.headers, self.default_ttl, self.max_ttl)
+        if response.status_code == 304:
+            data = entry.data
+            with self._lock:
+                self._stats['not_modified'] += 1
+        else:
+            data = response.json()
+            entry = _Entry(data, 0.0, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        if store:
+            entry.expires = time.monotonic() + ttl
+            with self._lock:
+                self._cache[key] = entry
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """Snapshot of request, cache hit and upstream call counters."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['entries'] = len(self._cache)
+        total = snapshot.pop('total_upstream_s')
+        snapshot['avg_upstream_ms'] = round(total / snapshot['upstream'] * 1000, 1) if snapshot['upstream'] else 0.0
+        snapshot['hit_ratio'] = round(snapshot['hits'] / snapshot['requests'], 3) if snapshot['requests'] else 0.0
+        return snapshot
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Process-wide UpstreamClient, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = UpstreamClient()
+        return _client
@@ -103,55 +103,44 @@ function App() {
     async function fetchData() {
       setError(null);
       try {
-        // Fetch current weather
-        const weatherResponse = await axios.get(
-          `http://localhost:5000/weather?lat=${selectedCity.lat}&lon=${selectedCity.lon}`
-        );
-        console.log("Weather API Response:", weatherResponse.data);
-        if (weatherResponse.data && weatherResponse.data.city) {
-          setWeatherData(weatherResponse.data);
+        // Weather, forecast, IoT status, all nodes and alerts in one request
+        const batchResponse = await axios.get("http://localhost:5000/batch", {
+          params: {
+            lat: selectedCity.lat,
+            lon: selectedCity.lon,
+            fields: "weather,forecast,status,alerts,nodes",
+          },
+        });
+        console.log("Batch API Response:", batchResponse.data);
+        // Keyed by the station nearest the selected coordinates
+        const cityData = Object.values(batchResponse.data.cities)[0] || {};
+
+        if (cityData.weather && cityData.weather.city) {
+          setWeatherData(cityData.weather);
         } else {
           setError("No valid weather data returned");
         }
 
-        // Fetch 48-hour forecast
-        const forecastResponse = await axios.get(
-          `http://localhost:5000/forecast?lat=${selectedCity.lat}&lon=${selectedCity.lon}`
-        );
-        console.log("Forecast API Response:", forecastResponse.data);
+        // Keep the next 48 hours of forecast
+        const forecast = cityData.forecast || {};
         const now = new Date();
         const fortyEightHoursLater = new Date(
           now.getTime() + 48 * 60 * 60 * 1000
         );
         const filteredForecast = {
-          api: (forecastResponse.data.api || []).filter(
+          api: (forecast.api || []).filter(
             (f) => new Date(f.timestamp) <= fortyEightHoursLater
           ),
-          model: (forecastResponse.data.model || []).filter(
+          model: (forecast.model || []).filter(
             (f) => new Date(f.timestamp) <= fortyEightHoursLater
           ),
         };
         setForecastData(filteredForecast);
         console.log("Filtered Forecast Data:", filteredForecast);
 
-        // Fetch IoT status for selected city
-        const statusResponse = await axios.get(
-          `http://localhost:5000/status?city=${selectedCity.name}`
-        );
-        console.log("Status API Response:", statusResponse.data);
-        setStatusData(statusResponse.data || null);
-
-        // Fetch all IoT nodes
-        const nodesResponse = await axios.get("http://localhost:5000/nodes");
-        console.log("Nodes API Response:", nodesResponse.data);
-        setNetworkData(nodesResponse.data || []);
-
-        // Fetch alerts
-        const alertsResponse = await axios.get(
-          `http://localhost:5000/alerts?city=${selectedCity.name}`
-        );
-        console.log("Alerts API Response:", alertsResponse.data);
-        setAlerts(alertsResponse.data.slice(-5)); // Keep last 5 alerts
+        setStatusData(cityData.status || null);
+        setNetworkData(batchResponse.data.nodes || []);
+        setAlerts((cityData.alerts || []).slice(0, 5)); // Newest first: keep the latest 5
       } catch (error) {
         console.error("Error fetching data:", error);
         setError(`Failed to fetch data: ${error.message}`);
@@ -159,19 +148,42 @@ function App() {
     }
     fetchData();
 
-    // Poll alerts every 60 seconds
-    const alertInterval = setInterval(async () => {
-      try {
-        const alertsResponse = await axios.get(
-          `http://localhost:5000/alerts?city=${selectedCity.name}`
-        );
-        setAlerts(alertsResponse.data.slice(-5));
-      } catch (error) {
-        console.error("Error fetching alerts:", error);
-      }
-    }, 60000);
+    // Live sensor readings and alerts pushed by the API (replaces polling)
+    const stream = new EventSource(
+      `http://localhost:5000/stream?city=${encodeURIComponent(selectedCity.name)}`
+    );
+    stream.addEventListener("alert", (event) => {
+      const alert = JSON.parse(event.data);
+      setAlerts((prev) => [alert, ...prev].slice(0, 5));
+    });
+    stream.addEventListener("sensor", (event) => {
+      const reading = JSON.parse(event.data);
+      if (!["openweathermap", "openmeteo"].includes(reading.source)) return;
+      setWeatherData((prev) =>
+        prev && prev.city === reading.city
+          ? {
+              ...prev,
+              weather: {
+                temp: reading.temp,
+                humidity: reading.humidity,
+                pressure: reading.pressure,
+                wind_speed: reading.wind_speed,
+                clouds: reading.clouds,
+                rain: reading.rain,
+              },
+              timestamp: reading.timestamp,
+              source: reading.source,
+              mood_score: reading.mood_score,
+            }
+          : prev
+      );
+    });
+    stream.onerror = (error) => {
+      // EventSource reconnects on its own
+      console.error("Stream error:", error);
+    };
 
-    return () => clearInterval(alertInterval);
+    return () => stream.close();
   }, [selectedCity]);
 
   // Determine weather condition